@@ -7,7 +7,17 @@
 # ###
 """\
 Authentication and authorization policies for the publication application.
+
+API keys are looked up by their (indexed) hash. Each web process keeps the
+recently used keys, and the keys found not to exist, in an LRU cache,
+which is cleared when the database notifies the 'api_keys' channel that
+the keys have changed (see `cnxpublishing.longpoll`).
+
+The principals are resolved once per request, because pyramid asks the
+policies for them on each permission check.
 """
+import hashlib
+
 from openstax_accounts.interfaces import IOpenstaxAccountsAuthenticationPolicy
 from pyramid import security
 from pyramid.authorization import ACLAuthorizationPolicy
@@ -15,25 +25,58 @@ from pyramid.interfaces import IAuthenticationPolicy
 from pyramid_multiauth import MultiAuthenticationPolicy
 from zope.interface import implementer
 
+from cnxpublishing.cache import LRUCache
 from cnxpublishing.db import db_connect
-from cnxpublishing.cache import cache_manager
+from cnxpublishing.longpoll import get_state_change_listener
+
+
+KEY_INFO_SQL_STMT = """\
+SELECT id, name, groups FROM api_keys WHERE key_hash = %s AND key = %s"""
+
+#: Channel notified when the api keys change
+API_KEYS_CHANNEL = 'api_keys'
+#: Maximum number of api keys cached by each process
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+#: Seconds an api key is cached, in case a change notification is missed
+DEFAULT_CACHE_MAX_AGE = 60 * 60
+
+# The api key information (or None for unknown keys), by key hash
+api_key_cache = LRUCache(DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_AGE)
+
+# Request attribute the requesting party is memoized in
+_REQUESTING_PARTY_ATTR = '_cnxpublishing_api_key_party'
+# Request attribute the resolved principals are memoized in
+_PRINCIPALS_ATTR = '_cnxpublishing_principals'
 
 
-ALL_KEY_INFO_SQL_STMT = "SELECT id, key, name, groups FROM api_keys"
+def hash_api_key(api_key):
+    """Returns the hash the api key is indexed by."""
+    if not isinstance(api_key, bytes):
+        api_key = api_key.encode('utf-8')
+    return hashlib.sha1(api_key).hexdigest()
 
 
-@cache_manager.cache(expire=60 * 60 * 24)  # cache for one day
-def lookup_api_key_info():
-    """Given a dbapi cursor, lookup all the api keys and their information."""
-    info = {}
+def lookup_api_key_info(api_key):
+    """Lookup the information about the given api key.
+    Returns None when the key doesn't exist.
+
+    """
+    key_hash = hash_api_key(api_key)
+    try:
+        return api_key_cache.get(key_hash)
+    except KeyError:
+        pass
+    generation = api_key_cache.generation
     with db_connect() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(ALL_KEY_INFO_SQL_STMT)
-            for row in cursor.fetchall():
-                id, key, name, groups = row
-                user_id = "api_key:{}".format(id)
-                info[key] = dict(id=id, user_id=user_id,
-                                 name=name, groups=groups)
+            cursor.execute(KEY_INFO_SQL_STMT, (key_hash, api_key,))
+            row = cursor.fetchone()
+    info = None
+    if row is not None:
+        id, name, groups = row
+        user_id = "api_key:{}".format(id)
+        info = dict(id=id, user_id=user_id, name=name, groups=groups)
+    api_key_cache.set(key_hash, info, generation)
     return info
 
 
@@ -41,23 +84,26 @@ def lookup_api_key_info():
 class APIKeyAuthenticationPolicy(object):
     """Authentication using preconfigured API keys"""
 
-    @property
-    def user_info_by_key(self):
-        return lookup_api_key_info()
-
     def _discover_requesting_party(self, request):
         """With the request object, discover who is making the request.
         Returns both the api-key and the principal-id
+        (which are looked up once per request).
         """
+        party = getattr(request, _REQUESTING_PARTY_ATTR, None)
+        if party is not None:
+            return party
         user_id = None
+        principal_info = None
         api_key = request.headers.get('x-api-key', None)
-        try:
-            principal_info = self.user_info_by_key[api_key]
-        except KeyError:
-            principal_info = None
+        if api_key is not None:
+            # Listen for the changes that invalidate the cached keys.
+            get_state_change_listener(request.registry).start()
+            principal_info = lookup_api_key_info(api_key)
         if principal_info is not None:
             user_id = principal_info['user_id']
-        return api_key, user_id, principal_info
+        party = (api_key, user_id, principal_info)
+        setattr(request, _REQUESTING_PARTY_ATTR, party)
+        return party
 
     def authenticated_userid(self, request):
         api_key, user_id, _ = self._discover_requesting_party(request)
@@ -90,8 +136,59 @@ class APIKeyAuthenticationPolicy(object):
         return []  # No need to forget when everything is already forgotten.
 
 
+class MemoizingMultiAuthenticationPolicy(MultiAuthenticationPolicy):
+    """Stacked authentication (see `MultiAuthenticationPolicy`) that
+    resolves the userids and principals once per request.
+
+    """
+
+    def _memoized(self, name, request):
+        memo = getattr(request, _PRINCIPALS_ATTR, None)
+        if memo is None:
+            memo = {}
+            setattr(request, _PRINCIPALS_ATTR, memo)
+        try:
+            return memo[name]
+        except KeyError:
+            method = getattr(super(MemoizingMultiAuthenticationPolicy, self),
+                             name)
+            value = memo[name] = method(request)
+            return value
+
+    def _forget_memoized(self, request):
+        setattr(request, _PRINCIPALS_ATTR, None)
+
+    def authenticated_userid(self, request):
+        return self._memoized('authenticated_userid', request)
+
+    def unauthenticated_userid(self, request):
+        return self._memoized('unauthenticated_userid', request)
+
+    def effective_principals(self, request):
+        return list(self._memoized('effective_principals', request))
+
+    def remember(self, request, principal, **kw):
+        self._forget_memoized(request)
+        return super(MemoizingMultiAuthenticationPolicy, self).remember(
+            request, principal, **kw)
+
+    def forget(self, request):
+        self._forget_memoized(request)
+        return super(MemoizingMultiAuthenticationPolicy, self).forget(
+            request)
+
+
 def includeme(config):
     """Configuration include fuction for this module"""
+    global api_key_cache
+    settings = config.registry.settings
+    api_key_cache = LRUCache(
+        int(settings.get('api_keys.cache.max_entries',
+                         DEFAULT_CACHE_MAX_ENTRIES)),
+        int(settings.get('api_keys.cache.max_age', DEFAULT_CACHE_MAX_AGE)))
+    get_state_change_listener(config.registry).add_callback(
+        API_KEYS_CHANNEL, api_key_cache.clear)
+
     api_key_authn_policy = APIKeyAuthenticationPolicy()
     config.include('openstax_accounts')
     openstax_authn_policy = config.registry.getUtility(
@@ -99,7 +196,7 @@ def includeme(config):
 
     # Set up api & user authentication policies.
     policies = [api_key_authn_policy, openstax_authn_policy]
-    authn_policy = MultiAuthenticationPolicy(policies)
+    authn_policy = MemoizingMultiAuthenticationPolicy(policies)
     config.set_authentication_policy(authn_policy)
 
     # Set up the authorization policy.
@@ -109,5 +206,7 @@ def includeme(config):
 
 __all__ = (
     'APIKeyAuthenticationPolicy',
+    'hash_api_key',
     'lookup_api_key_info',
+    'MemoizingMultiAuthenticationPolicy',
 )
@@ -6,15 +6,38 @@
 # See LICENCE.txt for details.
 # ###
 """Provides a means of baking a binder and persisting it to the archive."""
+import hashlib
+import io
+import json
+import logging
+
 import cnxepub
-import memcache
-from cnxepub.collation import collate as collate_models
-from cnxepub.formatters import exercise_callback_factory
+from cnxepub.collation import collate as collate_models, reconstitute
+from cnxepub.formatters import exercise_callback_factory, SingleHTMLFormatter
 from pyramid.threadlocal import get_current_registry
 from pyramid.settings import aslist
+from repoze.lru import LRUCache
 
-from .db import with_db_cursor
+from .db import (
+    db_connect,
+    get_bake_checkpoint,
+    remove_bake_checkpoints,
+    save_bake_checkpoint,
+    with_db_cursor,
+)
+from .exercises import (
+    DEFAULT_PREFETCH_BATCH_SIZE,
+    DEFAULT_PREFETCH_CONCURRENCY,
+    find_exercise_codes,
+    get_exercise_cache,
+    is_exercise_cached,
+    prefetch_exercises,
+)
+from .exceptions import BakeMemoryExceeded
+from .instrumentation import BakeStats, current_rss
 from .publish import (
+    add_collated_file,
+    associate_collated_file,
     publish_collated_document,
     publish_collated_tree,
     publish_composite_model,
@@ -22,89 +45,566 @@ from .publish import (
 from .utils import amend_tree_with_slugs
 
 
-def _formatter_callback_factory():  # pragma: no cover
-    """Returns a list of includes to be given to `cnxepub.collation.collate`.
+logger = logging.getLogger('cnxpublishing')
+
+#: Checkpoint stage holding the collated book as single html
+COLLATED = 'collate'
+#: Checkpoint stage holding the ids of the written page files, by ident_hash
+WRITTEN = 'pages'
+DEFAULT_CHECKPOINT_MAX_AGE = 24 * 60 * 60  # one day
+#: Number of pages written between the saves of the written pages
+DEFAULT_CHECKPOINT_BATCH_SIZE = 20
+
+
+class BakeCheckpoints(object):
+    """Saves and loads the intermediate results of baking a book
+    (by ``module_ident``), so that a retried bake can resume from the
+    last completed stage. Checkpoints older than ``max_age`` seconds are
+    ignored, because they may contain outdated exercises.
+
+    Checkpoints are saved on their own connection, so that they are kept
+    when the baking transaction is rolled back. They are removed within
+    the baking transaction, which keeps the completion of a bake atomic.
+
+    The files of the written pages are also committed (spilled) on their
+    own connection, ``batch_size`` pages at a time together with their
+    ids, so a retry only associates the pages written by an earlier
+    attempt.
+
+    """
+
+    def __init__(self, module_ident, max_age=DEFAULT_CHECKPOINT_MAX_AGE,
+                 batch_size=DEFAULT_CHECKPOINT_BATCH_SIZE):
+        self.module_ident = module_ident
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self._artifacts = {}
+        # The written page file ids by ident_hash, by recipe_id
+        self._written = {}
+        # The (recipe_id, model, html) of the pages waiting to be spilled
+        self._unspilled = []
+        #: The stages saved by this instance, as (recipe_id, stage) tuples
+        self.saved = []
+
+    @classmethod
+    def from_settings(cls, module_ident, settings=None):
+        if settings is None:
+            settings = get_current_registry().settings
+        max_age = int(settings.get('baking.checkpoint.max_age',
+                                   DEFAULT_CHECKPOINT_MAX_AGE))
+        batch_size = int(settings.get('baking.checkpoint.batch_size',
+                                      DEFAULT_CHECKPOINT_BATCH_SIZE))
+        return cls(module_ident, max_age=max_age, batch_size=batch_size)
+
+    def load(self, recipe_id, stage, cursor):
+        """Returns the artifact saved for ``stage`` or None."""
+        key = (recipe_id, stage,)
+        if key not in self._artifacts:
+            self._artifacts[key] = get_bake_checkpoint(
+                cursor, self.module_ident, recipe_id, stage, self.max_age)
+        return self._artifacts[key]
+
+    def save(self, recipe_id, stage, artifact):
+        """Save (and commit) the ``artifact`` of the completed ``stage``."""
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                self._save(recipe_id, stage, artifact, cursor)
+
+    def _save(self, recipe_id, stage, artifact, cursor):
+        save_bake_checkpoint(cursor, self.module_ident, recipe_id,
+                             stage, artifact)
+        self._artifacts[(recipe_id, stage,)] = artifact
+        self.saved.append((recipe_id, stage,))
+
+    def _get_written(self, recipe_id, cursor):
+        if recipe_id not in self._written:
+            artifact = self.load(recipe_id, WRITTEN, cursor)
+            self._written[recipe_id] = artifact and json.loads(artifact) or {}
+        return self._written[recipe_id]
+
+    def get_written(self, recipe_id, ident_hash, cursor):
+        """Returns the id of the file written for the page (by
+        ``ident_hash``) by an earlier attempt, locked for the transaction
+        of ``cursor``, or None.
+
+        """
+        fileid = self._get_written(recipe_id, cursor).get(ident_hash)
+        if fileid is None:
+            return None
+        # The file may have been collected as an orphan since.
+        cursor.execute("SELECT fileid FROM files WHERE fileid = %s "
+                       "FOR KEY SHARE", (fileid,))
+        return cursor.fetchone() and fileid or None
+
+    def spill(self, recipe_id, model, html, cursor):
+        """Queue the ``html`` file of the page ``model`` to be spilled.
+        Once ``batch_size`` pages are queued, they are spilled
+        (see `flush`) and returned as a list of (model, html) tuples.
+
+        """
+        self._get_written(recipe_id, cursor)
+        self._unspilled.append((recipe_id, model, html,))
+        if len(self._unspilled) < self.batch_size:
+            return []
+        return self.flush()
+
+    def flush(self):
+        """Commit the files of the queued pages and save the written pages
+        in one transaction. Returns the spilled pages as a list of
+        (model, html) tuples.
+
+        """
+        if not self._unspilled:
+            return []
+        spilled = []
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                for recipe_id, model, html in self._unspilled:
+                    fileid = add_collated_file(cursor, html)
+                    self._written[recipe_id][model.ident_hash] = fileid
+                    spilled.append((model, html,))
+                for recipe_id in set([x[0] for x in self._unspilled]):
+                    self._save(recipe_id, WRITTEN,
+                               json.dumps(self._written[recipe_id]), cursor)
+        self._unspilled = []
+        return spilled
+
+    def clear(self, cursor):
+        """Remove the checkpoints as part of the transaction of ``cursor``.
+        """
+        remove_bake_checkpoints(cursor, self.module_ident)
+        self._artifacts = {}
+        self._written = {}
+        self._unspilled = []
+
+
+def _exercise_embeds(settings):
+    """Returns a list of (match, url_template) tuples for the configured
+    exercise embeds.
 
     """
-    includes = []
     exercise_url_template = '{baseUrl}/api/exercises?q={field}:"{{itemCode}}"'
-    settings = get_current_registry().settings
     exercise_base_url = settings.get('embeddables.exercise.base_url', None)
     exercise_matches = [match.split(',', 1) for match in aslist(
         settings.get('embeddables.exercise.match', ''), flatten=False)]
+    if not exercise_base_url:
+        return []
+    return [(exercise_match,
+             exercise_url_template.format(baseUrl=exercise_base_url,
+                                          field=exercise_field))
+            for (exercise_match, exercise_field) in exercise_matches]
+
+
+def _formatter_callback_factory():  # pragma: no cover
+    """Returns a list of includes to be given to `cnxepub.collation.collate`.
+
+    """
+    includes = []
+    settings = get_current_registry().settings
     exercise_token = settings.get('embeddables.exercise.token', None)
     mathml_url = settings.get('mathmlcloud.url', None)
-    memcache_servers = settings.get('memcache_servers')
-    if memcache_servers:
-        memcache_servers = memcache_servers.split()
-    else:
-        memcache_servers = None
-
-    if exercise_base_url and exercise_matches:
-        mc_client = None
-        if memcache_servers:
-            mc_client = memcache.Client(memcache_servers, debug=0)
-        for (exercise_match, exercise_field) in exercise_matches:
-            template = exercise_url_template.format(
-                baseUrl=exercise_base_url, field=exercise_field)
+
+    exercise_embeds = _exercise_embeds(settings)
+    if exercise_embeds:
+        # The cache is given in place of a memcache client.
+        cache = get_exercise_cache()
+        for (exercise_match, template) in exercise_embeds:
             includes.append(exercise_callback_factory(exercise_match,
                                                       template,
-                                                      mc_client,
+                                                      cache,
                                                       exercise_token,
                                                       mathml_url))
     return includes
 
 
+def _exercise_fetch_check():
+    """Returns a function telling whether collation fetches the exercise
+    embedded by an element, because it isn't in the exercise cache.
+
+    """
+    settings = get_current_registry().settings
+    token = settings.get('embeddables.exercise.token', None)
+    matches = [match for match, template in _exercise_embeds(settings)]
+    cache = get_exercise_cache()
+
+    def is_fetched(elem):
+        href = elem.get('href') or ''
+        for match in matches:
+            if match in href:
+                return not is_exercise_cached(cache, href, match, token)
+        return False
+    return is_fetched
+
+
+def _prefetch_exercises(binder):
+    """Fill the exercise cache with the exercises embedded in ``binder``,
+    so that collation doesn't need to fetch them one at a time.
+    Returns the number of exercises that were fetched.
+
+    """
+    settings = get_current_registry().settings
+    embeds = []
+    for (match, template) in _exercise_embeds(settings):
+        embeds.extend([(code, template.format(itemCode=code))
+                       for code in find_exercise_codes(binder, match)])
+    if not embeds:
+        return 0
+    return prefetch_exercises(
+        get_exercise_cache(), embeds,
+        token=settings.get('embeddables.exercise.token', None),
+        concurrency=int(settings.get(
+            'embeddables.exercise.prefetch.concurrency',
+            DEFAULT_PREFETCH_CONCURRENCY)),
+        batch_size=int(settings.get(
+            'embeddables.exercise.prefetch.batch_size',
+            DEFAULT_PREFETCH_BATCH_SIZE)))
+
+
+_recipe_cache = None
+
+
+def enable_recipe_cache(max_entries):
+    """Keep up to ``max_entries`` recipes in memory for the life of the
+    process. This is used by the baking worker processes
+    (see `cnxpublishing.worker`).
+
+    """
+    global _recipe_cache
+    _recipe_cache = LRUCache(max_entries)
+
+
 def _get_recipe(recipe_id, cursor):
     """Returns recipe as a unicode string"""
+    if _recipe_cache is not None:
+        recipe = _recipe_cache.get(recipe_id)
+        if recipe is not None:
+            return recipe
 
     cursor.execute("""SELECT convert_from(file, 'utf-8') FROM files
                       WHERE fileid = %s""", (recipe_id,))
-    return cursor.fetchone()[0]
+    recipe = cursor.fetchone()[0]
+    if _recipe_cache is not None:
+        # A file's content doesn't change, so neither does the recipe.
+        _recipe_cache.put(recipe_id, recipe)
+    return recipe
+
+
+#: Memory (in kilobytes) a bake may use, 0 is unlimited
+DEFAULT_MAX_RSS = 0
+
+#: Write modes of a bake, i.e. what was written to persist the bake
+UNCHANGED = 'unchanged'  # the baked book is the same, nothing is written
+PARTIAL = 'partial'  # only the changed page contents are written
+FULL = 'full'  # the baked book is removed and written again
+
+
+def _is_composite(model):
+    return (isinstance(model, cnxepub.CompositeDocument) or
+            (isinstance(model, cnxepub.Binder) and
+             model.metadata.get('type') == 'composite-chapter'))
+
+
+def _walk(model, title=None, path=()):
+    """Yields a (path, title, model) tuple for ``model`` and each of its
+    descendants in document order, where path is the tree position.
+
+    """
+    if title is None:
+        title = model.metadata.get('title')
+    yield path, title, model
+    if hasattr(model, '__iter__'):
+        for i, node in enumerate(model):
+            for x in _walk(node, model.get_title_for_node(node), path + (i,)):
+                yield x
+
+
+def _comparable_ident_hash(model):
+    """Composites are given None, because a new ident_hash
+    is made each time they are persisted.
+
+    """
+    if _is_composite(model) or isinstance(model, cnxepub.TranslucentBinder):
+        return None
+    return model.ident_hash
+
+
+def _content_sha1(model):
+    html = bytes(cnxepub.DocumentContentFormatter(model))
+    return hashlib.new('sha1', html).hexdigest()
+
+
+def _fingerprint_baked(cursor, binder_ident_hash):
+    """Returns the currently persisted collated tree of the book as a
+    mapping of tree position (path) to a tuple of the title, comparable
+    ident_hash and content sha1 of each node.
+
+    """
+    cursor.execute("""\
+WITH RECURSIVE book AS (
+  SELECT module_ident FROM modules
+  WHERE ident_hash(uuid, major_version, minor_version) = %s
+), t(nodeid, path, title, documentid) AS (
+  SELECT tr.nodeid, ARRAY[]::integer[], tr.title, tr.documentid
+  FROM trees AS tr, book
+  WHERE tr.documentid = book.module_ident AND tr.parent_id IS NULL
+    AND tr.is_collated = TRUE
+UNION ALL
+  SELECT c.nodeid, t.path || c.childorder, c.title, c.documentid
+  FROM trees AS c JOIN t ON (c.parent_id = t.nodeid)
+)
+SELECT t.path, t.title,
+       CASE WHEN m.module_ident IS NULL
+                 OR m.portal_type IN ('CompositeModule', 'SubCollection')
+            THEN NULL
+            ELSE ident_hash(m.uuid, m.major_version, m.minor_version)
+       END,
+       f.sha1
+FROM t
+  CROSS JOIN book
+  LEFT JOIN modules AS m ON (t.documentid = m.module_ident)
+  LEFT JOIN collated_file_associations AS cfa
+    ON (cfa.context = book.module_ident AND cfa.item = t.documentid)
+  LEFT JOIN files AS f ON (cfa.fileid = f.fileid)""", (binder_ident_hash,))
+    return dict([(tuple(path), (title, ident_hash, sha1))
+                 for path, title, ident_hash, sha1 in cursor.fetchall()])
+
+
+def _has_same_structure(binder, baked):
+    """Whether the collated ``binder`` has the same tree, titles and
+    ident_hashes as the ``baked`` fingerprint (see `_fingerprint_baked`).
+
+    """
+    count = 0
+    for path, title, model in _walk(binder):
+        if path not in baked:
+            return False
+        if baked[path][:2] != (title, _comparable_ident_hash(model)):
+            return False
+        count += 1
+    return count == len(baked)
+
+
+def _check_memory(max_rss):
+    """Raises `BakeMemoryExceeded` when the process uses more than
+    ``max_rss`` kilobytes of memory. A ``max_rss`` of 0 disables the check.
+
+    """
+    if max_rss:
+        rss = current_rss()
+        if rss > max_rss:
+            raise BakeMemoryExceeded(rss, max_rss)
+
+
+def _remove_collated_document(cursor, model, parent_model):
+    cursor.execute("""\
+DELETE FROM collated_file_associations AS cfa
+USING modules AS context, modules AS item
+WHERE cfa.context = context.module_ident AND cfa.item = item.module_ident
+  AND ident_hash(context.uuid, context.major_version,
+                 context.minor_version) = %s
+  AND ident_hash(item.uuid, item.major_version, item.minor_version) = %s""",
+                   (parent_model.ident_hash, model.ident_hash,))
+
+
+def _write_collated_document(cursor, model, binder, checkpoints=None,
+                             recipe_id=None):
+    """Write the collated page ``model``. When ``checkpoints`` are given,
+    the page's file is reused from an earlier attempt or spilled, in which
+    case it is written once its batch is spilled (see `_write_spilled`).
+
+    """
+    if checkpoints is None:
+        publish_collated_document(cursor, model, binder)
+        return
+    fileid = checkpoints.get_written(recipe_id, model.ident_hash, cursor)
+    if fileid is not None:
+        associate_collated_file(cursor, model, binder, fileid)
+        return
+    html = bytes(cnxepub.DocumentContentFormatter(model))
+    _write_spilled(cursor, binder,
+                   checkpoints.spill(recipe_id, model, html, cursor))
+
+
+def _write_spilled(cursor, binder, spilled):
+    """Write the ``spilled`` pages, a list of (model, html) tuples."""
+    for model, html in spilled:
+        # Lock the spilled file for this transaction, or add it again
+        # when it was collected as an orphan in the meantime.
+        fileid = add_collated_file(cursor, html)
+        associate_collated_file(cursor, model, binder, fileid)
+
+
+def _write_changed_pages(cursor, binder, baked, max_rss=0, checkpoints=None,
+                         recipe_id=None):
+    """Write the pages of the collated ``binder`` whose content differs
+    from the ``baked`` fingerprint, one page at a time.
+    Returns the write mode, which is `FULL` when a composite page changed,
+    in which case nothing has been written.
+
+    """
+    pages = [(path, model) for path, title, model in _walk(binder)
+             if isinstance(model, cnxepub.Document)]
+    # Composites are only written as a whole.
+    for path, model in pages:
+        if _is_composite(model) and _content_sha1(model) != baked[path][2]:
+            return FULL
+    write_mode = UNCHANGED
+    for path, model in pages:
+        if (not _is_composite(model) and
+                _content_sha1(model) != baked[path][2]):
+            _remove_collated_document(cursor, model, binder)
+            _write_collated_document(cursor, model, binder, checkpoints,
+                                     recipe_id)
+            write_mode = PARTIAL
+        _check_memory(max_rss)
+    if checkpoints is not None:
+        _write_spilled(cursor, binder, checkpoints.flush())
+    return write_mode
+
+
+def _write_pages(cursor, binder, publisher, message, max_rss=0,
+                 checkpoints=None, recipe_id=None):
+    """Write the composite and collated pages of ``binder`` in a single
+    pass over its tree, formatting one page at a time.
+
+    """
+    for path, title, model in _walk(binder):
+        if _is_composite(model):
+            publish_composite_model(cursor, model, binder, publisher, message)
+        elif isinstance(model, cnxepub.Document):
+            _write_collated_document(cursor, model, binder, checkpoints,
+                                     recipe_id)
+        if isinstance(model, cnxepub.Document):
+            _check_memory(max_rss)
+    if checkpoints is not None:
+        _write_spilled(cursor, binder, checkpoints.flush())
 
 
 @with_db_cursor
-def bake(binder, recipe_id, publisher, message, cursor):
+def bake(binder, recipe_id, publisher, message, cursor, stats=None,
+         checkpoints=None, max_rss=None):
     """Given a `Binder` as `binder`, bake the contents and
     persist those changes alongside the published content.
+    Each stage of the bake is measured into ``stats``
+    (a `BakeStats`), when given.
+
+    When ``checkpoints`` (a `BakeCheckpoints`) is given, the collated
+    book is saved once collation completes, and with a memory ceiling
+    the written pages are saved in batches. If a collated book was
+    already saved by an earlier attempt, collation is skipped and
+    ``binder`` may be None; the pages written by earlier attempts are
+    not written again.
+
+    Only what differs from the currently baked book is written;
+    the write mode is recorded as ``stats.write_mode``. The pages are
+    formatted and written one at a time. When the process uses more than
+    ``max_rss`` kilobytes (``baking.memory.max_rss`` by default)
+    `BakeMemoryExceeded` is raised; a retry can then resume from the
+    checkpoints.
 
     """
-    recipe = _get_recipe(recipe_id, cursor)
-    includes = _formatter_callback_factory()
-    binder = collate_models(binder, ruleset=recipe, includes=includes)
+    if stats is None:
+        stats = BakeStats()
+    if max_rss is None:
+        max_rss = int(get_current_registry().settings.get(
+            'baking.memory.max_rss', DEFAULT_MAX_RSS))
+    cursor = stats.wrap_cursor(cursor)
 
-    def flatten_filter(model):
-        return (isinstance(model, cnxepub.CompositeDocument) or
-                (isinstance(model, cnxepub.Binder) and
-                 model.metadata.get('type') == 'composite-chapter'))
+    collated_html = None
+    if checkpoints is not None:
+        collated_html = checkpoints.load(recipe_id, COLLATED, cursor)
+    if collated_html is not None:
+        logger.info('Resuming the bake of module_ident={} from the '
+                    'collated checkpoint'.format(checkpoints.module_ident))
+        with stats.stage('restore'):
+            binder = reconstitute(io.BytesIO(collated_html))
+    else:
+        with stats.stage('prefetch_exercises'):
+            stats.exercise_fetches += _prefetch_exercises(binder)
+        with stats.stage('collate'):
+            recipe = _get_recipe(recipe_id, cursor)
+            includes = stats.wrap_includes(_formatter_callback_factory(),
+                                           _exercise_fetch_check())
+            binder = collate_models(binder, ruleset=recipe,
+                                    includes=includes)
+        if checkpoints is not None:
+            with stats.stage('checkpoint'):
+                checkpoints.save(recipe_id, COLLATED,
+                                 bytes(SingleHTMLFormatter(binder)))
 
-    def only_documents_filter(model):
-        return isinstance(model, cnxepub.Document) \
-            and not isinstance(model, cnxepub.CompositeDocument)
+    _check_memory(max_rss)
 
-    for doc in cnxepub.flatten_to(binder, flatten_filter):
-        publish_composite_model(cursor, doc, binder, publisher, message)
+    if not max_rss:
+        # Without a memory ceiling the written pages aren't spilled.
+        _write_baked(cursor, binder, recipe_id, publisher, message, stats,
+                     None, max_rss)
+        return []
+    try:
+        _write_baked(cursor, binder, recipe_id, publisher, message, stats,
+                     checkpoints, max_rss)
+    except Exception:
+        if checkpoints is not None:
+            # Keep the progress for the retry.
+            checkpoints.flush()
+        raise
+    return []
 
-    for doc in cnxepub.flatten_to(binder, only_documents_filter):
-        publish_collated_document(cursor, doc, binder)
 
-    tree = cnxepub.model_to_tree(binder)
-    amend_tree_with_slugs(tree)
-    publish_collated_tree(cursor, tree)
+def _write_baked(cursor, binder, recipe_id, publisher, message, stats,
+                 checkpoints, max_rss):
+    """Write what differs between the collated ``binder``
+    and the currently baked book (see `bake`).
 
-    return []
+    """
+    with stats.stage('compare'):
+        baked = _fingerprint_baked(cursor, binder.ident_hash)
+        write_mode = FULL
+        if baked and _has_same_structure(binder, baked):
+            write_mode = None
+    if write_mode is None:
+        with stats.stage('publish_pages'):
+            write_mode = _write_changed_pages(cursor, binder, baked, max_rss,
+                                              checkpoints, recipe_id)
+    stats.write_mode = write_mode
+    logger.debug('Write mode for baking {} is {}'
+                 .format(binder.ident_hash, write_mode))
+    if write_mode != FULL:
+        return
+
+    with stats.stage('remove_baked'):
+        remove_baked(binder.ident_hash, cursor=cursor)
+
+    with stats.stage('publish_pages'):
+        _write_pages(cursor, binder, publisher, message, max_rss,
+                     checkpoints, recipe_id)
+
+    with stats.stage('publish_tree'):
+        tree = cnxepub.model_to_tree(binder)
+        amend_tree_with_slugs(tree)
+        publish_collated_tree(cursor, tree)
 
 
 @with_db_cursor
 def remove_baked(binder_ident_hash, cursor):
-    """Given a binder's ident_hash, remove the baked results."""
+    """Given a binder's ident_hash, remove the baked results.
+    The composite modules and collated files that are left unreferenced
+    are removed later by `cnxpublishing.orphans.collect_orphans`.
+
+    """
+    cursor.execute("SELECT module_ident FROM modules "
+                   "WHERE ident_hash(uuid, major_version, minor_version) = %s",
+                   (binder_ident_hash,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    module_ident = row[0]
+
     # Remove the baked tree.
     cursor.execute("""\
     WITH RECURSIVE t(node, path, is_collated) AS (
     SELECT nodeid, ARRAY[nodeid], is_collated
-    FROM trees AS tr, modules AS m
-    WHERE ident_hash(m.uuid, m.major_version, m.minor_version) = %s AND
-      tr.documentid = m.module_ident AND
+    FROM trees AS tr
+    WHERE tr.documentid = %s AND
       tr.parent_id IS NULL AND
       tr.is_collated = TRUE
 UNION ALL
@@ -113,21 +613,16 @@ UNION ALL
     WHERE not nodeid = any (t.path) AND t.is_collated = c1.is_collated
 )
 delete from trees where nodeid in (select node FROM t)
-    """, (binder_ident_hash,))
+    """, (module_ident,))
 
-    # Remove the baked/collation associations and composite-modules entries.
-    cursor.execute("""\
-    DELETE FROM collated_file_associations AS cfa
-    USING modules AS m
-    WHERE
-      (ident_hash(m.uuid, m.major_version, m.minor_version) = %s
-       )
-      AND
-      cfa.context = m.module_ident
-    RETURNING item, fileid""", (binder_ident_hash,))
-    # FIXME (11-May-2016) This can create orphan `files` & `modules` entries,
-    #       but since it's not intended to be used in production
-    #       this is not a major concern.
-
-
-__all__ = ('bake', 'remove_baked',)
+    # Remove the baked/collation associations.
+    cursor.execute("DELETE FROM collated_file_associations "
+                   "WHERE context = %s", (module_ident,))
+
+
+__all__ = (
+    'BakeCheckpoints',
+    'bake',
+    'enable_recipe_cache',
+    'remove_baked',
+)
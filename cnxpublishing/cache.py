@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
 
@@ -7,9 +11,86 @@ from beaker.util import parse_cache_config_options
 # (This is reassigned with configuration in ``includeme``.)
 cache_manager = CacheManager()
 
+#: Maximum number of accounts profiles cached by each process
+DEFAULT_PROFILE_CACHE_MAX_ENTRIES = 1000
+#: Seconds an accounts profile is cached
+DEFAULT_PROFILE_CACHE_MAX_AGE = 5 * 60
+
 
 def includeme(config):
-    """Configures the caching manager"""
-    global cache_manager
+    """Configures the caching manager and the accounts profile cache"""
+    global cache_manager, profile_cache
     settings = config.registry.settings
     cache_manager = CacheManager(**parse_cache_config_options(settings))
+    profile_cache = LRUCache(
+        int(settings.get('accounts_profiles.cache.max_entries',
+                         DEFAULT_PROFILE_CACHE_MAX_ENTRIES)),
+        int(settings.get('accounts_profiles.cache.max_age',
+                         DEFAULT_PROFILE_CACHE_MAX_AGE)))
+
+
+class LRUCache(object):
+    """A thread safe mapping of at most ``maxsize`` items, which evicts the
+    least recently used item when full and forgets the items that are
+    older than ``ttl`` seconds (unless ``ttl`` is None).
+
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.time):
+        if maxsize < 1:
+            raise ValueError('The size must be positive')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (value, expiry) by key, from the least to the most recently used
+        self._items = OrderedDict()
+        #: Number of times the cache has been cleared
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Returns the value of ``key``.
+        Raises KeyError when it isn't cached or has expired.
+
+        """
+        with self._lock:
+            value, expiry = self._items.pop(key)
+            if expiry is not None and expiry <= self._clock():
+                raise KeyError(key)
+            self._items[key] = (value, expiry)
+            return value
+
+    def set(self, key, value, generation=None):
+        """Cache ``value`` as the value of ``key``, unless the cache has
+        been cleared since ``generation`` (i.e. since the value was
+        looked up).
+
+        """
+        expiry = None
+        if self.ttl is not None:
+            expiry = self._clock() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._items.pop(key, None)
+            self._items[key] = (value, expiry)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self, *args):
+        """Forget all the items. (The arguments are ignored, so it can be
+        used as a notification callback.)
+
+        """
+        with self._lock:
+            self._items.clear()
+            self.generation += 1
+
+
+# The accounts profiles (see `cnxpublishing.db.upsert_users`), by username.
+# (This is reassigned with configuration in ``includeme``.)
+profile_cache = LRUCache(DEFAULT_PROFILE_CACHE_MAX_ENTRIES,
+                         DEFAULT_PROFILE_CACHE_MAX_AGE)
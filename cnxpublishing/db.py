@@ -14,6 +14,7 @@ import json
 
 import cnxepub
 import psycopg2
+import psycopg2.pool
 import jinja2
 from cnxdb.ident_hash import IdentHashSyntaxError, IdentHashShortId
 from cnxepub import ATTRIBUTED_ROLE_KEYS
@@ -23,7 +24,7 @@ from pyramid.threadlocal import (
     get_current_request, get_current_registry,
 )
 
-from . import exceptions
+from . import cache, exceptions
 from .config import CONNECTION_STRING
 from .exceptions import (
     DocumentLookupError,
@@ -45,9 +46,46 @@ END_N_INTERIM_STATES = ('Publishing', 'Done/Success',
 register_uuid()
 
 
+#: Number of connections a worker process keeps (see `init_process_db_pool`)
+DEFAULT_PROCESS_POOL_SIZE = 4
+
+_process_db_pool = None
+
+
+def init_process_db_pool(connection_string,
+                         maxconn=DEFAULT_PROCESS_POOL_SIZE):
+    """Keep the connections made by `db_connect` open for the life of the
+    process, rather than connecting each time. This is used by the
+    baking worker processes (see `cnxpublishing.worker`).
+
+    """
+    global _process_db_pool
+    close_process_db_pool()
+    _process_db_pool = psycopg2.pool.SimpleConnectionPool(
+        0, maxconn, connection_string)
+
+
+def close_process_db_pool():
+    """Close the connections kept by `init_process_db_pool`."""
+    global _process_db_pool
+    if _process_db_pool is not None:
+        _process_db_pool.closeall()
+        _process_db_pool = None
+
+
 @contextlib.contextmanager
 def db_connect(connection_string=None, **kwargs):
     """Function to supply a database connection object."""
+    if (connection_string is None and not kwargs and
+            _process_db_pool is not None):
+        db_conn = _process_db_pool.getconn()
+        try:
+            with db_conn:
+                yield db_conn
+        finally:
+            # Discard the connection when it was lost.
+            _process_db_pool.putconn(db_conn, close=bool(db_conn.closed))
+        return
     if connection_string is None:
         connection_string = get_current_registry().settings[CONNECTION_STRING]
     db_conn = psycopg2.connect(connection_string, **kwargs)
@@ -897,6 +935,55 @@ WHERE id = %s""", (publication_id,))
     return publication_state, publication_messages
 
 
+def get_publication_version(cursor, publication_id):
+    """Returns the version stamp and modification time of the
+    publication, or None when it doesn't exist.
+
+    """
+    cursor.execute("SELECT version, modified FROM publications "
+                   "WHERE id = %s", (publication_id,))
+    return cursor.fetchone()
+
+
+def get_document_controls_version(cursor, uuid_):
+    """Returns the version stamp and modification time of the license,
+    license and role acceptances and ACL of the document identified by
+    ``uuid_``, or None when it doesn't exist.
+
+    """
+    cursor.execute("SELECT version, modified FROM document_controls "
+                   "WHERE uuid = %s", (uuid_,))
+    return cursor.fetchone()
+
+
+def get_bake_state_version(cursor, uuid_):
+    """Returns a digest of the states of the versions of the book
+    identified by ``uuid_`` and of their bakes.
+
+    """
+    cursor.execute("""\
+SELECT md5(coalesce(string_agg(
+         m.module_ident || ':' || m.stateid || ':' ||
+           coalesce(bj.id::text, '') || ':' || coalesce(bj.state, ''),
+         ',' ORDER BY m.module_ident, bj.created, bj.id), ''))
+FROM modules AS m LEFT JOIN bake_jobs AS bj USING (module_ident)
+WHERE m.uuid = %s""", (uuid_,))
+    return cursor.fetchone()[0]
+
+
+def get_moderations_version(cursor):
+    """Returns a digest of the version stamps of the publications waiting
+    for moderation and the time the last of them was modified.
+
+    """
+    cursor.execute("""\
+SELECT md5(coalesce(string_agg(id || ':' || version, ',' ORDER BY id), '')),
+       max(modified)
+FROM publications
+WHERE state = 'Waiting for moderation'""")
+    return cursor.fetchone()
+
+
 def _node_to_model(tree_or_item, metadata=None, parent=None,
                    lucent_id=cnxepub.TRANSLUCENT_BINDER_ID):
     """Given a tree, parse to a set of models"""
@@ -1329,16 +1416,21 @@ VALUES
 def upsert_users(cursor, user_ids):
     """Given a set of user identifiers (``user_ids``),
     upsert them into the database after checking accounts for
-    the latest information.
+    the latest information (cached for a few minutes).
     """
     accounts = get_current_registry().getUtility(IOpenstaxAccounts)
 
     def lookup_profile(username):
-        profile = accounts.get_profile_by_username(username)
-        # See structure documentation at:
-        #   https://<accounts-instance>/api/docs/v1/users/index
-        if profile is None:
-            raise UserFetchError(username)
+        try:
+            profile = cache.profile_cache.get(username)
+        except KeyError:
+            profile = accounts.get_profile_by_username(username)
+            # See structure documentation at:
+            #   https://<accounts-instance>/api/docs/v1/users/index
+            if profile is None:
+                raise UserFetchError(username)
+            cache.profile_cache.set(username, profile)
+        profile = dict(profile)
 
         opt_attrs = ('first_name', 'last_name', 'full_name',
                      'title', 'suffix',)
@@ -1440,16 +1532,111 @@ SET stateid = (
                    (state_name, recipe, module_ident))
 
 
+BAKE_JOB_ACTIVE_STATES = ('queued', 'started', 'retry',)
+
+
+def add_bake_job(cursor, job_id, module_ident, recipe):
+    """Record a baking task (by ``job_id``) in the queued state."""
+    cursor.execute("""\
+INSERT INTO bake_jobs (id, module_ident, recipe)
+VALUES (%s, %s, %s)""", (job_id, module_ident, recipe))
+
+
+def add_bake_jobs(cursor, jobs):
+    """Record the baking tasks, a sequence of
+    (job_id, module_ident, recipe) tuples, in the queued state.
+
+    """
+    if not jobs:
+        return
+    job_ids, module_idents, recipes = zip(*jobs)
+    cursor.execute("""\
+INSERT INTO bake_jobs (id, module_ident, recipe)
+SELECT * FROM unnest(%s::uuid[], %s::integer[], %s::integer[])""",
+                   (list(job_ids), list(module_idents), list(recipes),))
+
+
+def set_bake_job_state(cursor, job_id, state, worker=None, recipe=None,
+                       traceback=None, stages=None, write_mode=None):
+    """Record the ``state`` of the baking task identified by ``job_id``.
+    The start and finish timestamps and the duration are derived
+    from the state change. ``stages`` is the JSON encoded list of
+    stage measurements (see `cnxpublishing.instrumentation`).
+    ``write_mode`` is how the baked book was written
+    (see `cnxpublishing.bake`).
+
+    """
+    cursor.execute("""\
+UPDATE bake_jobs SET
+  state = %(state)s,
+  worker = coalesce(%(worker)s, worker),
+  recipe = coalesce(%(recipe)s, recipe),
+  traceback = %(traceback)s,
+  stages = coalesce(%(stages)s::json, stages),
+  write_mode = coalesce(%(write_mode)s, write_mode),
+  started = CASE WHEN %(state)s = 'started'
+                 THEN CURRENT_TIMESTAMP ELSE started END,
+  finished = CASE WHEN %(state)s IN ('finished', 'failed')
+                  THEN CURRENT_TIMESTAMP ELSE finished END,
+  duration = CASE WHEN %(state)s IN ('finished', 'failed')
+                  THEN CURRENT_TIMESTAMP - started ELSE duration END
+WHERE id = %(job_id)s""", {'job_id': job_id, 'state': state,
+                           'worker': worker, 'recipe': recipe,
+                           'traceback': traceback, 'stages': stages,
+                           'write_mode': write_mode})
+
+
+def get_bake_checkpoint(cursor, module_ident, recipe, stage, max_age):
+    """Returns the artifact of the bake ``stage`` or None when there isn't
+    one or it is older than ``max_age`` seconds.
+
+    """
+    cursor.execute("""\
+SELECT artifact FROM bake_checkpoints
+WHERE module_ident = %s AND recipe = %s AND stage = %s
+  AND created > CURRENT_TIMESTAMP - %s * interval '1 second'""",
+                   (module_ident, recipe, stage, max_age,))
+    row = cursor.fetchone()
+    return row and bytes(row[0]) or None
+
+
+def save_bake_checkpoint(cursor, module_ident, recipe, stage, artifact):
+    """Save the ``artifact`` of the completed bake ``stage``."""
+    cursor.execute("""\
+DELETE FROM bake_checkpoints
+WHERE module_ident = %s AND recipe = %s AND stage = %s""",
+                   (module_ident, recipe, stage,))
+    cursor.execute("""\
+INSERT INTO bake_checkpoints (module_ident, recipe, stage, artifact)
+VALUES (%s, %s, %s, %s)""",
+                   (module_ident, recipe, stage, psycopg2.Binary(artifact),))
+
+
+def remove_bake_checkpoints(cursor, module_ident):
+    """Remove all the bake checkpoints for ``module_ident``."""
+    cursor.execute("DELETE FROM bake_checkpoints WHERE module_ident = %s",
+                   (module_ident,))
+
+
 __all__ = (
     'accept_publication_license',
     'accept_publication_role',
     'acquire_subject_vocabulary',
+    'add_bake_job',
+    'add_bake_jobs',
     'add_pending_model',
     'add_pending_model_content',
     'add_pending_resource',
     'add_publication',
     'check_publication_state',
+    'close_process_db_pool',
     'db_connect',
+    'get_bake_checkpoint',
+    'get_bake_state_version',
+    'get_document_controls_version',
+    'get_moderations_version',
+    'get_publication_version',
+    'init_process_db_pool',
     'is_publication_permissible',
     'is_revision_publication',
     'lookup_document_pointer',
@@ -1458,8 +1645,11 @@ __all__ = (
     'poke_publication_state',
     'publish_pending',
     'remove_acl',
+    'remove_bake_checkpoints',
     'remove_license_requests',
     'remove_role_requests',
+    'save_bake_checkpoint',
+    'set_bake_job_state',
     'set_post_publications_state',
     'set_publication_failure',
     'update_module_state',
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the concurrent handling of the events made from the notifications
+received by the channel processing process
+(see `cnxpublishing.scripts.channel_processing`).
+
+Events are handled by a fixed number of threads, so that one slow
+subscriber doesn't hold up the other notifications. Events with the same
+key (see `event_key`) are handled one at a time, in the order they were
+received. When too many events are waiting, `NotificationDispatcher.submit`
+blocks, which leaves the notifications waiting on the database connection.
+
+Before being handled, notifications may be coalesced by a
+`NotificationCoalescer`, which holds each notification for a short window
+and drops the notifications with the same key (see `coalesce_key`) that
+arrive within it, keeping the newest version of a book.
+
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from pyramid.threadlocal import manager as threadlocal_manager
+
+from .utils import split_ident_hash
+
+
+logger = logging.getLogger('channel_processing')
+
+#: Number of threads handling events
+DEFAULT_WORKERS = 4
+#: Number of events that may be waiting before `submit` blocks
+DEFAULT_MAX_PENDING = 100
+#: Seconds to wait for the waiting events to be handled on shutdown
+DEFAULT_DRAIN_TIMEOUT = 30
+#: Seconds a notification is held to be coalesced with those that follow
+DEFAULT_COALESCE_WINDOW = 2
+# Seconds between checks while waiting, which keeps the main thread
+# responsive to signals (a wait without a timeout isn't in Python 2).
+_WAIT_INTERVAL = 1
+
+
+def event_key(event):
+    """Returns the key of ``event``. Notifications about the same module
+    (by module_ident) share a key, any other notification is keyed
+    by its channel.
+
+    """
+    payload = getattr(event, 'payload', None)
+    if isinstance(payload, dict) and 'module_ident' in payload:
+        return ('module_ident', payload['module_ident'],)
+    return ('channel', getattr(event, 'channel', None),)
+
+
+def coalesce_key(event):
+    """Returns the key used to coalesce ``event`` with other notifications
+    on its channel. Notifications about any version of a book (by the
+    uuid of its ident_hash) share a key, otherwise the key is `event_key`.
+
+    """
+    channel = getattr(event, 'channel', None)
+    payload = getattr(event, 'payload', None)
+    if isinstance(payload, dict) and payload.get('ident_hash'):
+        uuid = _split_version(payload['ident_hash'])[0]
+        return (channel, 'uuid', uuid,)
+    return (channel,) + event_key(event)
+
+
+def _split_version(ident_hash):
+    uuid, version = split_ident_hash(ident_hash, split_version=True)
+    return uuid, tuple([int(x or 0) for x in version])
+
+
+def _is_newer(event, other):
+    """Is ``event`` about the same or a newer version of a book
+    than ``other``?
+
+    """
+    try:
+        version = _split_version(event.payload['ident_hash'])[1]
+        other_version = _split_version(other.payload['ident_hash'])[1]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # Not about a book, the last notification received wins.
+        return True
+    return version >= other_version
+
+
+class NotificationCoalescer(object):
+    """Holds notifications for ``window`` seconds from the first
+    notification of each key (see `coalesce_key`). The notifications
+    that arrive within the window replace the held notification, unless
+    they are about an older version of the book. Either way, one of
+    them is dropped and counted in ``dropped`` (by channel).
+
+    """
+
+    def __init__(self, window=DEFAULT_COALESCE_WINDOW):
+        if window <= 0:
+            raise ValueError('The window must be positive')
+        self.window = window
+        self.dropped = {}
+        self._held = {}  # key to [due time, event]
+        self._order = deque()  # keys in the order they were first held
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(window=float(settings.get(
+            'channel_processing.coalesce_window',
+            DEFAULT_COALESCE_WINDOW)))
+
+    @property
+    def pending(self):
+        """Number of notifications being held"""
+        return len(self._held)
+
+    def add(self, event, now=None):
+        """Hold ``event``. Returns False when a notification was dropped."""
+        if now is None:
+            now = time.time()
+        key = coalesce_key(event)
+        held = self._held.get(key)
+        if held is None:
+            self._held[key] = [now + self.window, event]
+            self._order.append(key)
+            return True
+        if _is_newer(event, held[1]):
+            held[1] = event
+        channel = getattr(event, 'channel', None)
+        self.dropped[channel] = self.dropped.get(channel, 0) + 1
+        return False
+
+    def next_due(self, now=None):
+        """Returns the seconds until the next notification is due,
+        or None when no notifications are being held.
+
+        """
+        if not self._order:
+            return None
+        if now is None:
+            now = time.time()
+        return max(self._held[self._order[0]][0] - now, 0)
+
+    def pop_due(self, now=None):
+        """Returns the notifications whose window has passed,
+        in the order they were first held.
+
+        """
+        if now is None:
+            now = time.time()
+        events = []
+        while self._order and self._held[self._order[0]][0] <= now:
+            events.append(self._held.pop(self._order.popleft())[1])
+        return events
+
+    def flush(self):
+        """Returns all the notifications being held."""
+        events = [self._held[key][1] for key in self._order]
+        self._held.clear()
+        self._order.clear()
+        return events
+
+    def stats(self):
+        return {
+            'held': len(self._held),
+            'dropped': sum(self.dropped.values()),
+        }
+
+
+class NotificationDispatcher(object):
+    """Handles events with ``registry.notify`` on ``workers`` threads.
+    At most ``max_pending`` events wait to be handled.
+
+    """
+
+    def __init__(self, registry, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, metrics=None):
+        if workers < 1 or max_pending < 1:
+            raise ValueError('The workers and max pending must be positive')
+        self.registry = registry
+        self.metrics = metrics
+        self.max_pending = max_pending
+        self.handled = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+        self._queues = {}  # key to the events waiting, in order
+        self._ready = deque()  # keys with events that can be handled now
+        self._busy = set()  # keys with an event being handled
+        self._pending = 0  # events submitted that are not yet handled
+        self._closed = False  # no longer accepting events
+        self._stopping = False  # the threads are to exit
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run,
+                                      name='dispatcher-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @classmethod
+    def from_settings(cls, registry, metrics=None):
+        settings = registry.settings
+        return cls(registry,
+                   workers=int(settings.get('channel_processing.workers',
+                                            DEFAULT_WORKERS)),
+                   max_pending=int(settings.get(
+                       'channel_processing.max_pending',
+                       DEFAULT_MAX_PENDING)),
+                   metrics=metrics)
+
+    @property
+    def pending(self):
+        """Number of events submitted and not yet handled"""
+        return self._pending
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'busy': len(self._busy),
+                'handled': self.handled,
+                'failed': self.failed,
+            }
+
+    def is_pending(self, key):
+        """Is an event with ``key`` waiting or being handled?"""
+        with self._cond:
+            return key in self._queues
+
+    def submit(self, event, key=None, timeout=None):
+        """Queue ``event`` to be handled after the events submitted
+        before it with the same ``key`` (by default `event_key`).
+        Blocks while ``max_pending`` events are waiting, for at most
+        ``timeout`` seconds. Returns False when timed out.
+
+        """
+        if key is None:
+            key = event_key(event)
+        deadline = timeout is not None and time.time() + timeout or None
+        with self._cond:
+            while self._pending >= self.max_pending and not self._closed:
+                if deadline is None:
+                    self._cond.wait(_WAIT_INTERVAL)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(min(remaining, _WAIT_INTERVAL))
+            if self._closed:
+                raise RuntimeError('The dispatcher has been shut down')
+            self._pending += 1
+            queue = self._queues.setdefault(key, deque())
+            queue.append(event)
+            if len(queue) == 1 and key not in self._busy:
+                self._ready.append(key)
+            self._cond.notify_all()
+        return True
+
+    def shutdown(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """Stop accepting events and wait up to ``timeout`` seconds for
+        the submitted events to be handled. Returns the number of events
+        that were left unhandled.
+
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            if self._stopping:
+                return self._pending
+            self._closed = True
+            self._cond.notify_all()
+            while self._pending and time.time() < deadline:
+                self._cond.wait(min(deadline - time.time(), _WAIT_INTERVAL))
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0))
+        if self._pending:
+            logger.warning('Shut down with {} notifications unhandled'
+                           .format(self._pending))
+        return self._pending
+
+    def _run(self):
+        # Make the registry available to the subscribers of this thread.
+        threadlocal_manager.push({'registry': self.registry,
+                                  'request': None})
+        try:
+            while True:
+                with self._cond:
+                    while not self._ready and not self._stopping:
+                        self._cond.wait(_WAIT_INTERVAL)
+                    if self._stopping:
+                        return
+                    key = self._ready.popleft()
+                    event = self._queues[key].popleft()
+                    self._busy.add(key)
+                failed = False
+                started = time.time()
+                try:
+                    try:
+                        self.registry.notify(event)
+                    except Exception:
+                        failed = True
+                        logger.exception('Logging an uncaught exception')
+                    if self.metrics is not None:
+                        self.metrics.observe_handled(event, started,
+                                                     time.time(), failed)
+                except Exception:
+                    logger.exception('Unable to record the metrics')
+                finally:
+                    # Always release the key, or its events are stuck.
+                    with self._cond:
+                        self._busy.discard(key)
+                        self._pending -= 1
+                        self.handled += 1
+                        self.failed += failed
+                        if self._queues[key]:
+                            self._ready.append(key)
+                        else:
+                            del self._queues[key]
+                        self._cond.notify_all()
+        finally:
+            threadlocal_manager.pop()
+
+
+__all__ = (
+    'coalesce_key',
+    'event_key',
+    'NotificationCoalescer',
+    'NotificationDispatcher',
+)
@@ -6,6 +6,13 @@ class ChannelProcessingStartUpEvent(object):
     """An event triggered during channel processing process start up."""
 
 
+class ChannelProcessingTickEvent(object):
+    """An event triggered every ``channel_processing.tick_interval`` seconds
+    by the channel processing `cnxpublishing.reactor.Scheduler`,
+    whether or not notifications were received.
+    """
+
+
 class PGNotifyEvent(object):
     """A base class for a Postgres Notification Event"""
 
@@ -82,6 +89,7 @@ def create_pg_notify_event(notif):
 __all__ = (
     'create_pg_notify_event',
     'ChannelProcessingStartUpEvent',
+    'ChannelProcessingTickEvent',
     'PGNotifyEvent',
     'PostPublicationEvent',
 )
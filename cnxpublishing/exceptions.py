@@ -33,6 +33,22 @@ class DocumentLookupError(Exception):
     """Generally used when a document cannot be found."""
 
 
+class BakeMemoryExceeded(Exception):
+    """Raised when a bake uses more memory than it is allowed."""
+
+    def __init__(self, rss, max_rss):
+        self.rss = rss
+        self.max_rss = max_rss
+
+    @property
+    def message(self):
+        return ("Baking used {}kB of memory, more than the {}kB allowed."
+                .format(self.rss, self.max_rss))
+
+    def __str__(self):
+        return self.message
+
+
 # ########################## #
 #   Publication Exceptions   #
 # ########################## #
@@ -273,6 +289,7 @@ class ResourceFileExceededLimitError(PublicationException):
 
 
 __all__ = (
+    'BakeMemoryExceeded',
     'DocumentLookupError',
     'InvalidLicense',
     'InvalidRole',
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the cache used for the exercise embeds during collation
+and the means to fill it before collation starts.
+
+The `ExerciseCache` has the same ``get`` and ``set`` interface as a
+memcache client, so it can be given to
+`cnxepub.formatters.exercise_callback_factory` in place of one.
+It layers an in-process LRU cache, an optional on-disk store and an
+optional memcache client.
+
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+import cnxepub
+import lxml.html
+import memcache
+import requests
+from pyramid.threadlocal import get_current_registry
+from repoze.lru import ExpiringLRUCache
+
+
+logger = logging.getLogger('cnxpublishing')
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_AGE = 24 * 60 * 60  # one day
+DEFAULT_PREFETCH_CONCURRENCY = 8
+DEFAULT_PREFETCH_BATCH_SIZE = 50
+
+
+class ExerciseCache(object):
+    """A memcache like store of exercise responses.
+
+    Values are looked up in the in-process LRU cache (of ``max_entries``),
+    then in ``directory`` (when given) and then with ``mc_client``
+    (when given). A value found in a slower store is copied into the
+    faster ones. Values older than ``max_age`` seconds are ignored,
+    except those in memcache, which handles its own expiry.
+
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, directory=None,
+                 mc_client=None, max_age=DEFAULT_MAX_AGE):
+        self._lru = ExpiringLRUCache(max_entries, default_timeout=max_age)
+        self.directory = directory
+        self.mc_client = mc_client
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def from_settings(cls, settings):
+        memcache_servers = settings.get('memcache_servers')
+        mc_client = None
+        if memcache_servers:
+            mc_client = memcache.Client(memcache_servers.split(), debug=0)
+        return cls(
+            max_entries=int(settings.get(
+                'embeddables.exercise.cache.max_entries',
+                DEFAULT_MAX_ENTRIES)),
+            directory=settings.get('embeddables.exercise.cache.directory',
+                                   None) or None,
+            mc_client=mc_client,
+            max_age=int(settings.get('embeddables.exercise.cache.max_age',
+                                     DEFAULT_MAX_AGE)),
+        )
+
+    def _path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        # Hash the key, it may contain the exercises service token.
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest())
+
+    def _get_from_disk(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, 'rb') as fb:
+                return fb.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def _set_on_disk(self, key, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fb:
+                fb.write(value)
+            os.rename(tmp_path, self._path(key))
+        except (IOError, OSError):  # pragma: no cover
+            logger.exception('Unable to write the exercise cache entry')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, key):
+        value = self.peek(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def peek(self, key):
+        """Returns the value of ``key``, as `get` does, without counting
+        it as a hit or a miss.
+
+        """
+        value = self._lru.get(key)
+        if value is None and self.directory is not None:
+            value = self._get_from_disk(key)
+            if value is not None:
+                self._lru.put(key, value)
+        if value is None and self.mc_client is not None:
+            value = self.mc_client.get(key)
+            if value is not None:
+                self._lru.put(key, value)
+                if self.directory is not None:
+                    self._set_on_disk(key, value)
+        return value
+
+    def set(self, key, value):
+        self._lru.put(key, value)
+        if self.directory is not None:
+            self._set_on_disk(key, value)
+        if self.mc_client is not None:
+            self.mc_client.set(key, value)
+        return True
+
+
+_cache_lock = threading.Lock()
+
+
+def get_exercise_cache(registry=None):
+    """Returns the `ExerciseCache` for the process,
+    creating it from settings on first use.
+
+    """
+    if registry is None:
+        registry = get_current_registry()
+    with _cache_lock:
+        cache = getattr(registry, 'exercise_cache', None)
+        if cache is None:
+            cache = ExerciseCache.from_settings(registry.settings)
+            registry.exercise_cache = cache
+    return cache
+
+
+def cache_key(item_code, token=None):
+    """The key used by `cnxepub.formatters.exercise_callback_factory`"""
+    return item_code + (token or '')
+
+
+def is_exercise_cached(cache, href, match, token=None):
+    """Is the exercise embedded by the link ``href`` (which contains
+    ``match``) in ``cache``? Otherwise collation fetches it.
+
+    """
+    # Same as the exercise callback's code extraction
+    return cache.peek(cache_key(href[len(match):], token)) is not None
+
+
+def find_exercise_codes(binder, match):
+    """Returns the item codes of the exercises embedded in the documents
+    of ``binder`` using links that contain ``match``.
+
+    """
+    codes = set()
+    for document in cnxepub.flatten_to_documents(binder):
+        content = document.content
+        if not content:
+            continue
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        html = lxml.html.fromstring(content)
+        for elem in html.iter('a'):
+            href = elem.get('href') or ''
+            if match in href:
+                # Same as the exercise callback's code extraction
+                codes.add(href[len(match):])
+    return sorted(codes)
+
+
+def prefetch_exercises(cache, embeds, token=None,
+                       concurrency=DEFAULT_PREFETCH_CONCURRENCY,
+                       batch_size=DEFAULT_PREFETCH_BATCH_SIZE):
+    """Fetch the exercises that are not yet in ``cache``.
+    ``embeds`` is a sequence of (item_code, url) tuples. Requests are
+    made ``concurrency`` at a time, in batches of ``batch_size``.
+    Returns the number of exercises that were fetched.
+
+    """
+    headers = {}
+    if token:
+        headers['Authorization'] = 'Bearer {}'.format(token)
+    missing = [(code, url) for code, url in embeds
+               if cache.get(cache_key(code, token)) is None]
+    if not missing:
+        return 0
+
+    def fetch(embed):
+        code, url = embed
+        try:
+            res = requests.get(url, headers=headers)
+        except requests.RequestException:
+            logger.exception('Unable to prefetch exercise {}'.format(url))
+            return False
+        if not res:
+            logger.warning('Unable to prefetch exercise {} ({})'
+                           .format(url, res.status_code))
+            return False
+        cache.set(cache_key(code, token), res.text)
+        return True
+
+    fetched = 0
+    pool = ThreadPool(concurrency)
+    try:
+        for i in range(0, len(missing), batch_size):
+            fetched += sum(pool.map(fetch, missing[i:i + batch_size]))
+    finally:
+        pool.close()
+        pool.join()
+    logger.debug('Prefetched {} of {} exercises ({} already cached)'
+                 .format(fetched, len(missing), len(embeds) - len(missing)))
+    return fetched
+
+
+__all__ = (
+    'cache_key',
+    'ExerciseCache',
+    'find_exercise_codes',
+    'get_exercise_cache',
+    'is_exercise_cached',
+    'prefetch_exercises',
+)
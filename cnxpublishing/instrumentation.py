@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides instrumentation for measuring where the time and resources
+of a bake are spent.
+
+A `BakeStats` is created for each bake and each stage of the bake
+(export, collation, persisting, etc.) is wrapped in a ``stage`` block.
+For each stage we record the wall time, the cpu time, the peak resident
+set size, the number of database queries and the number of exercise
+embeds that were fetched.
+
+"""
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('cnxpublishing')
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss():
+    """Peak resident set size of the process in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss():
+    """Resident set size of the process in kilobytes. This is the peak
+    resident set size where it can't be read from ``/proc``.
+
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):  # pragma: no cover
+        return _peak_rss()
+    return pages * resource.getpagesize() // 1024
+
+
+class CountingCursor(object):
+    """Wraps a psycopg2 cursor to count the queries executed through it."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, *args, **kwargs):
+        self._stats.query_count += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._stats.query_count += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class BakeStats(object):
+    """Collects the per stage measurements of a single bake."""
+
+    def __init__(self):
+        self.stages = []
+        self.query_count = 0
+        self.exercise_fetches = 0
+        #: How the baked book was written (see `cnxpublishing.bake`)
+        self.write_mode = None
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the enclosed block as the stage called ``name``.
+        The stage is recorded even when the block raises an exception.
+
+        """
+        start_wall = time.time()
+        start_cpu = _cpu_time()
+        start_queries = self.query_count
+        start_fetches = self.exercise_fetches
+        try:
+            yield
+        finally:
+            self.stages.append({
+                'name': name,
+                'wall_time': round(time.time() - start_wall, 3),
+                'cpu_time': round(_cpu_time() - start_cpu, 3),
+                'peak_rss': _peak_rss(),
+                'queries': self.query_count - start_queries,
+                'exercise_fetches': self.exercise_fetches - start_fetches,
+            })
+
+    def wrap_cursor(self, cursor):
+        """Returns ``cursor`` wrapped to count the queries made with it."""
+        if isinstance(cursor, CountingCursor):
+            return cursor
+        return CountingCursor(cursor, self)
+
+    def wrap_includes(self, includes, is_fetched=None):
+        """Wraps the collation ``includes`` (a list of (xpath, callback)
+        tuples) to count the exercise embeds that are fetched.
+        When given, ``is_fetched`` is called with each element before
+        its callback, to tell whether the exercise is fetched
+        (e.g. rather than taken from a cache).
+
+        """
+        def counted(callback):
+            def wrapper(elem):
+                if is_fetched is None or is_fetched(elem):
+                    self.exercise_fetches += 1
+                return callback(elem)
+            return wrapper
+        return [(match, counted(callback)) for match, callback in includes]
+
+    @property
+    def total_wall_time(self):
+        return sum(s['wall_time'] for s in self.stages)
+
+    def to_json(self):
+        return json.dumps(self.stages)
+
+    def log(self, module_ident, ident_hash):
+        """Write a summary of the stages to the log."""
+        logger.info('Bake stages for module_ident={} ident_hash={}: {}'
+                    .format(module_ident, ident_hash,
+                            ', '.join(['{name}={wall_time}s '
+                                       '(cpu={cpu_time}s '
+                                       'rss={peak_rss}kB '
+                                       'queries={queries} '
+                                       'exercises={exercise_fetches})'
+                                       .format(**s)
+                                       for s in self.stages])))
+
+
+__all__ = (
+    'BakeStats',
+    'CountingCursor',
+    'current_rss',
+)
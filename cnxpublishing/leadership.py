@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the election of the active channel processing process
+(see `cnxpublishing.scripts.channel_processing`) among its replicas.
+
+The active process holds a session level Postgres advisory lock on its
+listening connection. The other replicas are on standby, trying to take
+the lock every few seconds. The lock is released by Postgres when the
+active process's connection is closed or lost, so a standby replica takes
+over without waiting for any timeout to pass.
+
+"""
+import logging
+import time
+
+
+logger = logging.getLogger('channel_processing')
+
+#: Key of the advisory lock held by the active process
+LOCK_KEY = 0x636e7870  # 'cnxp'
+#: Seconds between a standby replica's attempts to take the lock
+DEFAULT_STANDBY_INTERVAL = 5
+
+
+def try_acquire_leadership(cursor, key=LOCK_KEY):
+    """Take the lock, without waiting. Returns True when it was taken,
+    which makes the cursor's connection the active one.
+
+    """
+    cursor.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+    return cursor.fetchone()[0]
+
+
+def release_leadership(cursor, key=LOCK_KEY):
+    """Release the lock. Returns False if it wasn't held."""
+    cursor.execute("SELECT pg_advisory_unlock(%s)", (key,))
+    return cursor.fetchone()[0]
+
+
+def wait_for_leadership(cursor, interval=DEFAULT_STANDBY_INTERVAL,
+                        key=LOCK_KEY, stopping=()):
+    """Try to take the lock every ``interval`` seconds, until it is taken
+    or ``stopping`` is no longer empty. Returns True when it was taken.
+
+    """
+    is_waiting = False
+    while not stopping:
+        if try_acquire_leadership(cursor, key):
+            if is_waiting:
+                logger.info('Taking over as the active channel processor')
+            return True
+        if not is_waiting:
+            logger.info('Standing by, another channel processor is active')
+            is_waiting = True
+        time.sleep(interval)
+    return False
+
+
+__all__ = (
+    'release_leadership',
+    'try_acquire_leadership',
+    'wait_for_leadership',
+)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the waiting for publication and bake state changes used by the
+long polling requests (e.g. ``GET /publications/{id}?wait=30``).
+
+Each web process has one connection listening on the state change
+channels, which are notified by the database when a publication is
+updated or a book's bake state changes. The listening is done in a
+background thread, started by the first request that waits. It wakes the
+requests waiting on the publication or book the notification is about,
+so the waiting requests don't query the database until there is a change.
+Each waiting request holds a thread of the web server, so at most
+``publishing.longpoll.max_waiters`` requests wait at once; the others are
+answered right away, with a ``Retry-After`` header.
+Other channels can be listened on with callbacks (see
+`StateChangeListener.add_callback`), e.g. to invalidate a process's cache.
+
+"""
+import contextlib
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+from .config import CONNECTION_STRING
+from .reactor import reconnect_delays
+
+
+logger = logging.getLogger('cnxpublishing')
+
+#: Maximum number of seconds a request waits for a change
+DEFAULT_MAX_WAIT = 30
+#: Maximum number of requests of a process waiting at once
+DEFAULT_MAX_WAITERS = 4
+
+#: Channel notified when a publication is updated
+PUBLICATION_STATE_CHANNEL = 'publication_state'
+#: Channel notified when the state of a book's bake changes
+BAKE_STATE_CHANNEL = 'bake_state'
+#: The payload field the waiting requests are keyed by, by channel
+KEY_FIELDS = {
+    PUBLICATION_STATE_CHANNEL: 'id',
+    BAKE_STATE_CHANNEL: 'uuid',
+}
+
+# Seconds between checks of whether the listener has been stopped
+_STOP_CHECK_INTERVAL = 5
+
+_listener_lock = threading.Lock()
+
+
+class StateChangeListener(object):
+    """Listens on the state change channels and wakes the requests
+    waiting on the publication or book a notification is about.
+
+    """
+
+    def __init__(self, connection_string, channels=tuple(KEY_FIELDS),
+                 max_waiters=DEFAULT_MAX_WAITERS):
+        self.connection_string = connection_string
+        self.channels = list(channels)
+        self._lock = threading.Lock()
+        self._waiter_slots = threading.BoundedSemaphore(max_waiters)
+        # Events of the waiting requests, by (channel, key)
+        self._waiters = {}
+        # Callbacks, by channel
+        self._callbacks = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @classmethod
+    def from_settings(cls, settings):
+        max_waiters = int(settings.get('publishing.longpoll.max_waiters',
+                                       DEFAULT_MAX_WAITERS))
+        return cls(settings[CONNECTION_STRING], max_waiters=max_waiters)
+
+    def start(self):
+        """Start listening, unless already listening."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='state-change-listener')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def add_callback(self, channel, callback):
+        """Call ``callback(payload)`` when ``channel`` is notified, and
+        ``callback(None)`` when notifications may have been missed
+        (i.e. whenever the listening (re)starts).
+        Add the callbacks before the listening starts.
+
+        """
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+            if channel not in self.channels:
+                self.channels.append(channel)
+
+    def stop(self):
+        """Stop listening (within a few seconds)."""
+        self._stopping.set()
+
+    @contextlib.contextmanager
+    def waiting(self, channel, key):
+        """Context within which the yielded event is set by a notification
+        on ``channel`` about ``key``. Check the state within it, so that
+        a change made after the check isn't missed. None is yielded when
+        the maximum number of requests are already waiting.
+
+        """
+        if not self._waiter_slots.acquire(False):
+            yield None
+            return
+        try:
+            self.start()
+            event = threading.Event()
+            waiter_key = (channel, str(key))
+            with self._lock:
+                self._waiters.setdefault(waiter_key, set()).add(event)
+            try:
+                yield event
+            finally:
+                with self._lock:
+                    events = self._waiters[waiter_key]
+                    events.discard(event)
+                    if not events:
+                        del self._waiters[waiter_key]
+        finally:
+            self._waiter_slots.release()
+
+    def notify(self, channel, payload):
+        """Wake the requests waiting on what ``payload`` is about."""
+        self._call_back(channel, payload)
+        if channel not in KEY_FIELDS:
+            return
+        try:
+            key = json.loads(payload)[KEY_FIELDS[channel]]
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Unrecognized {} notification: {!r}'
+                           .format(channel, payload))
+            return
+        with self._lock:
+            events = list(self._waiters.get((channel, str(key)), ()))
+        for event in events:
+            event.set()
+
+    def _call_back(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('Failed to handle a {} notification'
+                                 .format(channel))
+
+    def _wake_all(self):
+        with self._lock:
+            channels = list(self._callbacks)
+        for channel in channels:
+            self._call_back(channel, None)
+        with self._lock:
+            events = [event for events in self._waiters.values()
+                      for event in events]
+        for event in events:
+            event.set()
+
+    def _listen(self, conn):
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            for channel in self.channels:
+                cursor.execute('LISTEN {}'.format(channel))
+        # Changes may have been missed while not listening.
+        self._wake_all()
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], _STOP_CHECK_INTERVAL) == \
+                    ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.notify(notify.channel, notify.payload)
+
+    def _run(self):
+        delays = reconnect_delays()
+        while not self._stopping.is_set():
+            try:
+                # Keepalives detect a connection lost without being closed.
+                conn = psycopg2.connect(self.connection_string, keepalives=1,
+                                        keepalives_idle=30,
+                                        keepalives_interval=10,
+                                        keepalives_count=3)
+            except psycopg2.OperationalError:
+                logger.exception('Unable to connect to listen for '
+                                 'state changes')
+            else:
+                delays = reconnect_delays()
+                try:
+                    self._listen(conn)
+                except psycopg2.OperationalError:
+                    logger.exception('Lost the connection listening for '
+                                     'state changes')
+                finally:
+                    conn.close()
+            self._stopping.wait(next(delays))
+
+
+def get_state_change_listener(registry):
+    """Returns the process's `StateChangeListener`."""
+    listener = getattr(registry, 'state_change_listener', None)
+    if listener is None:
+        with _listener_lock:
+            listener = getattr(registry, 'state_change_listener', None)
+            if listener is None:
+                listener = StateChangeListener.from_settings(
+                    registry.settings)
+                registry.state_change_listener = listener
+    return listener
+
+
+def get_wait(request):
+    """Returns the seconds the request asks to wait for a change
+    (its ``wait`` parameter), at most ``publishing.longpoll.max_wait``.
+
+    """
+    try:
+        wait = float(request.params.get('wait', 0))
+    except ValueError:
+        return 0
+    max_wait = float(request.registry.settings.get(
+        'publishing.longpoll.max_wait', DEFAULT_MAX_WAIT))
+    return max(min(wait, max_wait), 0)
+
+
+def wait_for_change(request, channel, key, get_version, is_current):
+    """Returns the version of what ``key`` identifies, from
+    ``get_version()``, once ``is_current(version)`` is no longer true or
+    the seconds the request asks to wait (see `get_wait`) have passed.
+    The version is looked up again only when ``channel`` is notified
+    about ``key``. When too many requests are waiting, the version is
+    returned right away and the response asks to retry after the wait.
+
+    """
+    wait = get_wait(request)
+    if not wait:
+        return get_version()
+    listener = get_state_change_listener(request.registry)
+    with listener.waiting(channel, key) as event:
+        version = get_version()
+        if version is None or not is_current(version):
+            pass
+        elif event is None:
+            request.response.headers['Retry-After'] = str(int(wait) or 1)
+        else:
+            event.wait(wait)
+            version = get_version()
+    return version
+
+
+__all__ = (
+    'get_state_change_listener',
+    'get_wait',
+    'StateChangeListener',
+    'wait_for_change',
+)
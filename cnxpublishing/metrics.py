@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the metrics of the channel processing process
+(see `cnxpublishing.scripts.channel_processing`).
+
+The metrics are written in the Prometheus text format to the file at
+``channel_processing.metrics.path`` every
+``channel_processing.metrics.interval`` seconds
+(see `cnxpublishing.subscribers.write_processor_metrics`), which is meant
+to be read by the node exporter's textfile collector. The file is
+replaced, so it is never read half written.
+
+"""
+import calendar
+import os
+import re
+import tempfile
+import threading
+import time
+
+
+#: Minimum number of seconds between writing the metrics
+DEFAULT_INTERVAL = 15
+
+PREFIX = 'cnxpublishing_channel_processing'
+
+_PG_TIMESTAMP = re.compile(
+    r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(\.\d+)?'
+    r'(?:([+-])(\d\d)(?::?(\d\d))?)?$')
+
+
+def parse_pg_timestamp(value):
+    """Returns the seconds since the epoch of a Postgres timestamp
+    (e.g. the ``timestamp`` of a notification's payload), or None when
+    it can't be parsed.
+
+    """
+    match = _PG_TIMESTAMP.match(value or '')
+    if match is None:
+        return None
+    dt, fraction, sign, hours, minutes = match.groups()
+    seconds = calendar.timegm(time.strptime(dt, '%Y-%m-%d %H:%M:%S'))
+    seconds += float(fraction or 0)
+    if sign is not None:
+        offset = int(hours) * 3600 + int(minutes or 0) * 60
+        seconds -= offset if sign == '+' else -offset
+    return seconds
+
+
+def _labels(**labels):
+    return '{{{}}}'.format(','.join(
+        ['{}="{}"'.format(name, str(value).replace('"', '\\"'))
+         for name, value in sorted(labels.items())]))
+
+
+class ProcessorMetrics(object):
+    """Counts the notifications received and handled, by channel,
+    and sums the time taken to handle them.
+
+    The times summed, in seconds, are the dispatch latency (from being
+    received to being handled), the lag (from the notification's payload
+    ``timestamp`` to being handled) and the duration of the subscribers.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = {}
+        self.handled = {}
+        self.exceptions = {}
+        self._summaries = {'dispatch_latency': {}, 'lag': {}, 'duration': {}}
+        self._gauges = {}
+        #: Counts of the dropped duplicate notifications, by channel
+        self.coalesced = {}
+        #: Objects with a ``stats()`` method whose values are reported
+        #: as gauges, by name (e.g. the dispatcher)
+        self.sources = {}
+
+    def set_gauge(self, name, value, help, **labels):
+        """Set the gauge ``name`` with ``labels`` to ``value``."""
+        with self._lock:
+            values = self._gauges.setdefault(name, (help, {}))[1]
+            values[tuple(sorted(labels.items()))] = value
+
+    def observe_received(self, event, now=None):
+        """Count ``event`` as received and note when."""
+        if now is None:
+            now = time.time()
+        event.received = now
+        with self._lock:
+            self.received[event.channel] = \
+                self.received.get(event.channel, 0) + 1
+
+    def observe_handled(self, event, started, finished, failed=False):
+        """Count ``event`` as handled between ``started`` and
+        ``finished``, with an exception when ``failed``. Events that
+        aren't notifications (e.g. the tick) are counted as ``tick``.
+
+        """
+        channel = getattr(event, 'channel', 'tick')
+        observations = [('duration', finished - started)]
+        received = getattr(event, 'received', None)
+        if received is not None:
+            observations.append(('dispatch_latency', started - received))
+        payload = getattr(event, 'payload', None)
+        if isinstance(payload, dict):
+            sent = parse_pg_timestamp(payload.get('timestamp'))
+            if sent is not None:
+                observations.append(('lag', finished - sent))
+        with self._lock:
+            self.handled[channel] = self.handled.get(channel, 0) + 1
+            if failed:
+                self.exceptions[channel] = \
+                    self.exceptions.get(channel, 0) + 1
+            for name, value in observations:
+                count, total = self._summaries[name].get(channel, (0, 0.0))
+                self._summaries[name][channel] = (count + 1, total + value)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = []
+
+        def add(name, kind, help, samples):
+            name = '{}_{}'.format(PREFIX, name)
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, labels, value in samples:
+                # Not yet known, e.g. the wait before the first dispatch.
+                if value is None:
+                    continue
+                lines.append('{}{}{} {}'.format(name, suffix, labels, value))
+
+        def counter(values, label='channel'):
+            return [('', _labels(**{label: key}), value)
+                    for key, value in sorted(values.items())]
+
+        with self._lock:
+            add('notifications_received_total', 'counter',
+                'Notifications received', counter(self.received))
+            add('notifications_handled_total', 'counter',
+                'Notifications handled', counter(self.handled))
+            add('exceptions_total', 'counter',
+                'Notifications whose subscribers raised an exception',
+                counter(self.exceptions))
+            add('notifications_coalesced_total', 'counter',
+                'Duplicate notifications dropped', counter(self.coalesced))
+            for name, help in (
+                    ('dispatch_latency',
+                     'Seconds from receiving to handling a notification'),
+                    ('lag', 'Seconds from sending to having handled '
+                            'a notification'),
+                    ('duration', 'Seconds taken by the subscribers')):
+                samples = []
+                for channel, (count, total) in sorted(
+                        self._summaries[name].items()):
+                    label_text = _labels(channel=channel)
+                    samples.append(('_count', label_text, count))
+                    samples.append(('_sum', label_text, round(total, 6)))
+                add('{}_seconds'.format(name), 'summary', help, samples)
+            gauges = dict([(name, (help, dict(values)))
+                           for name, (help, values) in self._gauges.items()])
+        for source_name, source in sorted(self.sources.items()):
+            for key, value in source.stats().items():
+                gauges['{}_{}'.format(source_name, key)] = (
+                    'The {} {}'.format(source_name, key), {(): value})
+        for name, (help, values) in sorted(gauges.items()):
+            add(name, 'gauge', help,
+                [('', labels and _labels(**dict(labels)) or '', value)
+                 for labels, value in sorted(values.items())])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to the file at ``path``."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as fb:
+                fb.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+__all__ = (
+    'parse_pg_timestamp',
+    'ProcessorMetrics',
+)
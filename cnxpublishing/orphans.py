@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the garbage collection of baked content that is no longer used.
+
+Each (re)bake removes the previously baked tree and its collated file
+associations (see `cnxpublishing.bake.remove_baked`), which leaves
+behind the composite modules and collated files only that tree used.
+These orphans are removed in batches, each in its own short transaction.
+Rows that are locked by a bake in progress are skipped, and the file
+lookups made while baking lock the file they reuse, so collection is
+safe to run while books are baking.
+
+Composite modules are collected before files, because removing a module
+also removes its file associations. The files are paged through by id,
+so each batch continues where the last one stopped. A dry run only
+counts the orphans, so it doesn't include the files that would be
+orphaned by removing the composite modules.
+
+"""
+import logging
+import time
+
+from .db import db_connect
+
+
+logger = logging.getLogger('cnxpublishing')
+
+#: Number of rows removed in each transaction
+DEFAULT_BATCH_SIZE = 500
+
+ORPHAN_MODULES_QUERY = """\
+SELECT m.module_ident FROM modules AS m
+WHERE m.portal_type = 'CompositeModule'
+  AND NOT EXISTS (SELECT 1 FROM trees WHERE documentid = m.module_ident)"""
+
+ORPHAN_FILES_QUERY = """\
+SELECT f.fileid FROM files AS f
+WHERE f.media_type = 'text/html'
+  AND NOT EXISTS (SELECT 1 FROM collated_file_associations AS cfa
+                  WHERE cfa.fileid = f.fileid)
+  AND NOT EXISTS (SELECT 1 FROM module_files AS mf
+                  WHERE mf.fileid = f.fileid)
+  AND NOT EXISTS (SELECT 1 FROM modules AS m WHERE m.recipe = f.fileid)
+  AND NOT EXISTS (SELECT 1 FROM print_style_recipes AS psr
+                  WHERE psr.fileid = f.fileid)
+  AND NOT EXISTS (SELECT 1 FROM default_print_style_recipes AS dpsr
+                  WHERE dpsr.fileid = f.fileid)"""
+
+
+def count_orphans(cursor):
+    """Returns the number of orphan composite modules and collated files
+    and the size of those files in bytes.
+
+    """
+    cursor.execute("SELECT count(*) FROM ({}) AS o"
+                   .format(ORPHAN_MODULES_QUERY))
+    modules = cursor.fetchone()[0]
+    cursor.execute("""\
+SELECT count(*), coalesce(sum(octet_length(file)), 0) FROM files
+WHERE fileid IN ({})""".format(ORPHAN_FILES_QUERY))
+    files, size = cursor.fetchone()
+    return {'modules': modules, 'files': files, 'bytes': int(size)}
+
+
+def remove_orphan_modules(cursor, limit=DEFAULT_BATCH_SIZE):
+    """Remove up to ``limit`` orphan composite modules.
+    Returns the number of modules removed.
+
+    """
+    cursor.execute("""\
+WITH batch AS (
+  {} LIMIT %s FOR UPDATE SKIP LOCKED
+)
+DELETE FROM modules AS m USING batch
+WHERE m.module_ident = batch.module_ident
+RETURNING m.module_ident""".format(ORPHAN_MODULES_QUERY), (limit,))
+    return len(cursor.fetchall())
+
+
+def remove_orphan_files(cursor, limit=DEFAULT_BATCH_SIZE, after=0):
+    """Remove up to ``limit`` orphan collated files, from those
+    with an id greater than ``after``.
+    Returns the number of files removed, their size in bytes and the
+    greatest id of those files (or ``after``), to continue after.
+
+    """
+    cursor.execute("""\
+WITH batch AS (
+  {} AND f.fileid > %s ORDER BY f.fileid LIMIT %s FOR UPDATE SKIP LOCKED
+)
+DELETE FROM files AS f USING batch
+WHERE f.fileid = batch.fileid
+RETURNING f.fileid, octet_length(f.file)""".format(ORPHAN_FILES_QUERY),
+                   (after, limit,))
+    rows = cursor.fetchall()
+    sizes = [size or 0 for fileid, size in rows]
+    return len(sizes), sum(sizes), max([after] + [row[0] for row in rows])
+
+
+def collect_orphans(batch_size=DEFAULT_BATCH_SIZE, dry_run=False, pause=0):
+    """Remove the orphan composite modules and collated files, committing
+    after each batch of ``batch_size`` rows and sleeping ``pause``
+    seconds between batches. With ``dry_run`` nothing is removed.
+    Returns a dictionary of the number of modules, files and bytes
+    (to be) removed, the number of batches and the duration in seconds.
+
+    """
+    start = time.time()
+    stats = {'modules': 0, 'files': 0, 'bytes': 0, 'batches': 0,
+             'dry_run': dry_run}
+
+    def run_batch(func):
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                result = func(cursor, batch_size)
+        stats['batches'] += 1
+        return result
+
+    if dry_run:
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                stats.update(count_orphans(cursor))
+    else:
+        while True:
+            count = run_batch(remove_orphan_modules)
+            stats['modules'] += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+        after = 0
+        while True:
+            count, size, after = run_batch(
+                lambda cursor, limit: remove_orphan_files(cursor, limit,
+                                                          after))
+            stats['files'] += count
+            stats['bytes'] += size
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    stats['duration'] = round(time.time() - start, 3)
+    logger.info('{} orphans: modules={modules} files={files} '
+                'bytes={bytes} batches={batches} duration={duration}s'
+                .format(dry_run and 'Found' or 'Collected', **stats))
+    return stats
+
+
+def format_orphan_stats(stats):
+    """Returns a one line summary of the ``stats`` of a collection."""
+    return ('{verb} {modules} composite modules and {files} collated files '
+            '({bytes} bytes) in {duration}s'
+            .format(verb=stats['dry_run'] and 'Would remove' or 'Removed',
+                    **stats))
+
+
+__all__ = (
+    'collect_orphans',
+    'count_orphans',
+    'format_orphan_stats',
+    'remove_orphan_files',
+    'remove_orphan_modules',
+)
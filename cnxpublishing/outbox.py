@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the durable queue (outbox) of the books waiting for
+post-publication processing (i.e. baking).
+
+A book is put in the outbox by the ``post_publication`` trigger when it is
+set to the 'post-publication' state, or by `enqueue_post_publication`.
+The ``post_publication`` notification that follows is only a signal that
+the outbox has entries, which means the entries made while the channel
+processing process is down are not lost.
+
+Entries are claimed in batches with a lease of a number of seconds.
+Claiming skips the entries that are locked or leased by another consumer,
+so several consumers may take from the outbox at the same time. An entry
+is removed once it has been processed (see `ack_post_publications`).
+An entry that isn't removed before its lease expires, because the consumer
+failed or died, can be claimed again. Thus each entry is processed at least
+once.
+
+"""
+from collections import namedtuple
+
+
+#: Number of entries claimed at a time
+DEFAULT_BATCH_SIZE = 50
+#: Seconds a claimed entry is held by its consumer
+DEFAULT_LEASE = 300
+#: Minimum number of seconds between checking for entries without a signal
+DEFAULT_INTERVAL = 30
+
+
+OutboxEntry = namedtuple('OutboxEntry',
+                         'id module_ident ident_hash attempts')
+
+
+def enqueue_post_publication(cursor, module_ident, ident_hash):
+    """Put the book in the outbox and signal the consumers.
+    Returns the id of the entry.
+
+    """
+    cursor.execute("""\
+INSERT INTO post_publication_outbox (module_ident, ident_hash)
+VALUES (%s, %s)
+RETURNING id""", (module_ident, ident_hash,))
+    entry_id = cursor.fetchone()[0]
+    # If you make changes to the payload, be sure to update the trigger
+    # code as well.
+    cursor.execute("""\
+SELECT pg_notify('post_publication',
+'{"module_ident": '||%s||',
+  "ident_hash": "'||%s||'",
+  "timestamp": "'||CURRENT_TIMESTAMP||'"}')
+""", (module_ident, ident_hash,))
+    return entry_id
+
+
+def enqueue_waiting_post_publications(cursor):
+    """Put the books that are in the 'post-publication' state and are
+    not already in the outbox in the outbox.
+    Returns the number of books put in the outbox.
+
+    """
+    cursor.execute("""\
+INSERT INTO post_publication_outbox (module_ident, ident_hash)
+SELECT m.module_ident,
+       ident_hash(m.uuid, m.major_version, m.minor_version)
+FROM modules AS m
+WHERE m.stateid = (SELECT stateid FROM modulestates
+                   WHERE statename = 'post-publication')
+  AND NOT EXISTS (SELECT 1 FROM post_publication_outbox AS o
+                  WHERE o.module_ident = m.module_ident)
+ORDER BY m.module_ident""")
+    return cursor.rowcount
+
+
+def claim_post_publications(cursor, limit=DEFAULT_BATCH_SIZE,
+                            lease=DEFAULT_LEASE):
+    """Claim up to ``limit`` entries for ``lease`` seconds,
+    oldest first. Returns a list of `OutboxEntry`.
+    The claim must be committed before the entries are processed.
+
+    """
+    cursor.execute("""\
+WITH batch AS (
+  SELECT id FROM post_publication_outbox
+  WHERE leased_until IS NULL OR leased_until < CURRENT_TIMESTAMP
+  ORDER BY id
+  LIMIT %s
+  FOR UPDATE SKIP LOCKED
+)
+UPDATE post_publication_outbox AS o
+SET leased_until = CURRENT_TIMESTAMP + %s * interval '1 second',
+    attempts = o.attempts + 1
+FROM batch
+WHERE o.id = batch.id
+RETURNING o.id, o.module_ident, o.ident_hash, o.attempts""",
+                   (limit, lease,))
+    return sorted([OutboxEntry(*row) for row in cursor.fetchall()])
+
+
+def coalesce_post_publications(entries):
+    """Split ``entries`` into the entries to process and the duplicates,
+    which are the entries for a book that already has an earlier entry.
+    Returns a tuple of the two lists.
+
+    """
+    seen = set()
+    unique, duplicates = [], []
+    for entry in entries:
+        if entry.module_ident in seen:
+            duplicates.append(entry)
+        else:
+            seen.add(entry.module_ident)
+            unique.append(entry)
+    return unique, duplicates
+
+
+def ack_post_publications(cursor, entry_ids):
+    """Remove the processed entries from the outbox."""
+    cursor.execute("DELETE FROM post_publication_outbox WHERE id = ANY(%s)",
+                   (list(entry_ids),))
+
+
+def count_post_publications(cursor):
+    """Returns the number of entries in the outbox
+    and the age in seconds of the oldest entry.
+
+    """
+    cursor.execute("""\
+SELECT count(*),
+       coalesce(extract(epoch FROM CURRENT_TIMESTAMP - min(created)), 0)
+FROM post_publication_outbox""")
+    count, age = cursor.fetchone()
+    return count, float(age)
+
+
+__all__ = (
+    'ack_post_publications',
+    'claim_post_publications',
+    'coalesce_post_publications',
+    'count_post_publications',
+    'enqueue_post_publication',
+    'enqueue_waiting_post_publications',
+    'OutboxEntry',
+)
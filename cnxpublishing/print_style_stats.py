@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the statistics of the print styles shown on the print style
+admin pages (see `cnxpublishing.views.admin.print_styles`).
+
+The number of books baked with each print style and recipe is kept in the
+'print_style_stats' table. The rows of a print style are recounted by a
+trigger on modules when the latest version of a book using it is
+published or removed, and adjusted when its bake state changes, so the
+pages only read a few rows. The changes to a print style's rows are
+serialized with an advisory lock.
+The recipes' details (e.g. title and tag) are looked up when the pages
+are viewed, so new recipe releases don't change the statistics.
+
+"""
+from .db import with_db_cursor
+
+
+@with_db_cursor
+def rebuild_print_style_stats(cursor):
+    """Recount the books of every print style.
+    Returns the number of print style and recipe combinations.
+
+    """
+    cursor.execute("DELETE FROM print_style_stats")
+    cursor.execute("""\
+SELECT refresh_print_style_stats(print_style)
+FROM (SELECT DISTINCT print_style FROM modules
+      WHERE portal_type = 'Collection') AS s""")
+    cursor.execute("SELECT count(*) FROM print_style_stats")
+    return cursor.fetchone()[0]
+
+
+__all__ = (
+    'rebuild_print_style_stats',
+)
@@ -239,7 +239,9 @@ def _insert_file(cursor, file, media_type):
 
     """
     resource_hash = _get_file_sha1(file)
-    cursor.execute("SELECT fileid FROM files WHERE sha1 = %s",
+    # Lock the file so that it isn't collected as an orphan
+    # (see `cnxpublishing.orphans`) before it is referenced.
+    cursor.execute("SELECT fileid FROM files WHERE sha1 = %s FOR KEY SHARE",
                    (resource_hash,))
     try:
         fileid = cursor.fetchone()[0]
@@ -423,18 +425,18 @@ def publish_composite_model(cursor, model, parent_model, publisher, message):
     return ident_hash
 
 
-def publish_collated_document(cursor, model, parent_model):
-    """Publish a given `module`'s collated content in the context of
-    the `parent_model`. Note, the model's content is expected to already
-    have the collated content. This will just persist that content to
-    the archive.
+def add_collated_file(cursor, html):
+    """Add the collated ``html`` file, unless it already exists.
+    Returns the id of the file.
 
     """
-    html = bytes(cnxepub.DocumentContentFormatter(model))
     sha1 = hashlib.new('sha1', html).hexdigest()
-    cursor.execute("SELECT fileid FROM files WHERE sha1 = %s", (sha1,))
+    # Lock the file so that it isn't collected as an orphan
+    # (see `cnxpublishing.orphans`) before it is referenced.
+    cursor.execute("SELECT fileid FROM files WHERE sha1 = %s FOR KEY SHARE",
+                   (sha1,))
     try:
-        fileid = cursor.fetchone()[0]
+        return cursor.fetchone()[0]
     except TypeError:
         file_args = {
             'media_type': 'text/html',
@@ -444,7 +446,14 @@ def publish_collated_document(cursor, model, parent_model):
         INSERT INTO files (file, media_type)
         VALUES (%(data)s, %(media_type)s)
         RETURNING fileid""", file_args)
-        fileid = cursor.fetchone()[0]
+        return cursor.fetchone()[0]
+
+
+def associate_collated_file(cursor, model, parent_model, fileid):
+    """Associate the collated file (by ``fileid``) with the given `module`
+    in the context of the `parent_model`.
+
+    """
     args = {
         'module_ident_hash': model.ident_hash,
         'parent_ident_hash': parent_model.ident_hash,
@@ -463,6 +472,18 @@ VALUES
     cursor.execute(stmt, args)
 
 
+def publish_collated_document(cursor, model, parent_model):
+    """Publish a given `module`'s collated content in the context of
+    the `parent_model`. Note, the model's content is expected to already
+    have the collated content. This will just persist that content to
+    the archive.
+
+    """
+    html = bytes(cnxepub.DocumentContentFormatter(model))
+    fileid = add_collated_file(cursor, html)
+    associate_collated_file(cursor, model, parent_model, fileid)
+
+
 def publish_collated_tree(cursor, tree):
     """Publish a given collated `tree` (containing newly added
     `CompositeDocument` objects and number inforation)
@@ -716,6 +737,8 @@ RETURNING nodeid"""
 
 
 __all__ = (
+    'add_collated_file',
+    'associate_collated_file',
     'bump_version',
     'get_previous_publication',
     'publish_collated_document',
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the scheduling used by the listening loop of the channel
+processing process (see `cnxpublishing.scripts.channel_processing`).
+
+The loop waits on the listening connection until a notification arrives
+or the next periodic task is due, rather than waking up on a fixed
+timeout to check. The periodic tasks (e.g. sending the
+`cnxpublishing.events.ChannelProcessingTickEvent`) run in the same loop.
+When the connection is lost, the loop reconnects after a delay that
+doubles with each failed attempt (see `reconnect_delays`).
+
+"""
+import logging
+import time
+
+
+logger = logging.getLogger('channel_processing')
+
+#: Seconds between the ticks (see `ChannelProcessingTickEvent`)
+DEFAULT_TICK_INTERVAL = 5
+#: Seconds before the first attempt to reconnect
+DEFAULT_RECONNECT_DELAY = 1
+#: Maximum number of seconds between the attempts to reconnect
+DEFAULT_RECONNECT_MAX_DELAY = 60
+
+
+class PeriodicTask(object):
+    """Calls ``func`` every ``interval`` seconds."""
+
+    def __init__(self, func, interval, now):
+        if interval <= 0:
+            raise ValueError('The interval must be positive')
+        self.func = func
+        self.interval = interval
+        self.next_run = now + interval
+
+    def __repr__(self):  # pragma: no cover
+        return '<{} {!r} every {}s>'.format(
+            type(self).__name__, self.func, self.interval)
+
+
+class Scheduler(object):
+    """Runs the periodic tasks when they are due."""
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.tasks = []
+
+    def call_every(self, interval, func):
+        """Call ``func`` every ``interval`` seconds.
+        Returns the `PeriodicTask`.
+
+        """
+        task = PeriodicTask(func, interval, self._clock())
+        self.tasks.append(task)
+        return task
+
+    def timeout(self, maximum=None):
+        """Returns the seconds until the next task is due, at most
+        ``maximum``, or None when there are no tasks and no maximum.
+
+        """
+        timeouts = [max(task.next_run - self._clock(), 0)
+                    for task in self.tasks]
+        if maximum is not None:
+            timeouts.append(maximum)
+        if not timeouts:
+            return None
+        return min(timeouts)
+
+    def run_due(self):
+        """Call the tasks that are due. An exception raised by a task is
+        logged, and the task is called again at its next interval.
+        Returns the number of tasks called.
+
+        """
+        now = self._clock()
+        called = 0
+        for task in self.tasks:
+            if task.next_run > now:
+                continue
+            task.next_run += task.interval
+            if task.next_run <= now:
+                # Skip the runs that were missed, rather than catching up.
+                task.next_run = now + task.interval
+            called += 1
+            try:
+                task.func()
+            except Exception:
+                logger.exception('Periodic task {!r} failed'.format(task))
+        return called
+
+
+def reconnect_delays(delay=DEFAULT_RECONNECT_DELAY,
+                     max_delay=DEFAULT_RECONNECT_MAX_DELAY):
+    """Yields the seconds to wait before each attempt to reconnect,
+    doubling from ``delay`` up to ``max_delay``.
+
+    """
+    while True:
+        yield delay
+        delay = min(delay * 2, max_delay)
+
+
+__all__ = (
+    'PeriodicTask',
+    'reconnect_delays',
+    'Scheduler',
+)
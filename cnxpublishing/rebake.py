@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the orchestration of bulk rebakes (e.g. all the books using a
+print style, after its recipe changed).
+
+A rebake run records the books to rebake. The run is advanced
+periodically by the channel processing process (see
+`cnxpublishing.subscribers.advance_rebakes`). Each time it is advanced,
+the books that finished baking are settled and the next batch of books
+is set to the 'post-publication' state, as long as no more than the
+run's ``concurrency`` books are baking at the same time.
+
+"""
+
+#: Number of books set to bake each time a run is advanced
+DEFAULT_BATCH_SIZE = 5
+#: Number of books from a run that may be baking at the same time
+DEFAULT_CONCURRENCY = 10
+#: Minimum number of seconds between advancing the runs
+DEFAULT_INTERVAL = 30
+
+
+def find_rebake_targets(cursor, print_style=None, uuids=None):
+    """Returns the module_idents of the latest versions of the books
+    using ``print_style`` or of the books identified by ``uuids``.
+
+    """
+    if print_style is not None:
+        criteria, args = 'm.print_style = %s', (print_style,)
+    elif uuids:
+        criteria, args = 'm.uuid = ANY(%s::uuid[])', (list(uuids),)
+    else:
+        raise ValueError('A print style or a list of uuids is required')
+    cursor.execute("""\
+SELECT m.module_ident
+FROM modules AS m
+WHERE m.portal_type = 'Collection'
+  AND {}
+  AND EXISTS (
+      SELECT 1 FROM latest_module_versions
+      WHERE module_ident = m.module_ident)
+ORDER BY m.module_ident""".format(criteria), args)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_rebake_run(cursor, print_style=None, uuids=None,
+                      batch_size=DEFAULT_BATCH_SIZE,
+                      concurrency=DEFAULT_CONCURRENCY, submitter=None):
+    """Create a rebake run for the latest versions of the books using
+    ``print_style`` or of the books identified by ``uuids``.
+    Returns the id of the run.
+
+    """
+    if batch_size < 1 or concurrency < 1:
+        raise ValueError('The batch size and concurrency must be positive')
+    module_idents = find_rebake_targets(cursor, print_style, uuids)
+    if not module_idents:
+        raise ValueError('No books were found to rebake')
+    cursor.execute("""\
+INSERT INTO rebake_runs (print_style, batch_size, concurrency, submitter)
+VALUES (%s, %s, %s, %s)
+RETURNING id""", (print_style, batch_size, concurrency, submitter,))
+    run_id = cursor.fetchone()[0]
+    cursor.execute("""\
+INSERT INTO rebake_run_items (run_id, module_ident)
+SELECT %s, unnest(%s::integer[])""", (run_id, module_idents,))
+    return run_id
+
+
+def advance_rebake_run(cursor, run_id):
+    """Settle the books of the run that have finished baking
+    and set the next batch of books to bake.
+    Returns the module_idents that were set to bake.
+
+    """
+    cursor.execute("""\
+SELECT batch_size, concurrency FROM rebake_runs
+WHERE id = %s AND state = 'running'
+FOR UPDATE""", (run_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return []
+    batch_size, concurrency = row
+
+    cursor.execute("""\
+UPDATE rebake_run_items AS ri
+SET state = CASE WHEN ms.statename = 'errored' THEN 'failed'
+                 ELSE 'done' END
+FROM modules AS m JOIN modulestates AS ms USING (stateid)
+WHERE ri.run_id = %s AND ri.state = 'queued'
+  AND ri.module_ident = m.module_ident
+  AND ms.statename NOT IN ('post-publication', 'processing')""",
+                   (run_id,))
+
+    cursor.execute("""\
+SELECT count(*) FROM rebake_run_items
+WHERE run_id = %s AND state = 'queued'""", (run_id,))
+    capacity = min(batch_size, concurrency - cursor.fetchone()[0])
+    queued = []
+    if capacity > 0:
+        cursor.execute("""\
+WITH batch AS (
+  SELECT module_ident FROM rebake_run_items
+  WHERE run_id = %(run_id)s AND state = 'waiting'
+  ORDER BY module_ident
+  LIMIT %(limit)s
+), queued AS (
+  UPDATE rebake_run_items AS ri SET state = 'queued'
+  FROM batch
+  WHERE ri.run_id = %(run_id)s AND ri.module_ident = batch.module_ident
+  RETURNING ri.module_ident
+), baking AS (
+  UPDATE modules SET stateid = 5
+  WHERE module_ident IN (SELECT module_ident FROM queued)
+    AND stateid NOT IN (5, 6)
+)
+SELECT module_ident FROM queued""", {'run_id': run_id, 'limit': capacity})
+        queued = [x[0] for x in cursor.fetchall()]
+
+    cursor.execute("""\
+UPDATE rebake_runs SET state = 'finished', finished = CURRENT_TIMESTAMP
+WHERE id = %(run_id)s AND NOT EXISTS (
+  SELECT 1 FROM rebake_run_items
+  WHERE run_id = %(run_id)s AND state IN ('waiting', 'queued'))""",
+                   {'run_id': run_id})
+    return queued
+
+
+def advance_rebake_runs(cursor):
+    """Advance all the running rebake runs, oldest first.
+    Returns a mapping of run id to the module_idents set to bake.
+
+    """
+    cursor.execute("SELECT id FROM rebake_runs WHERE state = 'running' "
+                   "ORDER BY created, id")
+    run_ids = [row[0] for row in cursor.fetchall()]
+    return dict([(run_id, advance_rebake_run(cursor, run_id))
+                 for run_id in run_ids])
+
+
+def cancel_rebake_run(cursor, run_id):
+    """Stop setting the books of the run to bake. Books that have already
+    been set to bake are left to finish. Returns False if the run
+    isn't running.
+
+    """
+    cursor.execute("""\
+UPDATE rebake_runs SET state = 'cancelled', finished = CURRENT_TIMESTAMP
+WHERE id = %s AND state = 'running'
+RETURNING id""", (run_id,))
+    return cursor.fetchone() is not None
+
+
+def get_rebake_run_progress(cursor, run_id):
+    """Returns a dictionary describing the progress of the run
+    or None if the run doesn't exist.
+
+    """
+    cursor.execute("""\
+SELECT row_to_json(progress) FROM (
+  SELECT r.id, r.print_style, r.state, r.submitter,
+         r.batch_size, r.concurrency,
+         r.created, r.finished,
+         count(ri.module_ident) AS total,
+         count(CASE WHEN ri.state = 'waiting' THEN 1 END) AS waiting,
+         count(CASE WHEN ri.state = 'queued' THEN 1 END) AS queued,
+         count(CASE WHEN ri.state = 'done' THEN 1 END) AS done,
+         count(CASE WHEN ri.state = 'failed' THEN 1 END) AS failed
+  FROM rebake_runs AS r
+    LEFT JOIN rebake_run_items AS ri ON (r.id = ri.run_id)
+  WHERE r.id = %s
+  GROUP BY r.id
+) AS progress""", (run_id,))
+    row = cursor.fetchone()
+    return row and row[0] or None
+
+
+def format_rebake_run_progress(progress):
+    """Returns a one line summary of the ``progress`` of a run."""
+    return ('Rebake run {id} ({print_style}): {done}/{total} done, '
+            '{failed} failed, {queued} baking, {waiting} waiting; '
+            'state={state}'.format(**progress))
+
+
+__all__ = (
+    'advance_rebake_run',
+    'advance_rebake_runs',
+    'cancel_rebake_run',
+    'create_rebake_run',
+    'find_rebake_targets',
+    'format_rebake_run_progress',
+    'get_rebake_run_progress',
+)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides a scheduler that sits in front of the baking task queue.
+
+Bake requests are held by the scheduler until there is room in the task
+queue. While a request waits it is coalesced with any other request for
+the same book (by uuid), so that only the newest version of the book is
+baked. Requests are released in the order given by the configured policy.
+
+The scheduler is not persisted. It lives in the channel processing
+process, which is the only producer of bake requests. The waiting
+requests are dropped when the process (re)gains the leadership
+(see `cnxpublishing.leadership`), because another process may have
+dispatched them in the meantime.
+
+"""
+import logging
+import threading
+import time
+
+from pyramid.threadlocal import get_current_registry
+
+from .utils import split_ident_hash
+
+
+logger = logging.getLogger('cnxpublishing')
+
+#: Priority tier for books with new content (i.e. never baked)
+NEW_CONTENT = 0
+#: Priority tier for books that are being rebaked (e.g. recipe change)
+REBAKE = 1
+
+#: Release the smallest books first within a tier
+SMALLEST_FIRST = 'smallest-first'
+#: Release the longest waiting books first within a tier
+AGING = 'aging'
+POLICIES = (SMALLEST_FIRST, AGING,)
+
+DEFAULT_POLICY = SMALLEST_FIRST
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_WAIT = 60 * 60  # one hour
+
+
+class BakeRequest(object):
+    """A request to bake a book."""
+
+    def __init__(self, module_ident, ident_hash, is_rebake=False, size=0,
+                 submitted=None):
+        self.module_ident = module_ident
+        self.ident_hash = ident_hash
+        self.uuid, version = split_ident_hash(ident_hash, split_version=True)
+        self.version = tuple([int(x or 0) for x in version])
+        self.is_rebake = is_rebake
+        self.size = size
+        if submitted is None:
+            submitted = time.time()
+        self.submitted = submitted
+
+    def supersedes(self, other):
+        """Is this request for a newer version of the same book?"""
+        return (self.uuid == other.uuid and
+                (self.version, self.module_ident) >
+                (other.version, other.module_ident))
+
+    def __repr__(self):  # pragma: no cover
+        return ('<{} module_ident={} ident_hash={} rebake={} size={}>'
+                .format(type(self).__name__, self.module_ident,
+                        self.ident_hash, self.is_rebake, self.size))
+
+
+class BakeScheduler(object):
+    """Coalescing priority queue of `BakeRequest` objects.
+
+    ``concurrency`` is the number of bakes allowed in the task queue
+    at any one time. ``max_wait`` is the number of seconds after which
+    a waiting request is promoted to the top priority tier, regardless
+    of the policy, in order to avoid starvation.
+
+    """
+
+    def __init__(self, policy=DEFAULT_POLICY,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 max_wait=DEFAULT_MAX_WAIT, clock=time.time):
+        if policy not in POLICIES:
+            raise ValueError("Unknown scheduling policy '{}'. "
+                             "Use one of: {}"
+                             .format(policy, ', '.join(POLICIES)))
+        self.policy = policy
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self._clock = clock
+        self._lock = threading.RLock()
+        # Pending requests by book uuid
+        self._pending = {}
+        # Dispatched requests by task id
+        self._in_flight = {}
+        self.coalesced_count = 0
+        self.dispatched_count = 0
+        self.last_wait_time = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            policy=settings.get('baking.scheduler.policy', DEFAULT_POLICY),
+            concurrency=int(settings.get('baking.scheduler.concurrency',
+                                         DEFAULT_CONCURRENCY)),
+            max_wait=int(settings.get('baking.scheduler.max_wait',
+                                      DEFAULT_MAX_WAIT)),
+        )
+
+    def submit(self, request):
+        """Add the ``request`` to the queue. If a request for the same book
+        is already waiting, only the newest version is kept.
+        Returns the request that was dropped, if any.
+
+        """
+        with self._lock:
+            existing = self._pending.get(request.uuid)
+            if existing is None:
+                self._pending[request.uuid] = request
+                return None
+            self.coalesced_count += 1
+            if existing.module_ident == request.module_ident:
+                # A repeated request for the same version.
+                return None
+            if request.supersedes(existing):
+                # Keep the original submission time so the book
+                # doesn't lose its place in line.
+                request.submitted = min(request.submitted,
+                                        existing.submitted)
+                self._pending[request.uuid] = request
+                dropped = existing
+            else:
+                dropped = request
+            logger.debug('Coalesced bake request {!r} into {!r}'
+                         .format(dropped, self._pending[request.uuid]))
+            return dropped
+
+    def priority(self, request, now=None):
+        """Returns the sort key for ``request``, lowest sorts first."""
+        if now is None:
+            now = self._clock()
+        waited = now - request.submitted
+        tier = REBAKE if request.is_rebake else NEW_CONTENT
+        if self.max_wait and waited >= self.max_wait:
+            tier = NEW_CONTENT
+        if self.policy == SMALLEST_FIRST:
+            return (tier, request.size, request.submitted,
+                    request.module_ident)
+        return (tier, request.submitted, request.module_ident)
+
+    def pop(self):
+        """Remove and return the next request or None if there isn't one.
+        This does not consider capacity; see `take`.
+
+        """
+        with self._lock:
+            if not self._pending:
+                return None
+            now = self._clock()
+            request = min(self._pending.values(),
+                          key=lambda r: self.priority(r, now))
+            del self._pending[request.uuid]
+            self.last_wait_time = now - request.submitted
+            return request
+
+    def clear(self):
+        """Drop the waiting requests. The dispatched requests are kept,
+        they hold capacity until they finish. Returns the number of
+        requests dropped.
+
+        """
+        with self._lock:
+            count = len(self._pending)
+            self._pending = {}
+            return count
+
+    def take(self):
+        """Remove and return as many requests as there is capacity for."""
+        with self._lock:
+            available = max(self.concurrency - len(self._in_flight), 0)
+            requests = []
+            while len(requests) < available:
+                request = self.pop()
+                if request is None:
+                    break
+                requests.append(request)
+            return requests
+
+    def mark_dispatched(self, task_id, request):
+        """Record that ``request`` was sent to the task queue
+        as ``task_id``.
+
+        """
+        with self._lock:
+            self._in_flight[task_id] = request
+            self.dispatched_count += 1
+
+    def mark_finished(self, task_ids):
+        """Release the capacity held by the given ``task_ids``."""
+        with self._lock:
+            for task_id in task_ids:
+                self._in_flight.pop(task_id, None)
+
+    @property
+    def in_flight(self):
+        """Task ids of the dispatched requests"""
+        with self._lock:
+            return list(self._in_flight.keys())
+
+    @property
+    def depth(self):
+        """Number of waiting requests"""
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        """Returns a dictionary describing the state of the queue."""
+        with self._lock:
+            now = self._clock()
+            waits = [now - r.submitted for r in self._pending.values()]
+            return {
+                'depth': len(waits),
+                'in_flight': len(self._in_flight),
+                'oldest_wait': max(waits) if waits else 0,
+                'mean_wait': sum(waits) / len(waits) if waits else 0,
+                'last_wait': self.last_wait_time,
+                'coalesced': self.coalesced_count,
+                'dispatched': self.dispatched_count,
+            }
+
+
+_scheduler_lock = threading.Lock()
+
+
+def get_bake_scheduler(registry=None):
+    """Returns the `BakeScheduler` for the application,
+    creating it from settings on first use.
+
+    """
+    if registry is None:
+        registry = get_current_registry()
+    with _scheduler_lock:
+        scheduler = getattr(registry, 'bake_scheduler', None)
+        if scheduler is None:
+            scheduler = BakeScheduler.from_settings(registry.settings)
+            registry.bake_scheduler = scheduler
+    return scheduler
+
+
+__all__ = (
+    'AGING',
+    'BakeRequest',
+    'BakeScheduler',
+    'get_bake_scheduler',
+    'NEW_CONTENT',
+    'POLICIES',
+    'REBAKE',
+    'SMALLEST_FIRST',
+)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+This script runs a Celery worker dedicated to baking, consuming the
+``baking.queue`` queue and the ``deferred`` queue, where the bakes of
+versions superseded while queued are retried.
+See `cnxpublishing.worker`.
+
+Arguments following the configuration file are given to the Celery worker,
+e.g. ``--concurrency 4``.
+
+"""
+import argparse
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+
+from cnxpublishing.config import configure
+from cnxpublishing.worker import configure_baking_worker
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri', help='configuration file')
+    return parser
+
+
+def main(argv=sys.argv[1:]):  # pragma: no cover
+    args, worker_args = create_parser().parse_known_args(argv)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri)
+    config = configure(settings)
+    celery_app = configure_baking_worker(config.make_celery_app(),
+                                         config.registry)
+    queue = config.registry.settings.get('baking.queue', 'default')
+    queues = [queue] + [q for q in ['deferred'] if q != queue]
+    celery_app.worker_main(['worker', '--pool', 'prefork',
+                            '-Q', ','.join(queues)] + worker_args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,10 +17,13 @@ and `cnxpublishing.events.create_pg_notify_event` (an event factory).
 
 """
 from __future__ import print_function
+import errno
 import logging
 import os
 import select
+import signal
 import sys
+import time
 
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
@@ -28,14 +31,37 @@ from pyramid.paster import bootstrap, setup_logging
 from pyramid.threadlocal import get_current_registry
 
 from cnxpublishing.config import CONNECTION_STRING
+from cnxpublishing.dispatcher import (
+    DEFAULT_COALESCE_WINDOW,
+    DEFAULT_DRAIN_TIMEOUT,
+    DEFAULT_WORKERS,
+    NotificationCoalescer,
+    NotificationDispatcher,
+)
 from cnxpublishing.events import (
     create_pg_notify_event,
     ChannelProcessingStartUpEvent,
+    ChannelProcessingTickEvent,
+)
+from cnxpublishing.leadership import (
+    DEFAULT_STANDBY_INTERVAL,
+    wait_for_leadership,
 )
+from cnxpublishing.metrics import ProcessorMetrics
+from cnxpublishing.reactor import (
+    DEFAULT_RECONNECT_MAX_DELAY,
+    DEFAULT_TICK_INTERVAL,
+    reconnect_delays,
+    Scheduler,
+)
+from cnxpublishing.scheduler import get_bake_scheduler
 
 
 logger = logging.getLogger('channel_processing')
 
+# The dispatcher key of the tick events, which are handled one at a time
+_TICK_KEY = ('tick',)
+
 
 def usage(argv):  # pragma: no cover
     cmd = os.path.basename(argv[0])
@@ -53,38 +79,145 @@ def _get_channels(settings):  # pragma: no cover
     return list(channels)
 
 
+def _notify(registry, event, metrics=None):  # pragma: no cover
+    failed = False
+    started = time.time()
+    try:
+        registry.notify(event)
+    except Exception:
+        failed = True
+        logger.exception('Logging an uncaught exception')
+    if metrics is not None:
+        metrics.observe_handled(event, started, time.time(), failed)
+
+
+def _connect(connection_string, channels, standby_interval,
+             stopping):  # pragma: no cover
+    """Connect, wait to become the active process and listen on the
+    ``channels``. Returns the connection or None if stopped while
+    standing by.
+
+    """
+    # Keepalives detect a connection lost without being closed.
+    conn = psycopg2.connect(connection_string, keepalives=1,
+                            keepalives_idle=30, keepalives_interval=10,
+                            keepalives_count=3)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cursor:
+            # Held until the connection is closed.
+            is_active = wait_for_leadership(cursor, standby_interval,
+                                            stopping=stopping)
+            for channel in is_active and channels or []:
+                cursor.execute('LISTEN {}'.format(channel))
+                logger.debug('Waiting for notifications on channel "{}"'
+                             .format(channel))
+    except Exception:
+        conn.close()
+        raise
+    if not is_active:
+        conn.close()
+        return None
+    return conn
+
+
 def processor():  # pragma: no cover
     """Churns over PostgreSQL notifications on configured channels.
     This requires the application be setup and the registry be available.
     This function uses the database connection string and a list of
     pre configured channels.
 
+    The process waits until a notification arrives or a periodic task is
+    due (see `cnxpublishing.reactor`). The tick event is sent every
+    ``channel_processing.tick_interval`` seconds, skipped while the
+    previous tick is still being handled. When the connection is
+    lost, the process reconnects, waiting up to
+    ``channel_processing.reconnect_max_delay`` seconds between attempts,
+    and sends the start up event again.
+
+    The notifications are coalesced for
+    ``channel_processing.coalesce_window`` seconds, unless it is 0,
+    and handled concurrently, like the tick event
+    (see `cnxpublishing.dispatcher`), unless
+    ``channel_processing.workers`` is 0. On SIGINT or SIGTERM the
+    notifications that have been received are handled before exiting.
+
+    Several replicas of this process may run, but only one is active
+    (see `cnxpublishing.leadership`). The others stand by, trying to
+    take over every ``channel_processing.standby_interval`` seconds.
+
     """
     registry = get_current_registry()
     settings = registry.settings
     connection_string = settings[CONNECTION_STRING]
     channels = _get_channels(settings)
 
-    # Code adapted from
-    # http://initd.org/psycopg/docs/advanced.html#asynchronous-notifications
-    with psycopg2.connect(connection_string) as conn:
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    # Written by `cnxpublishing.subscribers.write_processor_metrics`
+    metrics = registry.processor_metrics = ProcessorMetrics()
+    dispatcher = None
+    if int(settings.get('channel_processing.workers', DEFAULT_WORKERS)):
+        dispatcher = NotificationDispatcher.from_settings(registry, metrics)
+        metrics.sources['dispatcher'] = dispatcher
+    drain_timeout = int(settings.get('channel_processing.drain_timeout',
+                                     DEFAULT_DRAIN_TIMEOUT))
+    standby_interval = float(settings.get(
+        'channel_processing.standby_interval', DEFAULT_STANDBY_INTERVAL))
+    max_delay = float(settings.get('channel_processing.reconnect_max_delay',
+                                   DEFAULT_RECONNECT_MAX_DELAY))
+    coalescer = None
+    if float(settings.get('channel_processing.coalesce_window',
+                          DEFAULT_COALESCE_WINDOW)):
+        coalescer = NotificationCoalescer.from_settings(settings)
+        metrics.coalesced = coalescer.dropped
 
-        with conn.cursor() as cursor:
-            for channel in channels:
-                cursor.execute('LISTEN {}'.format(channel))
-                logger.debug('Waiting for notifications on channel "{}"'
-                             .format(channel))
+    def handle(event):
+        if dispatcher is None:
+            _notify(registry, event, metrics)
+        else:
+            # Blocks while too many events are waiting.
+            dispatcher.submit(event)
+
+    def tick():
+        if dispatcher is None:
+            _notify(registry, ChannelProcessingTickEvent())
+        elif not dispatcher.is_pending(_TICK_KEY):
+            # The subscribers (e.g. draining the outbox) may take a while,
+            # so they are kept off this thread, which waits on the
+            # connection. A tick is skipped while the last one is handled
+            # or too many events are waiting.
+            dispatcher.submit(ChannelProcessingTickEvent(), key=_TICK_KEY,
+                              timeout=0)
+
+    scheduler = Scheduler()
+    scheduler.call_every(
+        float(settings.get('channel_processing.tick_interval',
+                           DEFAULT_TICK_INTERVAL)),
+        tick)
 
-        registry.notify(ChannelProcessingStartUpEvent())
+    stopping = []
 
-        rlist = [conn]  # wait until ready for reading
-        wlist = []  # wait until ready for writing
-        xlist = []  # wait for an "exceptional condition"
-        timeout = 5
+    def stop(signum, frame):
+        logger.info('Stopping on signal {}'.format(signum))
+        stopping.append(signum)
 
-        while True:
-            if select.select(rlist, wlist, xlist, timeout) != ([], [], []):
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def listen(conn):
+        # Code adapted from
+        # http://initd.org/psycopg/docs/advanced.html#asynchronous-notifications
+        while not stopping:
+            next_due = None
+            if coalescer is not None:
+                next_due = coalescer.next_due()
+            wait = scheduler.timeout(next_due)
+            try:
+                ready = select.select([conn], [], [], wait)
+            except select.error as exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+                continue  # interrupted by a signal
+            if ready[0]:
                 conn.poll()
                 while conn.notifies:
                     notif = conn.notifies.pop(0)
@@ -92,10 +225,54 @@ def processor():  # pragma: no cover
                                  .format(notif.pid, notif.channel,
                                          notif.payload))
                     event = create_pg_notify_event(notif)
-                    try:
-                        registry.notify(event)
-                    except Exception:
-                        logger.exception('Logging an uncaught exception')
+                    metrics.observe_received(event)
+                    if coalescer is None:
+                        handle(event)
+                    elif not coalescer.add(event):
+                        logger.debug('Coalesced NOTIFY: channel={} '
+                                     'payload={}'.format(notif.channel,
+                                                         notif.payload))
+            if coalescer is not None:
+                for event in coalescer.pop_due():
+                    handle(event)
+            scheduler.run_due()
+
+    delays = reconnect_delays(max_delay=max_delay)
+    while not stopping:
+        try:
+            conn = _connect(connection_string, channels, standby_interval,
+                            stopping)
+        except psycopg2.OperationalError:
+            delay = next(delays)
+            logger.exception('Unable to connect, retrying in {}s'
+                             .format(delay))
+            time.sleep(delay)
+            continue
+        if conn is None:
+            break
+        delays = reconnect_delays(max_delay=max_delay)
+        # Another process may have dispatched the waiting bake requests
+        # while this one wasn't the leader. The books still waiting are
+        # submitted again by the start up event.
+        dropped = get_bake_scheduler(registry).clear()
+        if dropped:
+            logger.info('Dropped {} waiting bake requests'.format(dropped))
+        try:
+            # Notifications may have been missed while disconnected.
+            registry.notify(ChannelProcessingStartUpEvent())
+            listen(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            logger.exception('Lost the database connection, reconnecting')
+        finally:
+            conn.close()
+
+    if coalescer is not None:
+        for event in coalescer.flush():
+            handle(event)
+        logger.info('Dropped duplicate notifications: {}'
+                    .format(coalescer.dropped))
+    if dispatcher is not None:
+        dispatcher.shutdown(drain_timeout)
 
 
 def main(argv=sys.argv):  # pragma: no cover
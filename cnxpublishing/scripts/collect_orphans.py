@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+This script removes the composite modules and collated files that are no
+longer used by any baked book. It is safe to run while books are baking.
+See `cnxpublishing.orphans`.
+
+"""
+from __future__ import print_function
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from cnxpublishing import orphans
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri', help='configuration file')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only report the number of orphans')
+    parser.add_argument('--batch-size', type=int,
+                        help='number of rows removed in each transaction')
+    parser.add_argument('--pause', type=float,
+                        help='seconds to wait between batches')
+    return parser
+
+
+def main(argv=sys.argv[1:]):  # pragma: no cover
+    args = create_parser().parse_args(argv)
+    env = bootstrap(args.config_uri)
+    setup_logging(args.config_uri)
+    settings = env['registry'].settings
+
+    batch_size = args.batch_size or int(settings.get(
+        'baking.gc.batch_size', orphans.DEFAULT_BATCH_SIZE))
+    pause = args.pause
+    if pause is None:
+        pause = float(settings.get('baking.gc.pause', 0))
+    stats = orphans.collect_orphans(batch_size=batch_size,
+                                    dry_run=args.dry_run, pause=pause)
+    print(orphans.format_orphan_stats(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
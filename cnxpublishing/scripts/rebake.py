@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+This script starts the rebaking of the latest versions of the books using
+a print style, or of a list of books, and reports on the progress.
+
+The books are set to bake in batches by the channel processing process,
+which must be running. See `cnxpublishing.rebake`.
+
+"""
+from __future__ import print_function
+import argparse
+import sys
+import time
+
+from pyramid.paster import bootstrap, setup_logging
+
+from cnxpublishing import rebake
+from cnxpublishing.db import db_connect
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri', help='configuration file')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--print-style',
+                        help='rebake the books using this print style')
+    target.add_argument('--uuid', dest='uuids', action='append',
+                        metavar='UUID', help='rebake this book (repeatable)')
+    target.add_argument('--status', type=int, metavar='RUN_ID',
+                        help='report on the progress of a run')
+    target.add_argument('--cancel', type=int, metavar='RUN_ID',
+                        help='stop a run from setting more books to bake')
+    parser.add_argument('--batch-size', type=int,
+                        help='number of books set to bake at a time')
+    parser.add_argument('--concurrency', type=int,
+                        help='number of books allowed to bake at once')
+    parser.add_argument('--wait', action='store_true',
+                        help='report the progress until the run ends')
+    parser.add_argument('--poll-interval', type=int, default=30,
+                        help='seconds between progress reports (--wait)')
+    return parser
+
+
+def _progress(run_id):
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            return rebake.get_rebake_run_progress(cursor, run_id)
+
+
+def main(argv=sys.argv[1:]):  # pragma: no cover
+    args = create_parser().parse_args(argv)
+    env = bootstrap(args.config_uri)
+    setup_logging(args.config_uri)
+    settings = env['registry'].settings
+
+    if args.status is not None or args.cancel is not None:
+        run_id = args.status or args.cancel
+    else:
+        batch_size = args.batch_size or int(settings.get(
+            'baking.rebake.batch_size', rebake.DEFAULT_BATCH_SIZE))
+        concurrency = args.concurrency or int(settings.get(
+            'baking.rebake.concurrency', rebake.DEFAULT_CONCURRENCY))
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                try:
+                    run_id = rebake.create_rebake_run(
+                        cursor, print_style=args.print_style,
+                        uuids=args.uuids, batch_size=batch_size,
+                        concurrency=concurrency, submitter='cli')
+                except ValueError as exc:
+                    print(exc.message, file=sys.stderr)
+                    return 1
+    if args.cancel is not None:
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                rebake.cancel_rebake_run(cursor, run_id)
+
+    progress = _progress(run_id)
+    if progress is None:
+        print('No rebake run with id {}'.format(run_id), file=sys.stderr)
+        return 1
+    print(rebake.format_rebake_run_progress(progress))
+    while args.wait and progress['state'] == 'running':
+        time.sleep(args.poll_interval)
+        progress = _progress(run_id)
+        print(rebake.format_rebake_run_progress(progress))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
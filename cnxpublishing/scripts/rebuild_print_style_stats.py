@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+This script recounts the books of every print style shown on the print
+style admin pages. The counts are kept up to date as books are baked,
+so this is only needed to backfill or repair them.
+See `cnxpublishing.print_style_stats`.
+
+"""
+from __future__ import print_function
+import argparse
+import sys
+
+from pyramid.paster import bootstrap, setup_logging
+
+from cnxpublishing.print_style_stats import rebuild_print_style_stats
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config_uri', help='configuration file')
+    return parser
+
+
+def main(argv=sys.argv[1:]):  # pragma: no cover
+    args = create_parser().parse_args(argv)
+    bootstrap(args.config_uri)
+    setup_logging(args.config_uri)
+
+    count = rebuild_print_style_stats()
+    print('Counted {} print style and recipe combinations'.format(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'bake_jobs' table, which tracks the state of each baking task
+without needing to look into celery's 'celery_taskmeta' table.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE bake_jobs (
+  -- The celery task id
+  "id" UUID PRIMARY KEY,
+  "module_ident" INTEGER NOT NULL,
+  "state" TEXT NOT NULL DEFAULT 'queued',
+  -- The recipe (files.fileid) used to bake
+  "recipe" INTEGER,
+  -- The hostname of the worker that picked up the task
+  "worker" TEXT,
+  "created" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  "started" TIMESTAMP WITH TIME ZONE,
+  "finished" TIMESTAMP WITH TIME ZONE,
+  "duration" INTERVAL,
+  "traceback" TEXT,
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident"),
+  CHECK ("state" IN ('queued', 'started', 'retry', 'finished', 'failed'))
+)""")
+    cursor.execute("CREATE INDEX bake_jobs_module_ident_idx "
+                   "ON bake_jobs (module_ident)")
+    cursor.execute("CREATE INDEX bake_jobs_state_idx ON bake_jobs (state)")
+
+    # Carry over the history of the existing baking tasks.
+    # The celery tables are created by celery, so may not exist yet.
+    # Only the tasks with a live result can still be worked on, the others
+    # (the results expired or were removed, or were revoked) are failed,
+    # otherwise their books would look queued forever.
+    cursor.execute("SELECT to_regclass('celery_taskmeta') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return
+    cursor.execute("""\
+INSERT INTO bake_jobs
+  (id, module_ident, state, recipe, created, finished, traceback)
+SELECT DISTINCT ON (bpsa.result_id)
+  bpsa.result_id, bpsa.module_ident,
+  CASE ctm.status
+    WHEN 'PENDING' THEN 'queued'
+    WHEN 'STARTED' THEN 'started'
+    WHEN 'RETRY' THEN 'retry'
+    WHEN 'SUCCESS' THEN 'finished'
+    ELSE 'failed'
+  END,
+  m.recipe, bpsa.created,
+  CASE WHEN ctm.status IS NULL
+            OR ctm.status NOT IN ('PENDING', 'STARTED', 'RETRY')
+       THEN coalesce(ctm.date_done, bpsa.created) END,
+  CASE WHEN ctm.status IS NULL
+         THEN 'The task result was no longer available'
+       WHEN ctm.status NOT IN ('PENDING', 'STARTED', 'RETRY', 'SUCCESS',
+                               'FAILURE')
+         THEN coalesce(ctm.traceback, 'The task ended ' || ctm.status)
+       ELSE ctm.traceback END
+FROM document_baking_result_associations AS bpsa
+  JOIN modules AS m USING (module_ident)
+  LEFT JOIN celery_taskmeta AS ctm ON (bpsa.result_id::text = ctm.task_id)
+ORDER BY bpsa.result_id""")
+
+
+def down(cursor):
+    cursor.execute("DROP TABLE bake_jobs")
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds a 'stages' column to 'bake_jobs' for the per stage timing and
+resource measurements of a bake.
+"""
+
+
+def up(cursor):
+    cursor.execute("ALTER TABLE bake_jobs ADD COLUMN stages JSON")
+
+
+def down(cursor):
+    cursor.execute("ALTER TABLE bake_jobs DROP COLUMN stages")
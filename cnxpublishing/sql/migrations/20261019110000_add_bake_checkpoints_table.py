@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'bake_checkpoints' table, which holds the intermediate results
+of a bake, so that a retried bake can resume where the last one stopped.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE bake_checkpoints (
+  "module_ident" INTEGER NOT NULL,
+  -- The recipe (files.fileid) used to bake
+  "recipe" INTEGER NOT NULL,
+  -- The name of the completed stage (e.g. 'collate')
+  "stage" TEXT NOT NULL,
+  "artifact" BYTEA NOT NULL,
+  "created" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY ("module_ident", "recipe", "stage"),
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident")
+    ON DELETE CASCADE
+)""")
+
+
+def down(cursor):
+    cursor.execute("DROP TABLE bake_checkpoints")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'rebake_runs' and 'rebake_run_items' tables, which track the
+bulk rebaking of books (e.g. all the books using a print style).
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE rebake_runs (
+  "id" SERIAL PRIMARY KEY,
+  -- The print style being rebaked or NULL when given a list of books
+  "print_style" TEXT,
+  -- Number of books set to bake at a time
+  "batch_size" INTEGER NOT NULL,
+  -- Number of books from this run that may be baking at any one time
+  "concurrency" INTEGER NOT NULL,
+  "submitter" TEXT,
+  "state" TEXT NOT NULL DEFAULT 'running',
+  "created" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  "finished" TIMESTAMP WITH TIME ZONE,
+  CHECK ("state" IN ('running', 'finished', 'cancelled'))
+)""")
+    cursor.execute("""\
+CREATE TABLE rebake_run_items (
+  "run_id" INTEGER NOT NULL,
+  "module_ident" INTEGER NOT NULL,
+  "state" TEXT NOT NULL DEFAULT 'waiting',
+  PRIMARY KEY ("run_id", "module_ident"),
+  FOREIGN KEY ("run_id") REFERENCES rebake_runs ("id") ON DELETE CASCADE,
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident"),
+  CHECK ("state" IN ('waiting', 'queued', 'done', 'failed'))
+)""")
+    cursor.execute("CREATE INDEX rebake_run_items_state_idx "
+                   "ON rebake_run_items (run_id, state)")
+
+
+def down(cursor):
+    cursor.execute("DROP TABLE rebake_run_items")
+    cursor.execute("DROP TABLE rebake_runs")
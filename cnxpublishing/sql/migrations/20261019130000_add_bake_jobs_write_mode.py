@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds a 'write_mode' column to 'bake_jobs' recording whether the baked
+book was written in full, in part or not at all (unchanged).
+"""
+
+
+def up(cursor):
+    cursor.execute("ALTER TABLE bake_jobs ADD COLUMN write_mode TEXT")
+
+
+def down(cursor):
+    cursor.execute("ALTER TABLE bake_jobs DROP COLUMN write_mode")
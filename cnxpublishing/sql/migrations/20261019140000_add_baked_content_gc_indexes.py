@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the indexes used to remove baked trees and to find the collated
+files and composite modules that are no longer referenced.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE INDEX IF NOT EXISTS trees_parent_id_idx ON trees (parent_id);
+CREATE INDEX IF NOT EXISTS collated_file_associations_fileid_idx
+  ON collated_file_associations (fileid);
+CREATE INDEX IF NOT EXISTS module_files_fileid_idx ON module_files (fileid);
+CREATE INDEX IF NOT EXISTS modules_recipe_idx ON modules (recipe);""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP INDEX IF EXISTS trees_parent_id_idx;
+DROP INDEX IF EXISTS collated_file_associations_fileid_idx;
+DROP INDEX IF EXISTS module_files_fileid_idx;
+DROP INDEX IF EXISTS modules_recipe_idx;""")
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'post_publication_outbox' table, the durable queue of the books
+waiting for post-publication processing, and changes the
+``post_publication`` trigger to put the book in it before notifying.
+The books already in the 'post-publication' state are put in the outbox.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE post_publication_outbox (
+  "id" BIGSERIAL PRIMARY KEY,
+  "module_ident" INTEGER NOT NULL,
+  "ident_hash" TEXT NOT NULL,
+  "created" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- The entry is being processed by a consumer until this time
+  "leased_until" TIMESTAMP WITH TIME ZONE,
+  -- Number of times the entry has been claimed
+  "attempts" INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY ("module_ident") REFERENCES modules ("module_ident")
+    ON DELETE CASCADE
+)""")
+    cursor.execute("CREATE INDEX post_publication_outbox_module_ident_idx "
+                   "ON post_publication_outbox (module_ident)")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+DECLARE
+  _ident_hash TEXT := ident_hash(NEW.uuid, NEW.major_version,
+                                 NEW.minor_version);
+BEGIN
+  -- Skip if this is an update of a module already in the state.
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.stateid != 5) THEN
+    INSERT INTO post_publication_outbox (module_ident, ident_hash)
+      VALUES (NEW.module_ident, _ident_hash);
+    -- Only signals the outbox has entries, but the payload is kept
+    -- for the other listeners.
+    PERFORM pg_notify('post_publication',
+                      '{"module_ident": '||NEW.module_ident||
+                      ', "ident_hash": "'||_ident_hash||
+                      '", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+INSERT INTO post_publication_outbox (module_ident, ident_hash)
+SELECT module_ident, ident_hash(uuid, major_version, minor_version)
+FROM modules WHERE stateid = 5
+ORDER BY module_ident""")
+
+
+def down(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION post_publication() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.stateid != 5) THEN
+    PERFORM pg_notify('post_publication',
+                      '{"module_ident": '||NEW.module_ident||
+                      ', "ident_hash": "'||
+                      ident_hash(NEW.uuid, NEW.major_version,
+                                 NEW.minor_version)||
+                      '", "timestamp": "'||CURRENT_TIMESTAMP||'"}');
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("DROP TABLE post_publication_outbox")
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds a partial index of the modules waiting to be baked or baking
+(i.e. in the 'post-publication' or 'processing' state), which is used
+to report the baking backlog.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE INDEX IF NOT EXISTS modules_baking_stateid_idx
+  ON modules (stateid) WHERE stateid IN (5, 6)""")
+
+
+def down(cursor):
+    cursor.execute("DROP INDEX IF EXISTS modules_baking_stateid_idx")
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the indexes used to page through the baking attempts on the
+content status admin page, which are ordered by when the bake was
+requested, and to filter them by book.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE INDEX IF NOT EXISTS document_baking_result_associations_created_idx
+  ON document_baking_result_associations (created, result_id);
+CREATE INDEX IF NOT EXISTS
+  document_baking_result_associations_module_ident_idx
+  ON document_baking_result_associations (module_ident);
+CREATE INDEX IF NOT EXISTS modules_authors_idx
+  ON modules USING GIN (authors);""")
+
+
+def down(cursor):
+    cursor.execute("""\
+DROP INDEX IF EXISTS document_baking_result_associations_created_idx;
+DROP INDEX IF EXISTS document_baking_result_associations_module_ident_idx;
+DROP INDEX IF EXISTS modules_authors_idx;""")
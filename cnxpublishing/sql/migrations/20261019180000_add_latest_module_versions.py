@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'latest_module_versions' table, which maps each uuid to the
+latest version published, whatever its state, and the triggers that
+keep it up to date as modules are published and removed.
+Unlike 'latest_modules', the version is in the table as soon as it is
+published, rather than once it has been baked.
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE latest_module_versions (
+  "uuid" UUID PRIMARY KEY,
+  "module_ident" INTEGER NOT NULL UNIQUE,
+  "major_version" INTEGER,
+  "minor_version" INTEGER
+)""")
+    cursor.execute("""\
+INSERT INTO latest_module_versions
+  (uuid, module_ident, major_version, minor_version)
+SELECT DISTINCT ON (uuid) uuid, module_ident, major_version, minor_version
+FROM modules
+ORDER BY uuid, ARRAY[major_version, minor_version] DESC""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_latest_module_versions() RETURNS trigger
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO latest_module_versions AS lv
+      (uuid, module_ident, major_version, minor_version)
+      VALUES (NEW.uuid, NEW.module_ident, NEW.major_version,
+              NEW.minor_version)
+    ON CONFLICT (uuid) DO UPDATE
+      SET module_ident = EXCLUDED.module_ident,
+          major_version = EXCLUDED.major_version,
+          minor_version = EXCLUDED.minor_version
+      -- Compared like max(ARRAY[major_version, minor_version]) does.
+      WHERE ARRAY[EXCLUDED.major_version, EXCLUDED.minor_version]
+            > ARRAY[lv.major_version, lv.minor_version];
+    RETURN NEW;
+  END IF;
+  -- The latest version was removed, so the previous one is the latest.
+  DELETE FROM latest_module_versions WHERE module_ident = OLD.module_ident;
+  IF FOUND THEN
+    INSERT INTO latest_module_versions
+      (uuid, module_ident, major_version, minor_version)
+    SELECT uuid, module_ident, major_version, minor_version
+    FROM modules WHERE uuid = OLD.uuid
+    ORDER BY ARRAY[major_version, minor_version] DESC
+    LIMIT 1;
+  END IF;
+  RETURN OLD;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER update_latest_module_versions
+  AFTER INSERT OR DELETE ON modules
+  FOR EACH ROW EXECUTE PROCEDURE update_latest_module_versions()""")
+
+
+def down(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS update_latest_module_versions "
+                   "ON modules")
+    cursor.execute("DROP FUNCTION IF EXISTS update_latest_module_versions()")
+    cursor.execute("DROP TABLE latest_module_versions")
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the 'print_style_stats' table, the number of books baked (or baking)
+with each print style and recipe, and the triggers that keep it up to date
+as books are published, baked and removed. Only the latest version of
+each book is counted (see the 'latest_module_versions' table).
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE TABLE print_style_stats (
+  "print_style" TEXT,
+  "recipe" INTEGER NOT NULL,
+  -- Number of books
+  "count" INTEGER NOT NULL,
+  -- Number of books that are not in the 'current' state
+  "bad" INTEGER NOT NULL,
+  -- When the most recently revised book was revised
+  "revised" TIMESTAMP WITH TIME ZONE
+)""")
+    cursor.execute("""\
+CREATE UNIQUE INDEX print_style_stats_print_style_recipe_idx
+  ON print_style_stats (coalesce(print_style, ''), recipe)""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS modules_print_style_idx "
+                   "ON modules (print_style)")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION lock_print_style_stats(_print_style TEXT)
+RETURNS void AS $$
+BEGIN
+  -- Serializes the changes to a print style's rows, which otherwise
+  -- may be recounted by two transactions at once.
+  PERFORM pg_advisory_xact_lock(hashtext('print_style_stats'),
+                                hashtext(coalesce(_print_style, '')));
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION refresh_print_style_stats(_print_style TEXT)
+RETURNS void AS $$
+BEGIN
+  PERFORM lock_print_style_stats(_print_style);
+  DELETE FROM print_style_stats
+    WHERE print_style IS NOT DISTINCT FROM _print_style;
+  INSERT INTO print_style_stats (print_style, recipe, count, bad, revised)
+  SELECT m.print_style, m.recipe, count(*),
+         count(*) FILTER (WHERE ms.statename != 'current'),
+         max(m.revised)
+  FROM modules AS m
+    JOIN latest_module_versions AS lv ON lv.module_ident = m.module_ident
+    JOIN modulestates AS ms ON ms.stateid = m.stateid
+  WHERE m.print_style IS NOT DISTINCT FROM _print_style
+    AND m.portal_type = 'Collection'
+    AND m.recipe IS NOT NULL
+    AND (m.baked IS NOT NULL
+         OR ms.statename NOT IN ('current', 'fallback'))
+  GROUP BY m.print_style, m.recipe;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_print_style_stats() RETURNS trigger AS $$
+DECLARE
+  _module modules%ROWTYPE;
+  _print_style TEXT;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    _module := OLD;
+  ELSE
+    _module := NEW;
+  END IF;
+  IF _module.portal_type != 'Collection' THEN
+    RETURN NULL;
+  END IF;
+  -- Publishing or removing a version changes which version is
+  -- the latest, which may have another print style.
+  FOR _print_style IN
+    SELECT print_style FROM modules WHERE uuid = _module.uuid
+    UNION SELECT _module.print_style
+    ORDER BY 1
+  LOOP
+    PERFORM refresh_print_style_stats(_print_style);
+  END LOOP;
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION update_print_style_stats_on_bake()
+RETURNS trigger AS $$
+DECLARE
+  _old_state TEXT;
+  _new_state TEXT;
+  _old_counted BOOLEAN;
+  _new_counted BOOLEAN;
+  _old_bad BOOLEAN;
+  _new_bad BOOLEAN;
+BEGIN
+  -- Only the latest version of a book is counted.
+  IF NOT EXISTS (SELECT 1 FROM latest_module_versions
+                 WHERE module_ident = NEW.module_ident) THEN
+    RETURN NULL;
+  END IF;
+  IF OLD.print_style IS DISTINCT FROM NEW.print_style
+     OR OLD.recipe IS DISTINCT FROM NEW.recipe THEN
+    PERFORM refresh_print_style_stats(_print_style)
+    FROM (SELECT OLD.print_style UNION SELECT NEW.print_style
+          ORDER BY 1) AS s (_print_style);
+    RETURN NULL;
+  END IF;
+  SELECT statename INTO _old_state FROM modulestates
+    WHERE stateid = OLD.stateid;
+  SELECT statename INTO _new_state FROM modulestates
+    WHERE stateid = NEW.stateid;
+  _old_counted := coalesce(
+    NEW.recipe IS NOT NULL AND (
+      OLD.baked IS NOT NULL OR _old_state NOT IN ('current', 'fallback')),
+    FALSE);
+  _new_counted := coalesce(
+    NEW.recipe IS NOT NULL AND (
+      NEW.baked IS NOT NULL OR _new_state NOT IN ('current', 'fallback')),
+    FALSE);
+  _old_bad := _old_counted AND _old_state IS DISTINCT FROM 'current';
+  _new_bad := _new_counted AND _new_state IS DISTINCT FROM 'current';
+  IF _old_counted AND NOT _new_counted THEN
+    -- The book no longer counts, which may change when the most
+    -- recently revised book was revised.
+    PERFORM refresh_print_style_stats(NEW.print_style);
+    RETURN NULL;
+  END IF;
+  IF _old_counted = _new_counted AND _old_bad = _new_bad THEN
+    RETURN NULL;
+  END IF;
+  PERFORM lock_print_style_stats(NEW.print_style);
+  INSERT INTO print_style_stats (print_style, recipe, count, bad, revised)
+  VALUES (NEW.print_style, NEW.recipe,
+          _new_counted::int - _old_counted::int,
+          _new_bad::int - _old_bad::int,
+          NEW.revised)
+  ON CONFLICT ((coalesce(print_style, '')), recipe) DO UPDATE
+    SET count = print_style_stats.count + EXCLUDED.count,
+        bad = print_style_stats.bad + EXCLUDED.bad,
+        revised = greatest(print_style_stats.revised, EXCLUDED.revised);
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    # N.B. These run after the 'update_latest_module_versions' trigger,
+    # because triggers on the same event run in the order of their names.
+    cursor.execute("""\
+CREATE TRIGGER update_print_style_stats
+  AFTER INSERT OR DELETE ON modules
+  FOR EACH ROW EXECUTE PROCEDURE update_print_style_stats()""")
+    # The bake state changes are counted by difference, so changing
+    # the state of many books doesn't recount their print styles.
+    cursor.execute("""\
+CREATE TRIGGER update_print_style_stats_on_bake
+  AFTER UPDATE OF print_style, recipe, baked, stateid ON modules
+  FOR EACH ROW
+  WHEN (NEW.portal_type = 'Collection'
+        AND (OLD.print_style, OLD.recipe, OLD.baked, OLD.stateid)
+            IS DISTINCT FROM
+            (NEW.print_style, NEW.recipe, NEW.baked, NEW.stateid))
+  EXECUTE PROCEDURE update_print_style_stats_on_bake()""")
+    cursor.execute("""\
+SELECT refresh_print_style_stats(print_style)
+FROM (SELECT DISTINCT print_style FROM modules
+      WHERE portal_type = 'Collection') AS s""")
+
+
+def down(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS update_print_style_stats_on_bake "
+                   "ON modules")
+    cursor.execute("DROP TRIGGER IF EXISTS update_print_style_stats "
+                   "ON modules")
+    cursor.execute("DROP FUNCTION IF EXISTS "
+                   "update_print_style_stats_on_bake()")
+    cursor.execute("DROP FUNCTION IF EXISTS update_print_style_stats()")
+    cursor.execute("DROP FUNCTION IF EXISTS refresh_print_style_stats(TEXT)")
+    cursor.execute("DROP FUNCTION IF EXISTS lock_print_style_stats(TEXT)")
+    cursor.execute("DROP INDEX IF EXISTS modules_print_style_idx")
+    cursor.execute("DROP TABLE print_style_stats")
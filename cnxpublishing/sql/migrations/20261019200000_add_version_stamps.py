@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds version stamps to publications and document controls, which are
+used to answer conditional requests (i.e. ETag and Last-Modified).
+A publication is stamped when it is updated. A document's controls are
+stamped when its license or any of its license acceptances, role
+acceptances or ACL entries change.
+"""
+
+
+def up(cursor):
+    cursor.execute("CREATE SEQUENCE version_stamps_seq")
+    for table in ('publications', 'document_controls'):
+        cursor.execute("""\
+ALTER TABLE {}
+  ADD COLUMN "version" BIGINT NOT NULL
+    DEFAULT nextval('version_stamps_seq'),
+  ADD COLUMN "modified" TIMESTAMP WITH TIME ZONE NOT NULL
+    DEFAULT CURRENT_TIMESTAMP""".format(table))
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION stamp_version() RETURNS trigger AS $$
+BEGIN
+  NEW.version := nextval('version_stamps_seq');
+  NEW.modified := CURRENT_TIMESTAMP;
+  RETURN NEW;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER stamp_publication_version
+  BEFORE UPDATE ON publications
+  FOR EACH ROW EXECUTE PROCEDURE stamp_version()""")
+    cursor.execute("""\
+CREATE TRIGGER stamp_document_controls_version
+  BEFORE UPDATE OF licenseid ON document_controls
+  FOR EACH ROW EXECUTE PROCEDURE stamp_version()""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION stamp_document_controls_version()
+RETURNS trigger AS $$
+DECLARE
+  _uuid UUID;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    _uuid := OLD.uuid;
+  ELSE
+    _uuid := NEW.uuid;
+  END IF;
+  UPDATE document_controls
+    SET version = nextval('version_stamps_seq'),
+        modified = CURRENT_TIMESTAMP
+    WHERE uuid = _uuid;
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    for table in ('license_acceptances', 'role_acceptances', 'document_acl'):
+        cursor.execute("""\
+CREATE TRIGGER stamp_document_controls_version
+  AFTER INSERT OR UPDATE OR DELETE ON {}
+  FOR EACH ROW EXECUTE PROCEDURE stamp_document_controls_version()"""
+                       .format(table))
+
+
+def down(cursor):
+    for table in ('license_acceptances', 'role_acceptances', 'document_acl',
+                  'document_controls'):
+        cursor.execute("DROP TRIGGER IF EXISTS stamp_document_controls_version"
+                       " ON {}".format(table))
+    cursor.execute("DROP TRIGGER IF EXISTS stamp_publication_version "
+                   "ON publications")
+    cursor.execute("DROP FUNCTION IF EXISTS stamp_document_controls_version()")
+    cursor.execute("DROP FUNCTION IF EXISTS stamp_version()")
+    for table in ('publications', 'document_controls'):
+        cursor.execute("ALTER TABLE {} DROP COLUMN version, "
+                       "DROP COLUMN modified".format(table))
+    cursor.execute("DROP SEQUENCE version_stamps_seq")
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds the triggers that notify the 'publication_state' channel when a
+publication is updated and the 'bake_state' channel when the state of
+a book or of its bake changes, which wake the long polling requests
+(see `cnxpublishing.longpoll`).
+"""
+
+
+def up(cursor):
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION notify_publication_state() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('publication_state',
+                    json_build_object('id', NEW.id,
+                                      'state', NEW.state)::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER notify_publication_state
+  AFTER UPDATE ON publications
+  FOR EACH ROW EXECUTE PROCEDURE notify_publication_state()""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION notify_bake_state() RETURNS trigger AS $$
+DECLARE
+  _uuid UUID;
+BEGIN
+  IF TG_TABLE_NAME = 'modules' THEN
+    _uuid := NEW.uuid;
+  ELSE
+    SELECT uuid INTO _uuid FROM modules
+      WHERE module_ident = NEW.module_ident;
+  END IF;
+  PERFORM pg_notify('bake_state',
+                    json_build_object('uuid', _uuid,
+                                      'module_ident', NEW.module_ident)::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER notify_bake_state
+  AFTER INSERT OR UPDATE OF state ON bake_jobs
+  FOR EACH ROW EXECUTE PROCEDURE notify_bake_state()""")
+    cursor.execute("""\
+CREATE TRIGGER notify_bake_state
+  AFTER UPDATE OF stateid ON modules
+  FOR EACH ROW
+  WHEN (NEW.portal_type = 'Collection'
+        AND OLD.stateid IS DISTINCT FROM NEW.stateid)
+  EXECUTE PROCEDURE notify_bake_state()""")
+
+
+def down(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS notify_bake_state ON modules")
+    cursor.execute("DROP TRIGGER IF EXISTS notify_bake_state ON bake_jobs")
+    cursor.execute("DROP FUNCTION IF EXISTS notify_bake_state()")
+    cursor.execute("DROP TRIGGER IF EXISTS notify_publication_state "
+                   "ON publications")
+    cursor.execute("DROP FUNCTION IF EXISTS notify_publication_state()")
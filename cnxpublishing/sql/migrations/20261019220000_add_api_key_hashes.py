@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""\
+Adds an indexed hash of the api keys, which they are looked up by,
+and the trigger that notifies the 'api_keys' channel when they change,
+which invalidates the web processes' api key caches
+(see `cnxpublishing.authnz`).
+"""
+
+
+def up(cursor):
+    cursor.execute("ALTER TABLE api_keys ADD COLUMN key_hash TEXT")
+    cursor.execute("UPDATE api_keys SET key_hash = sha1(key)")
+    cursor.execute("CREATE INDEX api_keys_key_hash_idx "
+                   "ON api_keys (key_hash)")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION hash_api_key() RETURNS trigger AS $$
+BEGIN
+  NEW.key_hash := sha1(NEW.key);
+  RETURN NEW;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER hash_api_key
+  BEFORE INSERT OR UPDATE OF key ON api_keys
+  FOR EACH ROW EXECUTE PROCEDURE hash_api_key()""")
+    cursor.execute("""\
+CREATE OR REPLACE FUNCTION notify_api_keys() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('api_keys', TG_OP);
+  RETURN NULL;
+END;
+$$ LANGUAGE 'plpgsql'""")
+    cursor.execute("""\
+CREATE TRIGGER notify_api_keys
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON api_keys
+  FOR EACH STATEMENT EXECUTE PROCEDURE notify_api_keys()""")
+
+
+def down(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS notify_api_keys ON api_keys")
+    cursor.execute("DROP FUNCTION IF EXISTS notify_api_keys()")
+    cursor.execute("DROP TRIGGER IF EXISTS hash_api_key ON api_keys")
+    cursor.execute("DROP FUNCTION IF EXISTS hash_api_key()")
+    cursor.execute("ALTER TABLE api_keys DROP COLUMN IF EXISTS key_hash")
@@ -2,86 +2,400 @@
 from __future__ import absolute_import
 
 import logging
+import time
+import traceback
+import uuid
 
-from celery.exceptions import SoftTimeLimitExceeded
+from celery.exceptions import Retry, SoftTimeLimitExceeded
 from cnxarchive.scripts import export_epub
 from pyramid.events import subscriber
 from pyramid.threadlocal import get_current_registry
 
 
-from . import events, utils
-from .bake import remove_baked, bake
+from . import events, metrics, outbox, rebake, utils
+from .bake import BakeCheckpoints, COLLATED, remove_baked, bake
 from .db import (
+    add_bake_jobs,
+    BAKE_JOB_ACTIVE_STATES,
+    db_connect,
+    set_bake_job_state,
     update_module_state,
     with_db_cursor,
 )
+from .exceptions import BakeMemoryExceeded
+from .instrumentation import BakeStats
+from .scheduler import BakeRequest, get_bake_scheduler
 from .tasks import task
 
 
 logger = logging.getLogger('cnxpublishing')
 
 
-@with_db_cursor
-def track_baking_proc_state(result, module_ident, cursor):
-    cursor.execute('INSERT INTO document_baking_result_associations '
-                   '(module_ident, result_id) VALUES (%s, %s)',
-                   (module_ident, result.id))
+#: Number of bake tasks sent to the task queue per second (0 is no limit)
+DEFAULT_DISPATCH_RATE = 10
 
 
 @subscriber(events.PostPublicationEvent)
+def post_publication_processing(event):
+    """Process the books waiting in the post-publication outbox.
+    The event is only a signal that the outbox has entries
+    (see `cnxpublishing.outbox`).
+
+    """
+    drain_post_publications()
+
+
+@subscriber(events.ChannelProcessingTickEvent)
+def check_post_publication_outbox(event):
+    """Process the books in the post-publication outbox every
+    ``post_publication.outbox.interval`` seconds, which picks up the
+    entries whose signal was missed or whose lease expired.
+
+    """
+    registry = get_current_registry()
+    interval = int(registry.settings.get('post_publication.outbox.interval',
+                                         outbox.DEFAULT_INTERVAL))
+    now = time.time()
+    if now - getattr(registry, 'outbox_checked', 0) < interval:
+        return
+    registry.outbox_checked = now
+    drain_post_publications()
+
+
+def drain_post_publications():
+    """Claim and process the entries of the post-publication outbox
+    in batches, until the outbox has no more entries to claim.
+    Returns the number of entries processed.
+
+    """
+    settings = get_current_registry().settings
+    batch_size = int(settings.get('post_publication.outbox.batch_size',
+                                  outbox.DEFAULT_BATCH_SIZE))
+    lease = int(settings.get('post_publication.outbox.lease',
+                             outbox.DEFAULT_LEASE))
+    processed = 0
+    while True:
+        # The claim is committed before the entries are processed.
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                claimed = outbox.claim_post_publications(cursor, batch_size,
+                                                         lease)
+                entries, duplicates = outbox.coalesce_post_publications(
+                    claimed)
+                outbox.ack_post_publications(
+                    cursor, [entry.id for entry in duplicates])
+        if duplicates:
+            logger.debug('Dropped {} duplicate outbox entries'
+                         .format(len(duplicates)))
+        if entries:
+            processed += _process_outbox_page(entries)
+            dispatch_bake_requests()
+        if len(claimed) < batch_size:
+            break
+    return processed
+
+
+def _process_outbox_page(entries):
+    """Process the page of outbox ``entries`` together, falling back to
+    processing them one at a time when that fails, so one bad entry
+    doesn't hold back the others. Returns the number processed.
+
+    """
+    try:
+        _process_outbox_entries(entries)
+        return len(entries)
+    except Exception:
+        if len(entries) == 1:
+            # Left in the outbox, to be retried once the lease expires.
+            logger.exception('Unable to process outbox entry {}'
+                             .format(entries[0]))
+            return 0
+        logger.exception('Unable to process the page of outbox entries, '
+                         'processing them one at a time')
+    return sum([_process_outbox_page([entry]) for entry in entries])
+
+
 @with_db_cursor
-def post_publication_processing(event, cursor):
-    """Process post-publication events coming out of the database."""
-    module_ident, ident_hash = event.module_ident, event.ident_hash
+def _process_outbox_entries(entries, cursor):
+    for entry in entries:
+        if entry.attempts > 1:
+            logger.warning('Retrying outbox entry {}'.format(entry))
+    process_post_publications(
+        [(entry.module_ident, entry.ident_hash) for entry in entries],
+        cursor)
+    outbox.ack_post_publications(cursor, [entry.id for entry in entries])
+
+
+def process_post_publication(module_ident, ident_hash, cursor):
+    """Queue the book for baking, unless it is already queued."""
+    process_post_publications([(module_ident, ident_hash)], cursor)
+    cursor.connection.commit()
+    dispatch_bake_requests(cursor=cursor)
 
-    celery_app = get_current_registry().celery_app
 
+def process_post_publications(books, cursor):
+    """Submit the ``books``, a sequence of (module_ident, ident_hash)
+    tuples, to the bake scheduler, unless already queued. Dispatching
+    the requests (see `dispatch_bake_requests`) is left to the caller.
+    Returns the number of books submitted.
+
+    """
     # Check baking is not already queued.
-    cursor.execute('SELECT status '
-                   'FROM document_baking_result_associations d '
-                   'JOIN celery_taskmeta t ON d.result_id::text = t.task_id '
-                   'WHERE module_ident = %s', (module_ident,))
-    for result in cursor.fetchall():
-        state = result[0]
-        if state in ('QUEUED', 'STARTED', 'RETRY'):
-            logger.debug('Already queued module_ident={} ident_hash={}'.format(
-                module_ident, ident_hash))
-            return
-
-    logger.debug('Queued for processing module_ident={} ident_hash={}'.format(
-        module_ident, ident_hash))
-    recipe_ids = _get_recipe_ids(module_ident, cursor)
-    update_module_state(cursor, module_ident, 'processing', recipe_ids[0])
-    # Commit the state change before preceding.
+    queued = _get_queued([module_ident for module_ident, _ in books], cursor)
+    for module_ident, ident_hash in books:
+        if module_ident in queued:
+            logger.debug('Already queued module_ident={} ident_hash={}'
+                         .format(module_ident, ident_hash))
+    books = [book for book in books if book[0] not in queued]
+    if not books:
+        return 0
+
+    scheduler = get_bake_scheduler()
+    superseded = []
+    for request in _make_bake_requests(books, cursor):
+        dropped = scheduler.submit(request)
+        if dropped is not None:
+            # Only the newest version of a book is baked.
+            logger.debug('Superseded module_ident={} ident_hash={}'
+                         .format(dropped.module_ident, dropped.ident_hash))
+            superseded.append(dropped.module_ident)
+    if superseded:
+        _mark_obsolete(superseded, cursor)
+    return len(books)
+
+
+@subscriber(events.ChannelProcessingTickEvent)
+def dispatch_waiting_bake_requests(event):
+    """Release waiting bake requests as capacity becomes available."""
+    # Avoid connecting to the database when there is nothing to do.
+    if get_bake_scheduler().depth == 0:
+        return
+    dispatch_bake_requests()
+
+
+@subscriber(events.ChannelProcessingTickEvent)
+def advance_rebakes(event):
+    """Advance the bulk rebake runs every ``baking.rebake.interval``
+    seconds.
+
+    """
+    registry = get_current_registry()
+    interval = int(registry.settings.get('baking.rebake.interval',
+                                         rebake.DEFAULT_INTERVAL))
+    now = time.time()
+    if now - getattr(registry, 'rebakes_advanced', 0) < interval:
+        return
+    registry.rebakes_advanced = now
+    advance_rebake_runs()
+
+
+@subscriber(events.ChannelProcessingTickEvent)
+def write_processor_metrics(event):
+    """Write the channel processing metrics (see `cnxpublishing.metrics`)
+    to ``channel_processing.metrics.path`` every
+    ``channel_processing.metrics.interval`` seconds.
+
+    """
+    registry = get_current_registry()
+    processor_metrics = getattr(registry, 'processor_metrics', None)
+    path = registry.settings.get('channel_processing.metrics.path')
+    if processor_metrics is None or not path:
+        return
+    interval = int(registry.settings.get('channel_processing.metrics.interval',
+                                         metrics.DEFAULT_INTERVAL))
+    now = time.time()
+    if now - getattr(registry, 'metrics_written', 0) < interval:
+        return
+    registry.metrics_written = now
+    processor_metrics.sources['bake_scheduler'] = get_bake_scheduler()
+    try:
+        update_backlog_metrics(processor_metrics)
+        processor_metrics.write(path)
+    except Exception:
+        logger.exception('Unable to write the metrics')
+
+
+@with_db_cursor
+def update_backlog_metrics(processor_metrics, cursor):
+    """Set the gauges of the books waiting to be baked or baking
+    and of the post-publication outbox.
+
+    """
+    states = ('post-publication', 'processing',)
+    cursor.execute("SELECT statename, stateid FROM modulestates "
+                   "WHERE statename IN %s", (states,))
+    stateids = dict(cursor.fetchall())
+    # The ids are given as literals, which matches the partial index
+    # on the modules' stateid.
+    cursor.execute("SELECT stateid, count(*) FROM modules "
+                   "WHERE stateid IN %s GROUP BY stateid",
+                   (tuple(stateids.values()),))
+    counts = dict(cursor.fetchall())
+    for state in states:
+        processor_metrics.set_gauge(
+            'modules_backlog', counts.get(stateids.get(state), 0),
+            'Books waiting to be baked or baking', state=state)
+    count, age = outbox.count_post_publications(cursor)
+    processor_metrics.set_gauge('outbox_entries', count,
+                                'Entries in the post-publication outbox')
+    processor_metrics.set_gauge('outbox_oldest_seconds', age,
+                                'Age of the oldest outbox entry')
+
+
+@with_db_cursor
+def advance_rebake_runs(cursor):
+    for run_id, queued in rebake.advance_rebake_runs(cursor).items():
+        progress = rebake.get_rebake_run_progress(cursor, run_id)
+        logger.info(rebake.format_rebake_run_progress(progress))
+        if queued:
+            logger.debug('Rebake run {} set to bake module_idents={}'
+                         .format(run_id, queued))
+
+
+@with_db_cursor
+def dispatch_bake_requests(cursor):
+    """Send as many waiting bake requests to the task queue
+    as the scheduler has capacity for.
+
+    """
+    scheduler = get_bake_scheduler()
+    in_flight = scheduler.in_flight
+    if in_flight:
+        cursor.execute("SELECT id::text FROM bake_jobs "
+                       "WHERE id = ANY(%s::uuid[]) AND state = ANY(%s)",
+                       (in_flight, list(BAKE_JOB_ACTIVE_STATES),))
+        active = set([row[0] for row in cursor.fetchall()])
+        scheduler.mark_finished(set(in_flight) - active)
+
+    requests = scheduler.take()
+    if requests:
+        # Another process may have queued them since they were submitted,
+        # e.g. while this one wasn't the leader.
+        queued = _get_queued([r.module_ident for r in requests], cursor)
+        for request in requests:
+            if request.module_ident in queued:
+                logger.debug('Already queued module_ident={} ident_hash={}'
+                             .format(request.module_ident,
+                                     request.ident_hash))
+        requests = [r for r in requests if r.module_ident not in queued]
+    if requests:
+        rate = float(get_current_registry().settings.get(
+            'baking.dispatch.rate', DEFAULT_DISPATCH_RATE))
+        results = _queue_bakes(requests, cursor, rate)
+        for request, result in zip(requests, results):
+            scheduler.mark_dispatched(result.id, request)
+            logger.debug('Dispatched module_ident={} ident_hash={} '
+                         'after waiting {:.1f}s'
+                         .format(request.module_ident, request.ident_hash,
+                                 scheduler.last_wait_time))
+    logger.debug('Bake scheduler stats: {}'.format(scheduler.stats()))
+
+
+def _get_queued(module_idents, cursor):
+    """Returns the set of the ``module_idents`` with an active bake job."""
+    cursor.execute('SELECT DISTINCT module_ident FROM bake_jobs '
+                   'WHERE module_ident = ANY(%s) AND state = ANY(%s)',
+                   (list(module_idents), list(BAKE_JOB_ACTIVE_STATES),))
+    return set([row[0] for row in cursor.fetchall()])
+
+
+def _make_bake_requests(books, cursor):
+    """Creates a `BakeRequest` for each of the ``books``, a sequence of
+    (module_ident, ident_hash) tuples, sized by the number of nodes in
+    the book's (raw) tree.
+
+    """
+    cursor.execute("""\
+WITH RECURSIVE t(root, nodeid) AS (
+    SELECT documentid, nodeid FROM trees
+    WHERE documentid = ANY(%(module_idents)s)
+      AND parent_id IS NULL AND NOT is_collated
+UNION ALL
+    SELECT t.root, c.nodeid FROM trees AS c JOIN t ON (c.parent_id = t.nodeid)
+    WHERE NOT c.is_collated
+)
+SELECT m.module_ident, m.baked IS NOT NULL, coalesce(sizes.size, 0)
+FROM modules AS m
+  LEFT JOIN (SELECT root, count(*) AS size FROM t GROUP BY root) AS sizes
+    ON (sizes.root = m.module_ident)
+WHERE m.module_ident = ANY(%(module_idents)s)""",
+                   {'module_idents': [book[0] for book in books]})
+    rows = dict([(row[0], row[1:]) for row in cursor.fetchall()])
+    requests = []
+    for module_ident, ident_hash in books:
+        is_rebake, size = rows.get(module_ident, (False, 0))
+        requests.append(BakeRequest(module_ident, ident_hash,
+                                    is_rebake=bool(is_rebake), size=size))
+    return requests
+
+
+def _mark_obsolete(module_idents, cursor):
+    cursor.execute("""\
+UPDATE modules
+SET stateid = (SELECT stateid FROM modulestates WHERE statename = 'obsolete')
+WHERE module_ident = ANY(%s)""", (list(module_idents),))
+
+
+def _queue_bakes(requests, cursor, rate=0):
+    """Puts the books of the ``requests`` in the processing state and sends
+    them to the task queue, at most ``rate`` per second (when given).
+    Returns the tasks' results.
+
+    """
+    celery_app = get_current_registry().celery_app
+
+    module_idents = [request.module_ident for request in requests]
+    recipe_ids = _get_recipe_ids_by_module(module_idents, cursor)
+    jobs = [(str(uuid.uuid4()), module_ident,
+             recipe_ids.get(module_ident, (None,))[0])
+            for module_ident in module_idents]
+    job_ids, _, recipes = zip(*jobs)
+    cursor.execute("""\
+UPDATE modules AS m
+SET stateid = (SELECT stateid FROM modulestates
+               WHERE statename = 'processing'),
+    recipe = q.recipe, baked = now()
+FROM unnest(%s::integer[], %s::integer[]) AS q(module_ident, recipe)
+WHERE m.module_ident = q.module_ident""", (module_idents, list(recipes),))
+    # Save the jobs before queuing, so the tasks always find their record.
+    add_bake_jobs(cursor, jobs)
+    cursor.execute("""\
+INSERT INTO document_baking_result_associations (module_ident, result_id)
+SELECT * FROM unnest(%s::integer[], %s::uuid[])""",
+                   (module_idents, list(job_ids),))
+    # Commit the state changes before preceding.
     cursor.connection.commit()
 
     # Start of task
     # FIXME Looking up the task isn't the most clear usage here.
     task_name = 'cnxpublishing.subscribers.baking_processor'
     baking_processor = celery_app.tasks[task_name]
-    result = baking_processor.delay(module_ident, ident_hash)
-    baking_processor.backend.store_result(result.id, None, 'QUEUED')
-
-    # Save the mapping between a celery task and this event.
-    track_baking_proc_state(result, module_ident, cursor)
-
+    results = []
+    for request, job_id in zip(requests, job_ids):
+        if results and rate:
+            time.sleep(1.0 / rate)
+        logger.debug('Queued for processing module_ident={} ident_hash={}'
+                     .format(request.module_ident, request.ident_hash))
+        try:
+            results.append(baking_processor.apply_async(
+                (request.module_ident, request.ident_hash), task_id=job_id))
+        except Exception:
+            # Don't leave the jobs looking like they're in the queue.
+            for unsent_job_id in job_ids[len(results):]:
+                set_bake_job_state(cursor, unsent_job_id, 'failed',
+                                   traceback=traceback.format_exc())
+            cursor.connection.commit()
+            raise
+    return results
 
-def _get_recipe_ids(module_ident, cursor):
-    """Returns a tuple of length 2 of primary and fallback recipe ids.
 
-    The primary will be based on the print_style of the book. It is the first
-    of:
-        1. default recipe currently associated with the print_style of the book
-           being baked (defined by module_ident)
-        2. A CSS file associated with this book that is named the same as the
-           print_style
-        3. A CSS file associated with this book that is named 'ruleset.css'
+def _get_recipe_ids_by_module(module_idents, cursor):
+    """Returns a mapping of module_ident to the tuple of primary and
+    fallback recipe ids of each of the books (see `_get_recipe_ids`).
 
-        The fallback is the recipe used for last successful bake of this book,
-        if different than the primary. Either value or both values may be
-        None"""
-
-    cursor.execute("""select coalesce(dpsf.fileid, mf.fileid, mf2.fileid),
+    """
+    cursor.execute("""select m.module_ident,
+                         coalesce(dpsf.fileid, mf.fileid, mf2.fileid),
                          CASE
                            WHEN lm.recipe != coalesce(dpsf.fileid,
                                                       mf.fileid,
@@ -99,125 +413,233 @@ def _get_recipe_ids(module_ident, cursor):
                                          AND mf2.filename = 'ruleset.css'
                                      LEFT JOIN latest_modules lm
                                          ON m.uuid = lm.uuid
-                      WHERE m.module_ident = %s""", (module_ident,))
-    return cursor.fetchone()
+                      WHERE m.module_ident = ANY(%s)""",
+                   (list(module_idents),))
+    return dict([(row[0], tuple(row[1:])) for row in cursor.fetchall()])
+
+
+def _get_recipe_ids(module_ident, cursor):
+    """Returns a tuple of length 2 of primary and fallback recipe ids.
+
+    The primary will be based on the print_style of the book. It is the first
+    of:
+        1. default recipe currently associated with the print_style of the book
+           being baked (defined by module_ident)
+        2. A CSS file associated with this book that is named the same as the
+           print_style
+        3. A CSS file associated with this book that is named 'ruleset.css'
+
+        The fallback is the recipe used for last successful bake of this book,
+        if different than the primary. Either value or both values may be
+        None"""
+
+    return _get_recipe_ids_by_module([module_ident], cursor).get(module_ident)
 
 
 @task(bind=True, time_limit=14400, soft_time_limit=10800)
 @with_db_cursor
 def baking_processor(self, module_ident, ident_hash, cursor=None):
+    job_id = self.request.id
+    _record_bake_job_state(job_id, 'started', worker=self.request.hostname)
+    stats = BakeStats()
+    checkpoints = BakeCheckpoints.from_settings(module_ident)
+    try:
+        recipe_id = _process_baking(self, module_ident, ident_hash,
+                                    stats.wrap_cursor(cursor), stats,
+                                    checkpoints)
+    except Retry:
+        _record_bake_job_state(job_id, 'retry')
+        raise
+    except (SoftTimeLimitExceeded, BakeMemoryExceeded) as exc:
+        reason = (isinstance(exc, BakeMemoryExceeded) and
+                  'ran out of memory' or 'timed out')
+        if checkpoints.saved and self.request.retries < self.max_retries:
+            # Progress was made, so try again from the last checkpoint.
+            logger.warning('Baking {} for module {}, retrying '
+                           'from the last checkpoint'
+                           .format(reason, module_ident))
+            _record_bake_job_state(job_id, 'retry', stages=stats.to_json())
+            raise self.retry(countdown=0)
+        logger.exception('Baking {} for module {}'
+                         .format(reason, module_ident))
+        # Discard the partly written bake, so only the state is changed.
+        cursor.connection.rollback()
+        checkpoints.clear(cursor)
+        update_module_state(cursor, module_ident, 'errored', None)
+        _record_bake_job_state(job_id, 'failed',
+                               traceback=traceback.format_exc(),
+                               stages=stats.to_json(),
+                               write_mode=stats.write_mode)
+    except Exception:
+        _clear_bake_checkpoints(checkpoints)
+        _record_bake_job_state(job_id, 'failed',
+                               traceback=traceback.format_exc(),
+                               stages=stats.to_json(),
+                               write_mode=stats.write_mode)
+        raise
+    else:
+        _record_bake_job_state(job_id, 'finished', recipe=recipe_id,
+                               stages=stats.to_json(),
+                               write_mode=stats.write_mode)
+    finally:
+        stats.log(module_ident, ident_hash)
+
+
+def _record_bake_job_state(job_id, state, **kwargs):
+    """Records the bake job's state outside of the baking transaction,
+    which may be rolled back.
+
+    """
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            set_bake_job_state(cursor, job_id, state, **kwargs)
+
+
+def _clear_bake_checkpoints(checkpoints):
+    """Removes the checkpoints of a failed bake outside of the baking
+    transaction, which is rolled back.
+
+    """
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            checkpoints.clear(cursor)
+
+
+def _export_binder(module_ident, ident_hash, cursor, stats):
     try:
-        if self.request.retries == 0:
-            cursor.execute("""\
+        with stats.stage('export'):
+            return export_epub.factory(ident_hash)
+    except:  # noqa: E722
+        logger.exception('Logging an uncaught exception during baking'
+                         'ident_hash={} module_ident={}'
+                         .format(ident_hash, module_ident))
+        # FIXME If the top module doesn't exist, this is going to fail.
+        update_module_state(cursor, module_ident, 'errored', None)
+        raise
+    finally:
+        logger.debug('Exported module_ident={} ident_hash={}'
+                     .format(module_ident, ident_hash))
+
+
+def _process_baking(task, module_ident, ident_hash, cursor, stats,
+                    checkpoints):
+    """Bakes the book and returns the id of the recipe that was used.
+    The stages of the bake are measured into ``stats``. The book is
+    only exported when there is no collated checkpoint to resume from.
+
+    """
+    if task.request.retries == 0:
+        cursor.execute("""\
 SELECT module_ident, ident_hash(uuid, major_version, minor_version)
 FROM modules NATURAL JOIN modulestates
 WHERE uuid = %s AND statename IN ('post-publication', 'processing')
 ORDER BY major_version DESC, minor_version DESC""",
-                           (utils.split_ident_hash(ident_hash)[0],))
-            latest_module_ident = cursor.fetchone()
-            if latest_module_ident:
-                if latest_module_ident[0] != module_ident:
-                    logger.debug("""\
+                       (utils.split_ident_hash(ident_hash)[0],))
+        latest_module_ident = cursor.fetchone()
+        if latest_module_ident:
+            if latest_module_ident[0] != module_ident:
+                logger.debug("""\
 More recent version (module_ident={} ident_hash={}) in queue. \
 Move this message (module_ident={} ident_hash={}) \
 to the deferred (low priority) queue"""
-                                 .format(latest_module_ident[0],
-                                         latest_module_ident[1],
-                                         module_ident, ident_hash))
+                             .format(latest_module_ident[0],
+                                     latest_module_ident[1],
+                                     module_ident, ident_hash))
 
-                    raise self.retry(queue='deferred')
-            else:
-                # In case we can't find the latest version being baked, we'll
-                # continue with baking this one
-                pass
+                raise task.retry(queue='deferred')
+        else:
+            # In case we can't find the latest version being baked, we'll
+            # continue with baking this one
+            pass
 
-        logger.debug('Starting baking module_ident={} ident_hash={}'
-                     .format(module_ident, ident_hash))
+    logger.debug('Starting baking module_ident={} ident_hash={}'
+                 .format(module_ident, ident_hash))
 
-        recipe_ids = _get_recipe_ids(module_ident, cursor)
+    recipe_ids = _get_recipe_ids(module_ident, cursor)
 
-        state = 'current'
-        if recipe_ids[0] is None:
+    state = 'current'
+    if recipe_ids[0] is None:
+        with stats.stage('remove_baked'):
             remove_baked(ident_hash, cursor=cursor)
-            logger.debug('Finished unbaking module_ident={} ident_hash={} '
-                         'with a final state of \'{}\'.'
-                         .format(module_ident, ident_hash, state))
-            update_module_state(cursor, module_ident, state, None)
-            return
+        logger.debug('Finished unbaking module_ident={} ident_hash={} '
+                     'with a final state of \'{}\'.'
+                     .format(module_ident, ident_hash, state))
+        update_module_state(cursor, module_ident, state, None)
+        return None
 
-        try:
-            binder = export_epub.factory(ident_hash)
-        except:  # noqa: E722
-            logger.exception('Logging an uncaught exception during baking'
-                             'ident_hash={} module_ident={}'
-                             .format(ident_hash, module_ident))
-            # FIXME If the top module doesn't exist, this is going to fail.
-            update_module_state(cursor, module_ident, 'errored', None)
-            raise
-        finally:
-            logger.debug('Exported module_ident={} ident_hash={}'
-                         .format(module_ident, ident_hash))
+    binder = None
+    if checkpoints.load(recipe_ids[0], COLLATED, cursor) is None:
+        binder = _export_binder(module_ident, ident_hash, cursor, stats)
 
-        cursor.execute("""\
+    cursor.execute("""\
 SELECT submitter, submitlog FROM modules
 WHERE ident_hash(uuid, major_version, minor_version) = %s""",
-                       (ident_hash,))
-        publisher, message = cursor.fetchone()
-        remove_baked(ident_hash, cursor=cursor)
-
-        for recipe_id in recipe_ids:
-            try:
-                bake(binder, recipe_id, publisher, message, cursor=cursor)
-            except Exception:
-                if state == 'current' and recipe_ids[1] is not None:
-                    state = 'fallback'
-                    logger.exception('Exception while baking module {}.'
-                                     'Falling back...'
-                                     .format(module_ident))
-                    continue
-                else:
-                    state = 'errored'
-                    # TODO rollback to pre-removal of the baked content??
-                    cursor.connection.rollback()
-                    logger.exception('Uncaught exception while'
-                                     'baking module {}'
-                                     .format(module_ident))
-                    update_module_state(cursor, module_ident, state, recipe_id)
-                    raise
+                   (ident_hash,))
+    publisher, message = cursor.fetchone()
+
+    for recipe_id in recipe_ids:
+        try:
+            if (binder is None and
+                    checkpoints.load(recipe_id, COLLATED, cursor) is None):
+                binder = _export_binder(module_ident, ident_hash, cursor,
+                                        stats)
+            bake(binder, recipe_id, publisher, message, cursor=cursor,
+                 stats=stats, checkpoints=checkpoints)
+        except BakeMemoryExceeded:
+            # Not a problem with the recipe, so don't fall back.
+            raise
+        except Exception:
+            if state == 'current' and recipe_ids[1] is not None:
+                state = 'fallback'
+                logger.exception('Exception while baking module {}.'
+                                 'Falling back...'
+                                 .format(module_ident))
+                continue
             else:
-                logger.debug('Finished baking module_ident={} ident_hash={} '
-                             'with a final state of \'{}\'.'
-                             .format(module_ident, ident_hash, state))
+                state = 'errored'
+                # TODO rollback to pre-removal of the baked content??
+                cursor.connection.rollback()
+                logger.exception('Uncaught exception while'
+                                 'baking module {}'
+                                 .format(module_ident))
                 update_module_state(cursor, module_ident, state, recipe_id)
-                break
-    except SoftTimeLimitExceeded:
-        logger.exception('Baking timed out for module {}'
-                         .format(module_ident))
-        update_module_state(cursor, module_ident, 'errored', None)
+                raise
+        else:
+            logger.debug('Finished baking module_ident={} ident_hash={} '
+                         'with a final state of \'{}\'.'
+                         .format(module_ident, ident_hash, state))
+            checkpoints.clear(cursor)
+            update_module_state(cursor, module_ident, state, recipe_id)
+            return recipe_id
 
 
 @subscriber(events.ChannelProcessingStartUpEvent)
 @with_db_cursor
 def post_publication_start_up(event, cursor):
-    # If you make changes to the payload, be sure to update the trigger
-    # code as well.
-    cursor.execute("""\
-SELECT pg_notify('post_publication',
-                 '{"module_ident": '||
-                 module_ident||
-                 ', "ident_hash": "'||
-                 ident_hash(uuid, major_version, minor_version)||
-                 '", "timestamp": "'||
-                 CURRENT_TIMESTAMP||
-                 '"}')
-FROM modules
-WHERE stateid = (
-    SELECT stateid
-    FROM modulestates
-    WHERE statename = 'post-publication');""")
+    """Put the books in the 'post-publication' state that are missing from
+    the outbox (i.e. set to that state by other means than the trigger)
+    in the outbox and signal that the outbox has entries.
+
+    """
+    count = outbox.enqueue_waiting_post_publications(cursor)
+    if count:
+        logger.info('Put {} books waiting for post-publication '
+                    'in the outbox'.format(count))
+    # A single signal, the entries are processed in batches.
+    cursor.execute("SELECT pg_notify('post_publication', '')")
 
 
 __all__ = (
+    'advance_rebake_runs',
+    'advance_rebakes',
+    'check_post_publication_outbox',
+    'dispatch_bake_requests',
+    'dispatch_waiting_bake_requests',
+    'drain_post_publications',
     'post_publication_processing',
     'post_publication_start_up',
+    'process_post_publication',
+    'process_post_publications',
+    'update_backlog_metrics',
+    'write_processor_metrics',
 )
@@ -23,8 +23,10 @@ class PyramidAwareTask(celery.Task):
     """
 
     def __call__(self, *args, **kwargs):
-        # Prepare the pyramid environment.
-        if 'pyramid_config' in self.app.conf:
+        # Prepare the pyramid environment, unless the worker process
+        # has done so once for all its tasks (see `cnxpublishing.worker`).
+        if ('pyramid_config' in self.app.conf and
+                not self.app.conf.get('pyramid_prepared', False)):
             pyramid_config = self.app.conf['pyramid_config']
             env = prepare(registry=pyramid_config.registry)  # noqa
         # Now run the original...
@@ -66,16 +68,23 @@ def includeme(config):
 
     config.registry.celery_app = celery.Celery('tasks')
 
+    baking_queue = settings.get('baking.queue', 'default')
+    queues = [Queue('default'), Queue('deferred')]
+    if baking_queue not in ('default', 'deferred'):
+        queues.append(Queue(baking_queue))
+
     config.registry.celery_app.conf.update(
         broker_url=settings['celery.broker'],
         result_backend=settings['celery.backend'],
         result_persistent=True,
         task_track_started=True,
         task_default_queue='default',
-        task_queues=(
-            Queue('default'),
-            Queue('deferred'),
-        ),
+        task_queues=tuple(queues),
+        task_routes={
+            'cnxpublishing.subscribers.baking_processor': {
+                'queue': baking_queue,
+            },
+        },
     )
 
     # Override the existing Task class.
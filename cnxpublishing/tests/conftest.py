@@ -5,7 +5,11 @@ import cnxepub
 import pytest
 
 from . import use_cases
-from .testing import config_uri, integration_test_settings
+from .testing import (
+    apply_migrations,
+    config_uri,
+    integration_test_settings,
+)
 
 
 @pytest.fixture(autouse=True, scope='session')
@@ -23,6 +27,9 @@ def db_init_and_wipe(db_engines, db_wipe, db_init):
     #   because previous connections may not be virtualenv initialized.
     for engine in db_engines.values():
         engine.dispose()
+    # Apply this project's schema changes.
+    from cnxpublishing.config import CONNECTION_STRING
+    apply_migrations(integration_test_settings()[CONNECTION_STRING])
 
 
 # Override cnx-db's settings fixture.
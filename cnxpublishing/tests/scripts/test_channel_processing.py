@@ -112,6 +112,7 @@ class ChannelProcessingTestCase(unittest.TestCase):
             from cnxpublishing import events
             interfaces = [
                 events.ChannelProcessingStartUpEvent,
+                events.ChannelProcessingTickEvent,
                 events.PostPublicationEvent,
             ]
             handlers = list(registry.registeredHandlers())
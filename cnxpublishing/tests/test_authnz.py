@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+
+from pyramid import security, testing
+
+
+class CountingPolicy(object):
+
+    def __init__(self, userid, principals):
+        self.userid = userid
+        self.principals = principals
+        self.calls = []
+
+    def authenticated_userid(self, request):
+        self.calls.append('authenticated_userid')
+        return self.userid
+
+    unauthenticated_userid = authenticated_userid
+
+    def effective_principals(self, request):
+        self.calls.append('effective_principals')
+        return self.principals
+
+    def remember(self, request, principal, **kw):
+        return []
+
+    def forget(self, request):
+        return []
+
+
+class MemoizingMultiAuthenticationPolicyTestCase(unittest.TestCase):
+
+    def make_one(self, *policies):
+        from cnxpublishing.authnz import MemoizingMultiAuthenticationPolicy
+        return MemoizingMultiAuthenticationPolicy(policies)
+
+    def test_once_per_request(self):
+        api_key_policy = CountingPolicy(None, [])
+        accounts_policy = CountingPolicy('smoo', ['smoo', 'g:publishers'])
+        policy = self.make_one(api_key_policy, accounts_policy)
+        request = testing.DummyRequest()
+
+        for i in range(3):
+            self.assertEqual(policy.authenticated_userid(request), 'smoo')
+            self.assertEqual(
+                sorted(policy.effective_principals(request)),
+                sorted([security.Everyone, 'smoo', 'g:publishers']))
+        self.assertEqual(accounts_policy.calls,
+                         ['authenticated_userid', 'effective_principals'])
+
+        # Each request resolves its own principals.
+        self.assertEqual(
+            policy.authenticated_userid(testing.DummyRequest()), 'smoo')
+        self.assertEqual(len(accounts_policy.calls), 3)
+
+    def test_forget(self):
+        accounts_policy = CountingPolicy('smoo', [])
+        policy = self.make_one(accounts_policy)
+        request = testing.DummyRequest()
+
+        policy.authenticated_userid(request)
+        policy.forget(request)
+        policy.authenticated_userid(request)
+        self.assertEqual(accounts_policy.calls,
+                         ['authenticated_userid'] * 2)
+
+
+class HashAPIKeyTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.authnz import hash_api_key
+        expected = 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3'
+        self.assertEqual(hash_api_key(b'test'), expected)
+        self.assertEqual(hash_api_key(u'test'), expected)
@@ -7,10 +7,12 @@
 # ###
 import os
 import inspect
+import json
 try:
     from unittest import mock
 except ImportError:
     import mock
+from pyramid.threadlocal import get_current_registry
 from vcr_unittest import VCRMixin
 
 import cnxepub
@@ -133,6 +135,199 @@ WHERE
             self.assertIn(content, self._get_baked_file(cursor, doc, binder))
 
 
+class BakeCheckpointsTestCase(BaseDatabaseIntegrationTestCase):
+
+    @property
+    def target(self):
+        from cnxpublishing.bake import bake
+        return bake
+
+    def make_one(self, module_ident):
+        from cnxpublishing.bake import BakeCheckpoints
+        return BakeCheckpoints(module_ident)
+
+    @db_connect
+    def test_resume_from_collated(self, cursor):
+        binder = use_cases.setup_COMPLEX_BOOK_ONE_in_archive(self, cursor)
+        cursor.execute("SELECT module_ident FROM modules "
+                       "WHERE ident_hash(uuid, major_version, "
+                       "                 minor_version) = %s",
+                       (binder.ident_hash,))
+        module_ident = cursor.fetchone()[0]
+        cursor.connection.commit()
+        publisher = 'ream'
+        msg = 'part of collated publish'
+        fake_recipe_id = 1
+        baked_doc_content = '<body><p>collated</p></body>'
+
+        def cnxepub_collate(binder_model, ruleset=None, includes=None):
+            binder_model[0][0].content = baked_doc_content
+            return binder_model
+
+        checkpoints = self.make_one(module_ident)
+        with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
+            mock_collate.side_effect = cnxepub_collate
+            self.target(binder, fake_recipe_id, publisher, msg,
+                        checkpoints=checkpoints)
+        self.assertEqual(checkpoints.saved, [(fake_recipe_id, 'collate')])
+
+        # Simulate a failed attempt, which rolls back the baked content.
+        from cnxpublishing.bake import remove_baked
+        remove_baked(binder.ident_hash, cursor=cursor)
+        cursor.connection.commit()
+
+        checkpoints = self.make_one(module_ident)
+        with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
+            self.target(None, fake_recipe_id, publisher, msg,
+                        cursor=cursor, checkpoints=checkpoints)
+            self.assertFalse(mock_collate.called)
+
+        cursor.execute("SELECT tree_to_json(%s, %s, TRUE)::json;",
+                       (binder.id, binder.metadata['version'],))
+        baked_tree = cursor.fetchone()[0]
+        self.assertEqual(baked_tree['slug'], u'book-of-infinity')
+
+        # The checkpoints are removed in the transaction of the bake.
+        checkpoints.clear(cursor)
+        cursor.execute("SELECT count(*) FROM bake_checkpoints "
+                       "WHERE module_ident = %s", (module_ident,))
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class BakeMemoryCeilingTestCase(BaseDatabaseIntegrationTestCase):
+
+    @db_connect
+    def test_checkpoint_saved(self, cursor):
+        from cnxpublishing.bake import BakeCheckpoints, bake
+        from cnxpublishing.exceptions import BakeMemoryExceeded
+        binder = use_cases.setup_COMPLEX_BOOK_ONE_in_archive(self, cursor)
+        cursor.execute("SELECT module_ident FROM modules "
+                       "WHERE ident_hash(uuid, major_version, "
+                       "                 minor_version) = %s",
+                       (binder.ident_hash,))
+        module_ident = cursor.fetchone()[0]
+        cursor.connection.commit()
+
+        checkpoints = BakeCheckpoints(module_ident)
+        with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
+            mock_collate.side_effect = lambda b, ruleset, includes: b
+            with self.assertRaises(BakeMemoryExceeded):
+                bake(binder, 1, 'ream', 'part of collated publish',
+                     cursor=cursor, checkpoints=checkpoints, max_rss=1)
+        # The collated book is kept for the retry.
+        self.assertEqual(checkpoints.saved, [(1, 'collate')])
+
+        cursor.execute("SELECT tree_to_json(%s, %s, TRUE)::json;",
+                       (binder.id, binder.metadata['version'],))
+        self.assertEqual(cursor.fetchone()[0], None)
+
+    @db_connect
+    def test_consecutive_overruns(self, cursor):
+        from cnxpublishing.bake import BakeCheckpoints, bake, WRITTEN
+        from cnxpublishing.exceptions import BakeMemoryExceeded
+        binder = use_cases.setup_COMPLEX_BOOK_ONE_in_archive(self, cursor)
+        cursor.execute("SELECT module_ident FROM modules "
+                       "WHERE ident_hash(uuid, major_version, "
+                       "                 minor_version) = %s",
+                       (binder.ident_hash,))
+        module_ident = cursor.fetchone()[0]
+        cursor.connection.commit()
+
+        def attempt(binder, rss_checks):
+            """Bake, running out of memory after ``rss_checks`` checks."""
+            checks = []
+
+            def current_rss():
+                checks.append(None)
+                return len(checks) > rss_checks and 2 or 1
+
+            checkpoints = BakeCheckpoints(module_ident, batch_size=1)
+            with mock.patch('cnxpublishing.bake.collate_models') as collate, \
+                    mock.patch('cnxpublishing.bake.current_rss') as rss:
+                collate.side_effect = lambda b, ruleset, includes: b
+                rss.side_effect = current_rss
+                try:
+                    bake(binder, 1, 'ream', 'part of collated publish',
+                         cursor=cursor, checkpoints=checkpoints, max_rss=1)
+                except BakeMemoryExceeded:
+                    # A failed attempt is rolled back.
+                    cursor.connection.rollback()
+                    raise
+
+        def written_pages():
+            checkpoints = BakeCheckpoints(module_ident)
+            return json.loads(checkpoints.load(1, WRITTEN, cursor))
+
+        # Runs out of memory after writing the first page.
+        with self.assertRaises(BakeMemoryExceeded):
+            attempt(binder, rss_checks=1)
+        self.assertEqual(len(written_pages()), 1)
+
+        # Runs out of memory again, after writing the second page,
+        # which is progress, so the bake would be retried again.
+        with self.assertRaises(BakeMemoryExceeded):
+            attempt(None, rss_checks=2)
+        self.assertEqual(len(written_pages()), 2)
+
+        # Completes, reusing the written pages.
+        attempt(None, rss_checks=1000)
+        cursor.execute("SELECT tree_to_json(%s, %s, TRUE)::json;",
+                       (binder.id, binder.metadata['version'],))
+        self.assertEqual(cursor.fetchone()[0]['slug'], u'book-of-infinity')
+
+
+class WriteModeTestCase(BaseDatabaseIntegrationTestCase):
+
+    def _bake(self, binder, baked_doc_content, cursor):
+        from cnxpublishing.bake import bake
+        from cnxpublishing.instrumentation import BakeStats
+
+        def cnxepub_collate(binder_model, ruleset=None, includes=None):
+            binder_model[0][0].content = baked_doc_content
+            return binder_model
+
+        stats = BakeStats()
+        with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
+            mock_collate.side_effect = cnxepub_collate
+            bake(binder, 1, 'ream', 'part of collated publish',
+                 cursor=cursor, stats=stats)
+        return stats
+
+    def _get_baked_content(self, cursor, doc, binder):
+        cursor.execute("""\
+SELECT convert_from(f.file, 'utf-8')
+FROM collated_file_associations AS cfa NATURAL JOIN files AS f,
+     modules AS mparent, modules AS mitem
+WHERE cfa.context = mparent.module_ident
+  AND cfa.item = mitem.module_ident
+  AND ident_hash(mparent.uuid, mparent.major_version,
+                 mparent.minor_version) = %s
+  AND ident_hash(mitem.uuid, mitem.major_version, mitem.minor_version) = %s""",
+                       (binder.ident_hash, doc.ident_hash,))
+        return cursor.fetchall()
+
+    @db_connect
+    def test(self, cursor):
+        binder = use_cases.setup_COMPLEX_BOOK_ONE_in_archive(self, cursor)
+        cursor.connection.commit()
+        doc = binder[0][0]
+
+        stats = self._bake(binder, '<body><p>collated</p></body>', cursor)
+        self.assertEqual(stats.write_mode, 'full')
+
+        # Baking the same output again writes nothing.
+        stats = self._bake(binder, '<body><p>collated</p></body>', cursor)
+        self.assertEqual(stats.write_mode, 'unchanged')
+        self.assertNotIn('publish_tree', [s['name'] for s in stats.stages])
+
+        # Only the changed document is written.
+        stats = self._bake(binder, '<body><p>changed</p></body>', cursor)
+        self.assertEqual(stats.write_mode, 'partial')
+        rows = self._get_baked_content(cursor, doc, binder)
+        self.assertEqual(len(rows), 1)
+        self.assertIn('changed', rows[0][0])
+
+
 class RemoveBakedTestCase(BaseDatabaseIntegrationTestCase):
 
     @property
@@ -241,11 +436,19 @@ class BakedExercisesTestCase(VCRMixin, BaseDatabaseIntegrationTestCase):
 
     @db_connect
     def test(self, cursor):
+        from cnxpublishing.exercises import ExerciseCache
+        from cnxpublishing.instrumentation import BakeStats
         recipes = use_cases.setup_RECIPES_in_archive(self, cursor)
         binder = use_cases.setup_EXERCISES_BOOK_in_archive(self, cursor)
         cursor.connection.commit()
         publisher = 'ream'
         msg = 'part of collated publish'
+        # Start without any cached exercises.
+        registry = get_current_registry()
+        self.addCleanup(setattr, registry, 'exercise_cache',
+                        getattr(registry, 'exercise_cache', None))
+        registry.exercise_cache = ExerciseCache()
+        stats = BakeStats()
 
         # Call bake but store the result of collate_models for later inspection
         collate_results = []
@@ -257,9 +460,16 @@ class BakedExercisesTestCase(VCRMixin, BaseDatabaseIntegrationTestCase):
             return composite_doc
         with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
             mock_collate.side_effect = cnxepub_collate
-            self.target(binder, recipes[1], publisher, msg, cursor=cursor)
+            self.target(binder, recipes[1], publisher, msg, cursor=cursor,
+                        stats=stats)
         composite_doc = collate_results[0]
 
+        # The exercises are fetched once, before collation.
+        fetches = dict([(stage['name'], stage['exercise_fetches'])
+                        for stage in stats.stages])
+        self.assertEqual(fetches['prefetch_exercises'], 4)
+        self.assertEqual(fetches['collate'], 0)
+
         # Ensure the tree has been stamped.
         cursor.execute("SELECT tree_to_json(%s, %s, TRUE)::json;",
                        (binder.id, binder.metadata['version'],))
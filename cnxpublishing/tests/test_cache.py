@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    @property
+    def target(self):
+        from cnxpublishing.cache import LRUCache
+        return LRUCache
+
+    def test_get(self):
+        cache = self.target(2)
+        cache.set('a', 1)
+        cache.set('b', None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        with self.assertRaises(KeyError):
+            cache.get('c')
+
+    def test_evicts_least_recently_used(self):
+        cache = self.target(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        with self.assertRaises(KeyError):
+            cache.get('b')
+
+    def test_expires(self):
+        now = [100]
+        cache = self.target(2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 109
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 110
+        with self.assertRaises(KeyError):
+            cache.get('a')
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = self.target(2)
+        cache.set('a', 1)
+        generation = cache.generation
+        cache.clear('DELETE')
+        with self.assertRaises(KeyError):
+            cache.get('a')
+        # A value looked up before the cache was cleared isn't cached.
+        cache.set('a', 1, generation)
+        with self.assertRaises(KeyError):
+            cache.get('a')
+        cache.set('a', 2, cache.generation)
+        self.assertEqual(cache.get('a'), 2)
@@ -51,6 +51,32 @@ class DatabaseUtilsTestCase(unittest.TestCase):
                 result = cur.fetchone()[0]
         self.assertTrue(result)
 
+    def test_db_connect_with_process_pool(self):
+        from ..db import (
+            close_process_db_pool,
+            db_connect,
+            init_process_db_pool,
+        )
+
+        settings = integration_test_settings()
+        from ..config import CONNECTION_STRING
+        init_process_db_pool(settings[CONNECTION_STRING])
+        self.addCleanup(close_process_db_pool)
+
+        with db_connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("select pg_backend_pid()")
+                pid = cur.fetchone()[0]
+            # Nested use is given another connection.
+            with db_connect() as nested_conn:
+                self.assertIsNot(nested_conn, conn)
+        # The connection is kept open and reused.
+        self.assertFalse(conn.closed)
+        with db_connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("select pg_backend_pid()")
+                self.assertEqual(cur.fetchone()[0], pid)
+
 
 class BaseDatabaseIntegrationTestCase(unittest.TestCase):
     """Verify database interactions"""
@@ -1803,3 +1829,47 @@ ORDER BY uuid, 2""")
             (book_two.id, ['1.2', '1.1'],),
         ]
         self.assertEqual(rows, expected_rows)
+
+
+class LatestModuleVersionsTestCase(BaseDatabaseIntegrationTestCase):
+    """Verify the ``latest_module_versions`` table is kept up to date."""
+
+    uuid = '5e254713-2050-4fa7-9b4c-5e5e8a71768a'
+
+    def _insert(self, cursor, major_version, minor_version):
+        cursor.execute("""\
+INSERT INTO modules
+  (uuid, name, licenseid, doctype, major_version, minor_version)
+VALUES (%s, 'title', 11, '', %s, %s)
+RETURNING module_ident""", (self.uuid, major_version, minor_version,))
+        return cursor.fetchone()[0]
+
+    def _latest(self, cursor):
+        cursor.execute("SELECT module_ident FROM latest_module_versions "
+                       "WHERE uuid = %s", (self.uuid,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @db_connect
+    def test_publish(self, cursor):
+        first_ident = self._insert(cursor, 1, 1)
+        self.assertEqual(self._latest(cursor), [first_ident])
+
+        second_ident = self._insert(cursor, 2, 1)
+        self.assertEqual(self._latest(cursor), [second_ident])
+
+        # An older version (e.g. a minor version bump) doesn't replace it.
+        self._insert(cursor, 1, 2)
+        self.assertEqual(self._latest(cursor), [second_ident])
+
+    @db_connect
+    def test_remove(self, cursor):
+        first_ident = self._insert(cursor, 1, 1)
+        second_ident = self._insert(cursor, 1, 2)
+
+        cursor.execute("DELETE FROM modules WHERE module_ident = %s",
+                       (second_ident,))
+        self.assertEqual(self._latest(cursor), [first_ident])
+
+        cursor.execute("DELETE FROM modules WHERE module_ident = %s",
+                       (first_ident,))
+        self.assertEqual(self._latest(cursor), [])
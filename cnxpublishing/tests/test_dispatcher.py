@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import threading
+import time
+import unittest
+
+
+class FauxEvent(object):
+
+    def __init__(self, name, channel='post_publication', payload=None):
+        self.name = name
+        self.channel = channel
+        self.payload = payload or {}
+
+
+class FauxRegistry(object):
+    """Records the events it is notified of, blocking on the events
+    named in ``blocked`` until they are released.
+
+    """
+
+    def __init__(self):
+        self.settings = {}
+        self.handled = []
+        self.registries = []
+        self.blocked = {}
+        self._lock = threading.Lock()
+
+    def block(self, name):
+        self.blocked[name] = threading.Event()
+
+    def release(self, name):
+        self.blocked[name].set()
+
+    def notify(self, event):
+        from pyramid.threadlocal import get_current_registry
+        self.registries.append(get_current_registry())
+        if event.name in self.blocked:
+            self.blocked[event.name].wait(5)
+        if event.name == 'error':
+            raise RuntimeError('something failed')
+        with self._lock:
+            self.handled.append(event.name)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class EventKeyTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.dispatcher import event_key
+        self.assertEqual(
+            event_key(FauxEvent('a', payload={'module_ident': 3})),
+            ('module_ident', 3))
+        self.assertEqual(event_key(FauxEvent('a', channel='other')),
+                         ('channel', 'other'))
+
+
+class NotificationDispatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = FauxRegistry()
+        self.dispatcher = None
+
+    def tearDown(self):
+        for name in self.registry.blocked:
+            self.registry.release(name)
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown(5)
+
+    def make_one(self, **kwargs):
+        from cnxpublishing.dispatcher import NotificationDispatcher
+        self.dispatcher = NotificationDispatcher(self.registry, **kwargs)
+        return self.dispatcher
+
+    def test_invalid(self):
+        from cnxpublishing.dispatcher import NotificationDispatcher
+        with self.assertRaises(ValueError):
+            NotificationDispatcher(self.registry, workers=0)
+
+    def test_metrics(self):
+        from cnxpublishing.metrics import ProcessorMetrics
+        metrics = ProcessorMetrics()
+        dispatcher = self.make_one(metrics=metrics)
+        dispatcher.submit(FauxEvent('a'))
+        dispatcher.submit(FauxEvent('error'))
+
+        self.assertTrue(wait_for(lambda: dispatcher.handled == 2))
+        self.assertEqual(metrics.handled, {'post_publication': 2})
+        self.assertEqual(metrics.exceptions, {'post_publication': 1})
+
+    def test_metrics_of_tick(self):
+        from cnxpublishing.events import ChannelProcessingTickEvent
+        from cnxpublishing.metrics import ProcessorMetrics
+
+        class FauxTickEvent(ChannelProcessingTickEvent):
+            name = 'tick'
+
+        metrics = ProcessorMetrics()
+        dispatcher = self.make_one(workers=1, metrics=metrics)
+        dispatcher.submit(FauxTickEvent(), key=('tick',))
+
+        self.assertTrue(wait_for(lambda: not dispatcher.is_pending(('tick',))))
+        self.assertEqual(metrics.handled, {'tick': 1})
+        # The worker is still handling events.
+        dispatcher.submit(FauxTickEvent(), key=('tick',))
+        self.assertTrue(wait_for(lambda: dispatcher.handled == 2))
+
+    def test_metrics_error(self):
+        dispatcher = self.make_one(workers=1, metrics=object())
+        dispatcher.submit(FauxEvent('a'), key=1)
+        self.assertTrue(wait_for(lambda: not dispatcher.is_pending(1)))
+        dispatcher.submit(FauxEvent('b'), key=1)
+        self.assertTrue(wait_for(lambda: dispatcher.handled == 2))
+        self.assertEqual(self.registry.handled, ['a', 'b'])
+
+    def test_slow_event_doesnt_block_others(self):
+        dispatcher = self.make_one(workers=2)
+        self.registry.block('slow')
+        dispatcher.submit(FauxEvent('slow'), key=1)
+        dispatcher.submit(FauxEvent('fast'), key=2)
+        self.assertTrue(wait_for(lambda: self.registry.handled == ['fast']))
+        self.registry.release('slow')
+        self.assertTrue(wait_for(lambda: len(self.registry.handled) == 2))
+
+    def test_same_key_in_order(self):
+        dispatcher = self.make_one(workers=4)
+        self.registry.block('first')
+        dispatcher.submit(FauxEvent('first'), key=1)
+        dispatcher.submit(FauxEvent('second'), key=1)
+        dispatcher.submit(FauxEvent('other'), key=2)
+        self.assertTrue(wait_for(lambda: self.registry.handled == ['other']))
+        # The second event waits for the first one.
+        time.sleep(0.05)
+        self.assertEqual(self.registry.handled, ['other'])
+        self.registry.release('first')
+        self.assertTrue(wait_for(
+            lambda: self.registry.handled == ['other', 'first', 'second']))
+
+    def test_backpressure(self):
+        dispatcher = self.make_one(workers=1, max_pending=1)
+        self.registry.block('slow')
+        self.assertTrue(dispatcher.submit(FauxEvent('slow')))
+        self.assertFalse(dispatcher.submit(FauxEvent('more'), timeout=0.1))
+        self.registry.release('slow')
+        self.assertTrue(dispatcher.submit(FauxEvent('more'), timeout=5))
+
+    def test_is_pending(self):
+        dispatcher = self.make_one(workers=1)
+        self.registry.block('slow')
+        dispatcher.submit(FauxEvent('slow'), key=1)
+        self.assertTrue(dispatcher.is_pending(1))
+        self.assertFalse(dispatcher.is_pending(2))
+        self.registry.release('slow')
+        self.assertTrue(wait_for(lambda: not dispatcher.is_pending(1)))
+
+    def test_errors_are_counted(self):
+        dispatcher = self.make_one(workers=1)
+        dispatcher.submit(FauxEvent('error'))
+        dispatcher.submit(FauxEvent('fine'))
+        self.assertEqual(dispatcher.shutdown(5), 0)
+        self.assertEqual(self.registry.handled, ['fine'])
+        stats = dispatcher.stats()
+        self.assertEqual((stats['handled'], stats['failed']), (2, 1))
+
+    def test_registry_available(self):
+        dispatcher = self.make_one(workers=1)
+        dispatcher.submit(FauxEvent('one'))
+        dispatcher.shutdown(5)
+        self.assertEqual(self.registry.registries, [self.registry])
+
+    def test_shutdown_drains(self):
+        dispatcher = self.make_one(workers=1)
+        for i in range(5):
+            dispatcher.submit(FauxEvent(str(i)), key=1)
+        self.assertEqual(dispatcher.shutdown(5), 0)
+        self.assertEqual(self.registry.handled, ['0', '1', '2', '3', '4'])
+        with self.assertRaises(RuntimeError):
+            dispatcher.submit(FauxEvent('late'))
+
+    def test_shutdown_timeout(self):
+        dispatcher = self.make_one(workers=1)
+        self.registry.block('slow')
+        dispatcher.submit(FauxEvent('slow'))
+        dispatcher.submit(FauxEvent('next'))
+        self.assertEqual(dispatcher.shutdown(0.1), 2)
+
+
+class CoalesceKeyTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.dispatcher import coalesce_key
+        uuid = '07509e07-3732-45d9-a102-dd9a4dad5456'
+        event = FauxEvent('a', payload={'module_ident': 1,
+                                        'ident_hash': uuid + '@1.1'})
+        self.assertEqual(coalesce_key(event),
+                         ('post_publication', 'uuid', uuid))
+        event = FauxEvent('b', channel='other', payload={'module_ident': 2})
+        self.assertEqual(coalesce_key(event),
+                         ('other', 'module_ident', 2))
+
+
+class NotificationCoalescerTestCase(unittest.TestCase):
+
+    uuid = '07509e07-3732-45d9-a102-dd9a4dad5456'
+
+    def make_one(self, window=2):
+        from cnxpublishing.dispatcher import NotificationCoalescer
+        return NotificationCoalescer(window)
+
+    def make_event(self, name, version, channel='post_publication'):
+        return FauxEvent(name, channel=channel,
+                         payload={'ident_hash': '{}@{}'.format(self.uuid,
+                                                               version)})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.make_one(0)
+
+    def test_keeps_newest_version(self):
+        coalescer = self.make_one()
+        self.assertTrue(coalescer.add(self.make_event('v2', '1.2'), now=0))
+        self.assertFalse(coalescer.add(self.make_event('v3', '1.3'), now=1))
+        self.assertFalse(coalescer.add(self.make_event('v1', '1.1'), now=1))
+
+        self.assertEqual(coalescer.next_due(now=1), 1)
+        self.assertEqual(coalescer.pop_due(now=1), [])
+        self.assertEqual([e.name for e in coalescer.pop_due(now=2)], ['v3'])
+        self.assertEqual(coalescer.dropped, {'post_publication': 2})
+        self.assertEqual(coalescer.stats(), {'held': 0, 'dropped': 2})
+        self.assertEqual(coalescer.next_due(now=2), None)
+
+    def test_window_starts_at_first(self):
+        coalescer = self.make_one()
+        coalescer.add(self.make_event('a', '1.1'), now=0)
+        # A steady stream of duplicates doesn't postpone the notification.
+        coalescer.add(self.make_event('b', '1.1'), now=1.5)
+        self.assertEqual([e.name for e in coalescer.pop_due(now=2)], ['b'])
+        coalescer.add(self.make_event('c', '1.1'), now=2.5)
+        self.assertEqual(coalescer.pending, 1)
+
+    def test_keys_in_order(self):
+        coalescer = self.make_one()
+        coalescer.add(FauxEvent('a', payload={'module_ident': 1}), now=0)
+        coalescer.add(FauxEvent('b', payload={'module_ident': 2}), now=1)
+        coalescer.add(FauxEvent('c', channel='other'), now=1)
+        coalescer.add(FauxEvent('d', payload={'module_ident': 1}), now=1)
+
+        self.assertEqual([e.name for e in coalescer.pop_due(now=2)], ['d'])
+        self.assertEqual([e.name for e in coalescer.flush()], ['b', 'c'])
+        self.assertEqual(coalescer.pending, 0)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import cnxepub
+
+
+class FauxMemcacheClient(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class ExerciseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make_one(self, **kwargs):
+        from cnxpublishing.exercises import ExerciseCache
+        return ExerciseCache(**kwargs)
+
+    def test_in_process(self):
+        cache = self.make_one()
+        self.assertEqual(cache.get('ex1'), None)
+        cache.set('ex1', u'{"total_count": 1}')
+        self.assertEqual(cache.get('ex1'), u'{"total_count": 1}')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_on_disk(self):
+        cache = self.make_one(directory=self.directory)
+        cache.set('ex1token', u'{"total_count": 1}')
+        # The token is not written to disk as part of the filename.
+        self.assertNotIn('ex1token', os.listdir(self.directory))
+
+        # A new cache (e.g. another process) finds it on disk.
+        cache = self.make_one(directory=self.directory)
+        self.assertEqual(cache.get('ex1token'), u'{"total_count": 1}')
+
+    def test_on_disk_expired(self):
+        cache = self.make_one(directory=self.directory, max_age=60)
+        cache.set('ex1', u'{}')
+        for filename in os.listdir(self.directory):
+            os.utime(os.path.join(self.directory, filename), (0, 0))
+
+        cache = self.make_one(directory=self.directory, max_age=60)
+        self.assertEqual(cache.get('ex1'), None)
+
+    def test_memcache(self):
+        mc_client = FauxMemcacheClient()
+        mc_client.set('ex1', u'{}')
+        cache = self.make_one(directory=self.directory, mc_client=mc_client)
+
+        self.assertEqual(cache.get('ex1'), u'{}')
+        # ... and is copied to the faster stores.
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        cache.set('ex2', u'[]')
+        self.assertEqual(mc_client.get('ex2'), u'[]')
+
+
+class IsExerciseCachedTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.exercises import (
+            ExerciseCache,
+            is_exercise_cached,
+        )
+        cache = ExerciseCache()
+        cache.set('ex1token', u'{}')
+        match = '#ost/api/ex/'
+
+        self.assertTrue(is_exercise_cached(cache, match + 'ex1', match,
+                                           'token'))
+        self.assertFalse(is_exercise_cached(cache, match + 'ex2', match,
+                                            'token'))
+        # The checks aren't counted as hits or misses of the cache.
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+class FindExerciseCodesTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.exercises import find_exercise_codes
+        content = (u'<body><p><a href="#ost/api/ex/k12phys-ch04-ex001">'
+                   u'[link]</a></p><a href="#ost/api/ex/k12phys-ch04-ex002">'
+                   u'[link]</a><a href="http://cnx.org/">cnx</a></body>')
+        document = cnxepub.Document('doc', content)
+        other = cnxepub.Document('other', u'<body><a href="#ost/api/ex/'
+                                          u'k12phys-ch04-ex001">x</a></body>')
+        binder = cnxepub.Binder('book', nodes=[document, other])
+
+        self.assertEqual(find_exercise_codes(binder, '#ost/api/ex/'),
+                         ['k12phys-ch04-ex001', 'k12phys-ch04-ex002'])
+        self.assertEqual(find_exercise_codes(binder, '#exercise/'), [])
+
+
+class PrefetchExercisesTestCase(unittest.TestCase):
+
+    def target(self, *args, **kwargs):
+        from cnxpublishing.exercises import prefetch_exercises
+        return prefetch_exercises(*args, **kwargs)
+
+    def make_response(self, text, ok=True):
+        response = mock.Mock(text=text, status_code=ok and 200 or 500)
+        response.__nonzero__ = mock.Mock(return_value=ok)
+        return response
+
+    def test(self):
+        from cnxpublishing.exercises import ExerciseCache
+        cache = ExerciseCache()
+        cache.set('cachedtoken', u'cached')
+        embeds = [('ex{}'.format(i), 'http://ex/{}'.format(i))
+                  for i in range(5)]
+        embeds.append(('cached', 'http://ex/cached'))
+
+        def get(url, headers):
+            self.assertEqual(headers, {'Authorization': 'Bearer token'})
+            return self.make_response(url, ok=not url.endswith('/4'))
+
+        with mock.patch('requests.get') as mock_get:
+            mock_get.side_effect = get
+            fetched = self.target(cache, embeds, token='token',
+                                  concurrency=2, batch_size=2)
+
+        self.assertEqual(fetched, 4)
+        self.assertEqual(mock_get.call_count, 5)
+        self.assertEqual(cache.get('ex0token'), 'http://ex/0')
+        self.assertEqual(cache.get('ex4token'), None)
+
+    def test_all_cached(self):
+        from cnxpublishing.exercises import ExerciseCache
+        cache = ExerciseCache()
+        cache.set('ex1', u'cached')
+        with mock.patch('requests.get') as mock_get:
+            self.assertEqual(self.target(cache, [('ex1', 'http://ex/1')]), 0)
+        self.assertFalse(mock_get.called)
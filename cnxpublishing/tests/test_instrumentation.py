@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import json
+import unittest
+
+
+class FauxCursor(object):
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, args=None):
+        self.executed.append(statement)
+
+    def fetchone(self):
+        return (1,)
+
+
+class BakeStatsTestCase(unittest.TestCase):
+
+    def make_one(self):
+        from cnxpublishing.instrumentation import BakeStats
+        return BakeStats()
+
+    def test_stage(self):
+        stats = self.make_one()
+        cursor = stats.wrap_cursor(FauxCursor())
+
+        with stats.stage('one'):
+            cursor.execute('SELECT 1')
+            cursor.execute('SELECT 2')
+        with stats.stage('two'):
+            cursor.execute('SELECT 3')
+
+        self.assertEqual([s['name'] for s in stats.stages], ['one', 'two'])
+        self.assertEqual([s['queries'] for s in stats.stages], [2, 1])
+        stage = stats.stages[0]
+        self.assertTrue(stage['wall_time'] >= 0)
+        self.assertTrue(stage['cpu_time'] >= 0)
+        self.assertTrue(stage['peak_rss'] > 0)
+        # The wrapped cursor is still usable as a cursor.
+        self.assertEqual(cursor.fetchone(), (1,))
+        self.assertEqual(len(cursor.executed), 3)
+
+    def test_stage_recorded_on_error(self):
+        stats = self.make_one()
+
+        with self.assertRaises(ValueError):
+            with stats.stage('broken'):
+                raise ValueError()
+
+        self.assertEqual([s['name'] for s in stats.stages], ['broken'])
+
+    def test_wrap_cursor_once(self):
+        stats = self.make_one()
+        cursor = stats.wrap_cursor(FauxCursor())
+        self.assertIs(stats.wrap_cursor(cursor), cursor)
+
+    def test_wrap_includes(self):
+        stats = self.make_one()
+        calls = []
+        includes = stats.wrap_includes([('//a', calls.append)])
+
+        with stats.stage('collate'):
+            match, callback = includes[0]
+            callback('a')
+            callback('b')
+
+        self.assertEqual(match, '//a')
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual(stats.stages[0]['exercise_fetches'], 2)
+
+    def test_wrap_includes_is_fetched(self):
+        stats = self.make_one()
+        calls = []
+        includes = stats.wrap_includes([('//a', calls.append)],
+                                       lambda elem: elem != 'cached')
+
+        with stats.stage('collate'):
+            match, callback = includes[0]
+            callback('cached')
+            callback('b')
+
+        # Only the exercise missing from the cache is fetched.
+        self.assertEqual(calls, ['cached', 'b'])
+        self.assertEqual(stats.stages[0]['exercise_fetches'], 1)
+
+    def test_to_json(self):
+        stats = self.make_one()
+        with stats.stage('one'):
+            pass
+        self.assertEqual(json.loads(stats.to_json())[0]['name'], 'one')
+
+
+class CurrentRSSTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.instrumentation import current_rss
+        self.assertTrue(current_rss() > 0)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from .test_db import BaseDatabaseIntegrationTestCase
+
+
+class LeadershipTestCase(BaseDatabaseIntegrationTestCase):
+
+    def connect(self):
+        conn = psycopg2.connect(self.db_conn_str)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_single_leader(self):
+        from cnxpublishing.leadership import (
+            release_leadership,
+            try_acquire_leadership,
+        )
+        active = self.connect().cursor()
+        standby = self.connect().cursor()
+
+        self.assertTrue(try_acquire_leadership(active))
+        self.assertFalse(try_acquire_leadership(standby))
+
+        self.assertTrue(release_leadership(active))
+        self.assertTrue(try_acquire_leadership(standby))
+        self.assertFalse(release_leadership(active))
+
+    def test_failover_on_disconnect(self):
+        from cnxpublishing.leadership import (
+            try_acquire_leadership,
+            wait_for_leadership,
+        )
+        active_conn = self.connect()
+        standby = self.connect().cursor()
+        self.assertTrue(try_acquire_leadership(active_conn.cursor()))
+
+        # Gives up when stopping.
+        self.assertFalse(wait_for_leadership(standby, stopping=[15]))
+
+        active_conn.close()
+        self.assertTrue(wait_for_leadership(standby, interval=0.1))
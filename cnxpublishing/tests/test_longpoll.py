@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import threading
+import unittest
+
+from pyramid import testing
+from pyramid.registry import Registry
+
+
+def make_listener():
+    from cnxpublishing.longpoll import StateChangeListener
+    listener = StateChangeListener('dbname=testing')
+    # Don't connect to listen.
+    listener.start = lambda: None
+    return listener
+
+
+def make_request(settings=None, **params):
+    request = testing.DummyRequest(params=params)
+    request.registry = Registry()
+    request.registry.settings = settings or {}
+    request.registry.state_change_listener = make_listener()
+    return request
+
+
+class StateChangeListenerTestCase(unittest.TestCase):
+
+    def test_notify(self):
+        listener = make_listener()
+        with listener.waiting('publication_state', 1) as event:
+            with listener.waiting('publication_state', 2) as other_event:
+                listener.notify('publication_state', '{"id": 1}')
+        self.assertTrue(event.is_set())
+        self.assertFalse(other_event.is_set())
+        self.assertEqual(listener._waiters, {})
+
+    def test_notify_bake_state(self):
+        listener = make_listener()
+        uuid_ = 'd5dbbd8e-d137-4f89-9d0a-3ac8db53d8ee'
+        with listener.waiting('bake_state', uuid_) as event:
+            listener.notify('bake_state',
+                            '{{"uuid": "{}", "module_ident": 2}}'
+                            .format(uuid_))
+        self.assertTrue(event.is_set())
+
+    def test_notify_unrecognized(self):
+        listener = make_listener()
+        with listener.waiting('publication_state', 1) as event:
+            listener.notify('publication_state', 'not json')
+            listener.notify('publication_state', '{"uuid": 1}')
+        self.assertFalse(event.is_set())
+
+    def test_callback(self):
+        listener = make_listener()
+        payloads = []
+        listener.add_callback('api_keys', payloads.append)
+        self.assertIn('api_keys', listener.channels)
+        listener.notify('api_keys', 'INSERT')
+        listener.notify('publication_state', '{"id": 1}')
+        # Missed notifications are handled like an unknown change.
+        listener._wake_all()
+        self.assertEqual(payloads, ['INSERT', None])
+
+
+class GetWaitTestCase(unittest.TestCase):
+
+    def target(self, request):
+        from cnxpublishing.longpoll import get_wait
+        return get_wait(request)
+
+    def test(self):
+        self.assertEqual(self.target(make_request(wait='10')), 10)
+        self.assertEqual(self.target(make_request()), 0)
+        self.assertEqual(self.target(make_request(wait='-1')), 0)
+        self.assertEqual(self.target(make_request(wait='abc')), 0)
+
+    def test_max_wait(self):
+        settings = {'publishing.longpoll.max_wait': '5'}
+        self.assertEqual(self.target(make_request(settings, wait='60')), 5)
+
+
+class WaitForChangeTestCase(unittest.TestCase):
+
+    def target(self, request, get_version, is_current):
+        from cnxpublishing.longpoll import wait_for_change
+        return wait_for_change(request, 'publication_state', 1,
+                               get_version, is_current)
+
+    def test_wo_wait(self):
+        versions = iter([1, 2])
+        version = self.target(make_request(), lambda: next(versions),
+                              lambda version: True)
+        self.assertEqual(version, 1)
+
+    def test_changed(self):
+        versions = iter([1, 2])
+        version = self.target(make_request(wait='10'), lambda: next(versions),
+                              lambda version: False)
+        self.assertEqual(version, 1)
+
+    def test_notified(self):
+        request = make_request(wait='10')
+        listener = request.registry.state_change_listener
+        versions = iter([1, 2])
+        timer = threading.Timer(
+            0.05, listener.notify, ('publication_state', '{"id": 1}'))
+
+        def get_version():
+            version = next(versions)
+            if version == 1:
+                # Change once waiting.
+                timer.start()
+            return version
+
+        version = self.target(request, get_version,
+                              lambda version: version == 1)
+        self.assertEqual(version, 2)
+
+    def test_too_many_waiters(self):
+        from cnxpublishing.longpoll import StateChangeListener
+        request = make_request(wait='10')
+        listener = StateChangeListener('dbname=testing', max_waiters=1)
+        listener.start = lambda: None
+        request.registry.state_change_listener = listener
+
+        # Another request is waiting.
+        with listener.waiting('publication_state', 2):
+            versions = iter([1, 2])
+            version = self.target(request, lambda: next(versions),
+                                  lambda version: True)
+        self.assertEqual(version, 1)
+        self.assertEqual(request.response.headers['Retry-After'], '10')
+
+    def test_timeout(self):
+        request = make_request(wait='0.05')
+        versions = iter([1, 1])
+        version = self.target(request, lambda: next(versions),
+                              lambda version: True)
+        self.assertEqual(version, 1)
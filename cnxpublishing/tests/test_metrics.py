@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class FauxEvent(object):
+
+    def __init__(self, channel='post_publication', payload=None):
+        self.channel = channel
+        self.payload = payload or {}
+
+
+class FauxSource(object):
+
+    def __init__(self, **stats):
+        self._stats = stats or {'pending': 3}
+
+    def stats(self):
+        return self._stats
+
+
+class ParsePGTimestampTestCase(unittest.TestCase):
+
+    @property
+    def target(self):
+        from cnxpublishing.metrics import parse_pg_timestamp
+        return parse_pg_timestamp
+
+    def test(self):
+        self.assertEqual(self.target('1970-01-01 00:01:00+00'), 60)
+        self.assertEqual(self.target('1970-01-01 01:01:00.5+01'), 60.5)
+        self.assertEqual(self.target('1970-01-01 00:00:00-05:30'), 19800)
+        self.assertEqual(self.target('1970-01-01 00:01:00'), 60)
+
+    def test_invalid(self):
+        self.assertEqual(self.target('<date>'), None)
+        self.assertEqual(self.target(None), None)
+
+
+class ProcessorMetricsTestCase(unittest.TestCase):
+
+    def make_one(self):
+        from cnxpublishing.metrics import ProcessorMetrics
+        return ProcessorMetrics()
+
+    def test_render(self):
+        metrics = self.make_one()
+        event = FauxEvent(payload={'timestamp': '1970-01-01 00:01:40+00'})
+        metrics.observe_received(event, now=101)
+        metrics.observe_handled(event, started=102, finished=105)
+        failed_event = FauxEvent('faux_channel')
+        metrics.observe_received(failed_event, now=100)
+        metrics.observe_handled(failed_event, 100, 100.5, failed=True)
+        metrics.set_gauge('modules_backlog', 7, 'Books waiting',
+                          state='post-publication')
+        metrics.coalesced['post_publication'] = 2
+        metrics.sources['dispatcher'] = FauxSource()
+
+        lines = metrics.render().splitlines()
+        prefix = 'cnxpublishing_channel_processing_'
+        for line in [
+            'notifications_received_total{channel="post_publication"} 1',
+            'notifications_handled_total{channel="faux_channel"} 1',
+            'exceptions_total{channel="faux_channel"} 1',
+            'notifications_coalesced_total{channel="post_publication"} 2',
+            'dispatch_latency_seconds_count{channel="post_publication"} 1',
+            'dispatch_latency_seconds_sum{channel="post_publication"} 1.0',
+            'lag_seconds_sum{channel="post_publication"} 5.0',
+            'duration_seconds_sum{channel="post_publication"} 3.0',
+            'modules_backlog{state="post-publication"} 7',
+            'dispatcher_pending 3',
+        ]:
+            self.assertIn(prefix + line, lines)
+        self.assertIn('# TYPE {}lag_seconds summary'.format(prefix), lines)
+        self.assertIn('# TYPE {}modules_backlog gauge'.format(prefix), lines)
+        # No lag is observed without a payload timestamp.
+        self.assertNotIn(
+            prefix + 'lag_seconds_count{channel="faux_channel"} 1', lines)
+
+    def test_render_unknown(self):
+        metrics = self.make_one()
+        metrics.sources['bake_scheduler'] = FauxSource(last_wait=None)
+
+        lines = metrics.render().splitlines()
+        name = 'cnxpublishing_channel_processing_bake_scheduler_last_wait'
+        self.assertIn('# TYPE {} gauge'.format(name), lines)
+        self.assertEqual([line for line in lines if line.startswith(name)],
+                         [])
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'channel_processing.prom')
+        metrics = self.make_one()
+        metrics.observe_received(FauxEvent())
+
+        metrics.write(path)
+        with open(path) as fb:
+            self.assertEqual(fb.read(), metrics.render())
+        self.assertEqual(os.listdir(directory), ['channel_processing.prom'])
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import cnxepub
+
+from . import use_cases
+from .testing import db_connect
+from .test_db import BaseDatabaseIntegrationTestCase
+
+
+class FormatOrphanStatsTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.orphans import format_orphan_stats
+        stats = {'modules': 2, 'files': 3, 'bytes': 1024, 'batches': 2,
+                 'duration': 0.5, 'dry_run': False}
+        self.assertEqual(format_orphan_stats(stats),
+                         'Removed 2 composite modules and 3 collated files '
+                         '(1024 bytes) in 0.5s')
+        stats['dry_run'] = True
+        self.assertEqual(format_orphan_stats(stats),
+                         'Would remove 2 composite modules and 3 collated '
+                         'files (1024 bytes) in 0.5s')
+
+
+class OrphansTestCase(BaseDatabaseIntegrationTestCase):
+
+    @db_connect
+    def setUp(self, cursor):
+        super(OrphansTestCase, self).setUp()
+        binder = use_cases.setup_COMPLEX_BOOK_ONE_in_archive(self, cursor)
+        cursor.connection.commit()
+
+        metadata = [x.metadata.copy()
+                    for x in cnxepub.flatten_to_documents(binder)][0]
+        del metadata['cnx-archive-uri']
+        del metadata['version']
+        metadata['created'] = None
+        metadata['revised'] = None
+        metadata['title'] = "Made up of other things"
+        composite_doc = cnxepub.CompositeDocument(
+            None, '<body><p>composite</p></body>', metadata)
+
+        def cnxepub_collate(binder_model, ruleset=None, includes=None):
+            binder_model[0][0].content = '<body><p>collated</p></body>'
+            binder_model.append(cnxepub.TranslucentBinder(
+                nodes=[composite_doc], metadata={'title': "Other things"}))
+            return binder_model
+
+        from cnxpublishing.bake import bake
+        with mock.patch('cnxpublishing.bake.collate_models') as mock_collate:
+            mock_collate.side_effect = cnxepub_collate
+            bake(binder, 1, 'ream', 'part of collated publish', cursor=cursor)
+        self.ident_hash = binder.ident_hash
+
+    @db_connect
+    def test(self, cursor):
+        from cnxpublishing.bake import remove_baked
+        from cnxpublishing.orphans import (
+            count_orphans,
+            remove_orphan_files,
+            remove_orphan_modules,
+        )
+        self.assertEqual(count_orphans(cursor)['modules'], 0)
+
+        remove_baked(self.ident_hash, cursor=cursor)
+        orphans = count_orphans(cursor)
+        self.assertEqual(orphans['modules'], 1)
+        self.assertTrue(orphans['files'] >= 2)
+        self.assertTrue(orphans['bytes'] > 0)
+
+        self.assertEqual(remove_orphan_modules(cursor, limit=10), 1)
+        count, size, after = remove_orphan_files(cursor, limit=1)
+        self.assertEqual(count, 1)
+        # The next batch continues after the removed file.
+        count, size, next_after = remove_orphan_files(cursor, limit=1,
+                                                      after=after)
+        self.assertEqual(count, 1)
+        self.assertTrue(next_after > after)
+        after = next_after
+        while count:
+            count, size, after = remove_orphan_files(cursor, limit=10,
+                                                     after=after)
+        self.assertEqual(count_orphans(cursor),
+                         {'modules': 0, 'files': 0, 'bytes': 0})
+
+        # The content of the book itself is left alone.
+        cursor.execute("SELECT count(*) FROM files AS f "
+                       "JOIN module_files AS mf USING (fileid)")
+        self.assertTrue(cursor.fetchone()[0] > 0)
+
+    @db_connect
+    def test_subcollections_left(self, cursor):
+        from cnxpublishing.bake import remove_baked
+        from cnxpublishing.orphans import count_orphans, remove_orphan_modules
+        remove_baked(self.ident_hash, cursor=cursor)
+        # Only composite modules are made by baking.
+        cursor.execute("UPDATE modules SET portal_type = 'SubCollection' "
+                       "WHERE portal_type = 'CompositeModule'")
+
+        self.assertEqual(count_orphans(cursor)['modules'], 0)
+        self.assertEqual(remove_orphan_modules(cursor, limit=10), 0)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+
+import psycopg2
+
+from . import use_cases
+from .testing import db_connect
+from .test_db import BaseDatabaseIntegrationTestCase
+
+
+class CoalescePostPublicationsTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.outbox import (
+            coalesce_post_publications,
+            OutboxEntry,
+        )
+        entries = [OutboxEntry(1, 10, 'a@1', 1),
+                   OutboxEntry(2, 11, 'b@1', 1),
+                   OutboxEntry(3, 10, 'a@1', 1)]
+        self.assertEqual(coalesce_post_publications(entries),
+                         (entries[:2], entries[2:]))
+
+
+class PostPublicationOutboxTestCase(BaseDatabaseIntegrationTestCase):
+
+    @db_connect
+    def setUp(self, cursor):
+        super(PostPublicationOutboxTestCase, self).setUp()
+        binder = use_cases.setup_BOOK_in_archive(self, cursor)
+        cursor.execute("""\
+UPDATE modules SET stateid = 1
+WHERE ident_hash(uuid, major_version, minor_version) = %s
+RETURNING module_ident""", (binder.ident_hash,))
+        self.module_ident = cursor.fetchone()[0]
+        self.ident_hash = binder.ident_hash
+        cursor.execute("DELETE FROM post_publication_outbox")
+
+    def _set_post_publication(self, cursor):
+        cursor.execute("UPDATE modules SET stateid = 5 "
+                       "WHERE module_ident = %s", (self.module_ident,))
+
+    @db_connect
+    def test_trigger(self, cursor):
+        self._set_post_publication(cursor)
+        # Updating a book already in the state doesn't add another entry.
+        self._set_post_publication(cursor)
+
+        cursor.execute("SELECT module_ident, ident_hash, attempts "
+                       "FROM post_publication_outbox")
+        self.assertEqual(cursor.fetchall(),
+                         [(self.module_ident, self.ident_hash, 0)])
+
+    @db_connect
+    def test_enqueue(self, cursor):
+        from cnxpublishing.outbox import (
+            claim_post_publications,
+            enqueue_post_publication,
+        )
+        entry_id = enqueue_post_publication(cursor, self.module_ident,
+                                            self.ident_hash)
+
+        entries = claim_post_publications(cursor)
+        self.assertEqual([(e.id, e.module_ident, e.ident_hash)
+                          for e in entries],
+                         [(entry_id, self.module_ident, self.ident_hash)])
+
+    @db_connect
+    def test_enqueue_waiting(self, cursor):
+        from cnxpublishing.outbox import enqueue_waiting_post_publications
+        self._set_post_publication(cursor)
+        cursor.execute("DELETE FROM post_publication_outbox")
+
+        self.assertEqual(enqueue_waiting_post_publications(cursor), 1)
+        # Books already in the outbox are not added again.
+        self.assertEqual(enqueue_waiting_post_publications(cursor), 0)
+
+    @db_connect
+    def test_claim_and_ack(self, cursor):
+        from cnxpublishing.outbox import (
+            ack_post_publications,
+            claim_post_publications,
+            count_post_publications,
+        )
+        self._set_post_publication(cursor)
+
+        entries = claim_post_publications(cursor, lease=60)
+        self.assertEqual([e.attempts for e in entries], [1])
+        # A leased entry isn't claimed again.
+        self.assertEqual(claim_post_publications(cursor), [])
+        self.assertEqual(count_post_publications(cursor)[0], 1)
+
+        ack_post_publications(cursor, [entries[0].id])
+        self.assertEqual(count_post_publications(cursor), (0, 0.0))
+
+    @db_connect
+    def test_claim_expired_lease(self, cursor):
+        from cnxpublishing.outbox import claim_post_publications
+        self._set_post_publication(cursor)
+        claim_post_publications(cursor, lease=60)
+        cursor.execute("UPDATE post_publication_outbox "
+                       "SET leased_until = leased_until - interval '1 hour'")
+
+        entries = claim_post_publications(cursor)
+        self.assertEqual([e.attempts for e in entries], [2])
+
+    @db_connect
+    def test_claim_skips_locked(self, cursor):
+        from cnxpublishing.outbox import claim_post_publications
+        self._set_post_publication(cursor)
+        cursor.connection.commit()
+
+        # Claim without committing, which holds the lock on the entry.
+        self.assertEqual(len(claim_post_publications(cursor)), 1)
+        with psycopg2.connect(self.db_conn_str) as other_conn:
+            with other_conn.cursor() as other_cursor:
+                self.assertEqual(claim_post_publications(other_cursor), [])
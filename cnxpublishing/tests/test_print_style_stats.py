@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+from . import use_cases
+from .testing import db_connect
+from .test_db import BaseDatabaseIntegrationTestCase
+
+
+class PrintStyleStatsTestCase(BaseDatabaseIntegrationTestCase):
+
+    @db_connect
+    def setUp(self, cursor):
+        super(PrintStyleStatsTestCase, self).setUp()
+        binder = use_cases.setup_BOOK_in_archive(self, cursor)
+        cursor.execute("""\
+SELECT module_ident FROM modules
+WHERE ident_hash(uuid, major_version, minor_version) = %s""",
+                       (binder.ident_hash,))
+        self.module_ident = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO files (file, media_type) "
+                       "VALUES ('recipe', 'text/css') RETURNING fileid")
+        self.recipe = cursor.fetchone()[0]
+
+    def _bake(self, cursor, stateid=1):
+        cursor.execute("""\
+UPDATE modules
+SET print_style = 'ccap-physics', recipe = %s, baked = now(), stateid = %s
+WHERE module_ident = %s""", (self.recipe, stateid, self.module_ident,))
+
+    def _stats(self, cursor):
+        cursor.execute("SELECT print_style, recipe, count, bad "
+                       "FROM print_style_stats ORDER BY print_style")
+        return cursor.fetchall()
+
+    @db_connect
+    def test_bake(self, cursor):
+        self._bake(cursor)
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 0)])
+
+        # Failing to bake is counted as bad.
+        self._bake(cursor, stateid=7)
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 1)])
+
+    @db_connect
+    def test_state_changes(self, cursor):
+        self._bake(cursor)
+
+        def set_state(statename, baked='baked'):
+            cursor.execute("""\
+UPDATE modules
+SET stateid = (SELECT stateid FROM modulestates WHERE statename = %s),
+    baked = {}
+WHERE module_ident = %s""".format(baked), (statename, self.module_ident,))
+
+        set_state('processing')
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 1)])
+        # Writing the same state again changes nothing.
+        set_state('processing')
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 1)])
+        set_state('current')
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 0)])
+        # An unbaked book isn't counted.
+        set_state('current', baked='NULL')
+        self.assertEqual(self._stats(cursor), [])
+
+    @db_connect
+    def test_change_print_style(self, cursor):
+        self._bake(cursor)
+        cursor.execute("UPDATE modules SET print_style = 'ccap-biology' "
+                       "WHERE module_ident = %s", (self.module_ident,))
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-biology', self.recipe, 1, 0)])
+
+    @db_connect
+    def test_rebuild(self, cursor):
+        from cnxpublishing.print_style_stats import rebuild_print_style_stats
+        self._bake(cursor)
+        cursor.execute("DELETE FROM print_style_stats")
+
+        self.assertEqual(rebuild_print_style_stats(cursor=cursor), 1)
+        self.assertEqual(self._stats(cursor),
+                         [('ccap-physics', self.recipe, 1, 0)])
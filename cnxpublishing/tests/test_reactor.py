@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import itertools
+import unittest
+
+
+class FauxClock(object):
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FauxClock()
+        self.calls = []
+
+    def make_one(self):
+        from cnxpublishing.reactor import Scheduler
+        return Scheduler(clock=self.clock)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.make_one().call_every(0, lambda: None)
+
+    def test_timeout(self):
+        scheduler = self.make_one()
+        # Waits without a timeout when nothing is scheduled.
+        self.assertEqual(scheduler.timeout(), None)
+        self.assertEqual(scheduler.timeout(3), 3)
+
+        scheduler.call_every(5, lambda: None)
+        scheduler.call_every(2, lambda: None)
+        self.assertEqual(scheduler.timeout(), 2)
+        self.assertEqual(scheduler.timeout(1), 1)
+        self.clock.now = 3
+        self.assertEqual(scheduler.timeout(), 0)
+
+    def test_run_due(self):
+        scheduler = self.make_one()
+        scheduler.call_every(5, lambda: self.calls.append('a'))
+        scheduler.call_every(2, lambda: self.calls.append('b'))
+
+        self.assertEqual(scheduler.run_due(), 0)
+        self.clock.now = 2
+        self.assertEqual(scheduler.run_due(), 1)
+        self.clock.now = 5
+        self.assertEqual(scheduler.run_due(), 2)
+        self.assertEqual(self.calls, ['b', 'a', 'b'])
+        self.assertEqual(scheduler.timeout(), 1)
+
+    def test_missed_runs_are_skipped(self):
+        scheduler = self.make_one()
+        scheduler.call_every(2, lambda: self.calls.append('a'))
+        self.clock.now = 11
+
+        self.assertEqual(scheduler.run_due(), 1)
+        self.assertEqual(scheduler.run_due(), 0)
+        self.assertEqual(scheduler.timeout(), 2)
+
+    def test_failing_task(self):
+        scheduler = self.make_one()
+
+        def fail():
+            self.calls.append('fail')
+            raise RuntimeError('something failed')
+
+        scheduler.call_every(1, fail)
+        scheduler.call_every(1, lambda: self.calls.append('a'))
+        self.clock.now = 1
+        self.assertEqual(scheduler.run_due(), 2)
+        self.clock.now = 2
+        self.assertEqual(scheduler.run_due(), 2)
+        self.assertEqual(self.calls, ['fail', 'a', 'fail', 'a'])
+
+
+class ReconnectDelaysTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.reactor import reconnect_delays
+        delays = reconnect_delays(1, 10)
+        self.assertEqual(list(itertools.islice(delays, 6)),
+                         [1, 2, 4, 8, 10, 10])
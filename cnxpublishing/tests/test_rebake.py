@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+
+from . import use_cases
+from .testing import db_connect
+from .test_db import BaseDatabaseIntegrationTestCase
+
+
+class FormatRebakeRunProgressTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.rebake import format_rebake_run_progress
+        progress = {'id': 3, 'print_style': 'physics', 'state': 'running',
+                    'total': 10, 'waiting': 4, 'queued': 2, 'done': 3,
+                    'failed': 1}
+        self.assertEqual(
+            format_rebake_run_progress(progress),
+            'Rebake run 3 (physics): 3/10 done, 1 failed, 2 baking, '
+            '4 waiting; state=running')
+
+
+class RebakeRunTestCase(BaseDatabaseIntegrationTestCase):
+
+    @db_connect
+    def setUp(self, cursor):
+        super(RebakeRunTestCase, self).setUp()
+        binder = use_cases.setup_BOOK_in_archive(self, cursor)
+        cursor.execute("""\
+UPDATE modules SET print_style = 'physics', stateid = 1
+WHERE ident_hash(uuid, major_version, minor_version) = %s
+RETURNING module_ident""", (binder.ident_hash,))
+        self.module_ident = cursor.fetchone()[0]
+        self.uuid = binder.id
+
+    def _set_stateid(self, cursor, stateid):
+        cursor.execute("UPDATE modules SET stateid = %s "
+                       "WHERE module_ident = %s", (stateid, self.module_ident))
+
+    def _get_stateid(self, cursor):
+        cursor.execute("SELECT stateid FROM modules WHERE module_ident = %s",
+                       (self.module_ident,))
+        return cursor.fetchone()[0]
+
+    @db_connect
+    def test_find_by_print_style(self, cursor):
+        from cnxpublishing.rebake import find_rebake_targets
+        self.assertEqual(find_rebake_targets(cursor, print_style='physics'),
+                         [self.module_ident])
+        self.assertEqual(find_rebake_targets(cursor, print_style='math'), [])
+
+    @db_connect
+    def test_find_by_uuids(self, cursor):
+        from cnxpublishing.rebake import find_rebake_targets
+        self.assertEqual(find_rebake_targets(cursor, uuids=[self.uuid]),
+                         [self.module_ident])
+
+    @db_connect
+    def test_create_without_books(self, cursor):
+        from cnxpublishing.rebake import create_rebake_run
+        with self.assertRaises(ValueError):
+            create_rebake_run(cursor, print_style='math')
+
+    @db_connect
+    def test_run(self, cursor):
+        from cnxpublishing.rebake import (
+            advance_rebake_run,
+            create_rebake_run,
+            get_rebake_run_progress,
+        )
+        run_id = create_rebake_run(cursor, print_style='physics',
+                                   batch_size=1, concurrency=1)
+        progress = get_rebake_run_progress(cursor, run_id)
+        self.assertEqual(progress['state'], 'running')
+        self.assertEqual((progress['total'], progress['waiting']), (1, 1))
+
+        # The book is set to bake.
+        self.assertEqual(advance_rebake_run(cursor, run_id),
+                         [self.module_ident])
+        self.assertEqual(self._get_stateid(cursor), 5)
+        self.assertEqual(get_rebake_run_progress(cursor, run_id)['queued'], 1)
+
+        # Nothing happens while the book is baking.
+        self._set_stateid(cursor, 6)
+        self.assertEqual(advance_rebake_run(cursor, run_id), [])
+        self.assertEqual(get_rebake_run_progress(cursor, run_id)['queued'], 1)
+
+        # The book is settled and the run finishes.
+        self._set_stateid(cursor, 1)
+        advance_rebake_run(cursor, run_id)
+        progress = get_rebake_run_progress(cursor, run_id)
+        self.assertEqual(progress['state'], 'finished')
+        self.assertEqual((progress['done'], progress['failed']), (1, 0))
+
+    @db_connect
+    def test_run_with_failure(self, cursor):
+        from cnxpublishing.rebake import (
+            advance_rebake_run,
+            create_rebake_run,
+            get_rebake_run_progress,
+        )
+        run_id = create_rebake_run(cursor, uuids=[self.uuid])
+        advance_rebake_run(cursor, run_id)
+        self._set_stateid(cursor, 7)
+        advance_rebake_run(cursor, run_id)
+
+        progress = get_rebake_run_progress(cursor, run_id)
+        self.assertEqual(progress['state'], 'finished')
+        self.assertEqual((progress['done'], progress['failed']), (0, 1))
+
+    @db_connect
+    def test_cancel(self, cursor):
+        from cnxpublishing.rebake import (
+            advance_rebake_run,
+            cancel_rebake_run,
+            create_rebake_run,
+            get_rebake_run_progress,
+        )
+        run_id = create_rebake_run(cursor, print_style='physics')
+        self.assertTrue(cancel_rebake_run(cursor, run_id))
+        self.assertFalse(cancel_rebake_run(cursor, run_id))
+
+        self.assertEqual(advance_rebake_run(cursor, run_id), [])
+        self.assertEqual(self._get_stateid(cursor), 1)
+        progress = get_rebake_run_progress(cursor, run_id)
+        self.assertEqual(progress['state'], 'cancelled')
+        self.assertEqual(progress['waiting'], 1)
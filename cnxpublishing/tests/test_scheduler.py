@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+
+
+BOOK_ONE = 'e79ffde3-7fb4-4af3-9ec8-df648b391597'
+BOOK_TWO = '3bdd1bcc-9e21-4a17-b1d4-c2c4ba6ac34c'
+
+
+class FauxClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class BakeSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FauxClock()
+
+    def make_one(self, **kwargs):
+        from cnxpublishing.scheduler import BakeScheduler
+        kwargs.setdefault('clock', self.clock)
+        return BakeScheduler(**kwargs)
+
+    def make_request(self, module_ident, uuid_, version, **kwargs):
+        from cnxpublishing.scheduler import BakeRequest
+        kwargs.setdefault('submitted', self.clock())
+        ident_hash = '{}@{}'.format(uuid_, version)
+        return BakeRequest(module_ident, ident_hash, **kwargs)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_one(policy='random')
+
+    def test_coalesce_keeps_newest_version(self):
+        scheduler = self.make_one()
+        older = self.make_request(1, BOOK_ONE, '1.1')
+        newer = self.make_request(2, BOOK_ONE, '1.2')
+
+        self.assertEqual(scheduler.submit(older), None)
+        self.assertEqual(scheduler.submit(newer), older)
+
+        self.assertEqual(scheduler.depth, 1)
+        self.assertEqual(scheduler.coalesced_count, 1)
+        self.assertEqual(scheduler.pop(), newer)
+
+    def test_coalesce_drops_older_arrival(self):
+        scheduler = self.make_one()
+        newer = self.make_request(2, BOOK_ONE, '2.1')
+        older = self.make_request(1, BOOK_ONE, '1.10')
+
+        scheduler.submit(newer)
+        self.assertEqual(scheduler.submit(older), older)
+        self.assertEqual(scheduler.pop(), newer)
+
+    def test_coalesce_repeated_request(self):
+        scheduler = self.make_one()
+        request = self.make_request(1, BOOK_ONE, '1.1')
+        repeated = self.make_request(1, BOOK_ONE, '1.1')
+
+        scheduler.submit(request)
+        self.assertEqual(scheduler.submit(repeated), None)
+        self.assertEqual(scheduler.depth, 1)
+
+    def test_coalesce_keeps_place_in_line(self):
+        scheduler = self.make_one()
+        older = self.make_request(1, BOOK_ONE, '1.1')
+        scheduler.submit(older)
+        self.clock.now += 30
+        newer = self.make_request(2, BOOK_ONE, '1.2')
+        scheduler.submit(newer)
+
+        self.assertEqual(newer.submitted, older.submitted)
+
+    def test_new_content_before_rebake(self):
+        scheduler = self.make_one()
+        rebake = self.make_request(1, BOOK_ONE, '1.1', is_rebake=True,
+                                   size=1)
+        new = self.make_request(2, BOOK_TWO, '1.1', size=500)
+        scheduler.submit(rebake)
+        scheduler.submit(new)
+
+        self.assertEqual(scheduler.pop(), new)
+        self.assertEqual(scheduler.pop(), rebake)
+        self.assertEqual(scheduler.pop(), None)
+
+    def test_smallest_first(self):
+        scheduler = self.make_one(policy='smallest-first')
+        big = self.make_request(1, BOOK_ONE, '1.1', size=500)
+        self.clock.now += 10
+        small = self.make_request(2, BOOK_TWO, '1.1', size=5)
+        scheduler.submit(big)
+        scheduler.submit(small)
+
+        self.assertEqual(scheduler.pop(), small)
+
+    def test_aging(self):
+        scheduler = self.make_one(policy='aging')
+        big = self.make_request(1, BOOK_ONE, '1.1', size=500)
+        self.clock.now += 10
+        small = self.make_request(2, BOOK_TWO, '1.1', size=5)
+        scheduler.submit(big)
+        scheduler.submit(small)
+
+        self.assertEqual(scheduler.pop(), big)
+
+    def test_max_wait_promotes_rebake(self):
+        scheduler = self.make_one(max_wait=60)
+        rebake = self.make_request(1, BOOK_ONE, '1.1', is_rebake=True)
+        scheduler.submit(rebake)
+        self.clock.now += 61
+        new = self.make_request(2, BOOK_TWO, '1.1')
+        scheduler.submit(new)
+
+        self.assertEqual(scheduler.pop(), rebake)
+
+    def test_take_respects_concurrency(self):
+        scheduler = self.make_one(concurrency=1)
+        one = self.make_request(1, BOOK_ONE, '1.1')
+        two = self.make_request(2, BOOK_TWO, '1.1')
+        scheduler.submit(one)
+        scheduler.submit(two)
+
+        requests = scheduler.take()
+        self.assertEqual(requests, [one])
+        scheduler.mark_dispatched('task-1', one)
+        self.assertEqual(scheduler.take(), [])
+
+        scheduler.mark_finished(['task-1'])
+        self.assertEqual(scheduler.take(), [two])
+
+    def test_clear(self):
+        scheduler = self.make_one(concurrency=1)
+        one = self.make_request(1, BOOK_ONE, '1.1')
+        two = self.make_request(2, BOOK_TWO, '1.1')
+        scheduler.submit(one)
+        scheduler.mark_dispatched('task-1', scheduler.take()[0])
+        scheduler.submit(two)
+
+        self.assertEqual(scheduler.clear(), 1)
+        self.assertEqual(scheduler.depth, 0)
+        # The dispatched request still holds the capacity.
+        self.assertEqual(scheduler.in_flight, ['task-1'])
+
+    def test_stats(self):
+        scheduler = self.make_one()
+        scheduler.submit(self.make_request(1, BOOK_ONE, '1.1'))
+        self.clock.now += 20
+        scheduler.submit(self.make_request(2, BOOK_TWO, '1.1'))
+        self.clock.now += 10
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['depth'], 2)
+        self.assertEqual(stats['oldest_wait'], 30)
+        self.assertEqual(stats['mean_wait'], 20)
+
+        scheduler.pop()
+        self.assertEqual(scheduler.stats()['last_wait'], 30)
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import json
 import time
 
 import pytest
@@ -36,10 +35,12 @@ def test_startup_event(db_cursor, complex_book_one,
     except IndexError:
         pytest.fail("the target did not create any notifications")
 
-    # Check that a notification was sent.
-    payload = json.loads(notify.payload)
-    assert book_one.ident_hash in payload['ident_hash']
-    assert ident_mapping[book_one.ident_hash] == payload['module_ident']
+    # Check that a notification was sent and the book is in the outbox.
+    assert notify.channel == 'post_publication'
+    cursor.execute("SELECT ident_hash FROM post_publication_outbox "
+                   "WHERE module_ident = %s",
+                   (ident_mapping[book_one.ident_hash],))
+    assert [row[0] for row in cursor.fetchall()] == [book_one.ident_hash]
 
 
 def test_recipe_selection(db_cursor, complex_book_one, recipes):
@@ -102,6 +103,27 @@ def test_recipe_selection(db_cursor, complex_book_one, recipes):
     assert recipe_ids == (None, recipes[1])
 
 
+def test_recipe_selection_by_module(db_cursor, complex_book_one,
+                                    complex_book_one_v2, recipes):
+    module_idents = [complex_book_one[1][complex_book_one[0].ident_hash],
+                     complex_book_one_v2[1][complex_book_one_v2[0].ident_hash]]
+    db_cursor.execute("UPDATE modules SET print_style = %s "
+                      "WHERE module_ident = %s",
+                      ('style_with_recipe_one', module_idents[0]))
+
+    from cnxpublishing.subscribers import (
+        _get_recipe_ids,
+        _get_recipe_ids_by_module as target,
+    )
+    recipe_ids = target(module_idents + [-1], db_cursor)
+
+    assert sorted(recipe_ids.keys()) == sorted(module_idents)
+    assert recipe_ids[module_idents[0]] == (recipes[0], None)
+    for module_ident in module_idents:
+        assert (recipe_ids[module_ident] ==
+                _get_recipe_ids(module_ident, db_cursor))
+
+
 class TestPostPublicationProcessing(object):
     @pytest.fixture(autouse=True)
     def suite_fixture(self, scoped_pyramid_app, complex_book_one,
@@ -178,6 +200,21 @@ class TestPostPublicationProcessing(object):
                           (self.module_ident,))
         assert db_cursor.fetchone()[0] == 'current'
 
+        db_cursor.execute("SELECT state, started IS NOT NULL, duration, "
+                          "stages "
+                          "FROM bake_jobs WHERE id = %s", (result_id,))
+        job_state, was_started, duration, stages = db_cursor.fetchone()
+        assert job_state == 'finished'
+        assert was_started
+        assert duration is not None
+        assert [s['name'] for s in stages] == [
+            'export', 'prefetch_exercises', 'collate', 'checkpoint',
+            'compare', 'remove_baked', 'publish_pages', 'publish_tree']
+
+        db_cursor.execute("SELECT write_mode FROM bake_jobs WHERE id = %s",
+                          (result_id,))
+        assert db_cursor.fetchone()[0] == 'full'
+
     def test_error_handling_of_unknown_error(self, db_cursor, mocker):
         exc_msg = 'something failed during baking'
 
@@ -255,6 +292,69 @@ class TestPostPublicationProcessing(object):
                           (self.module_ident,))
         db_cursor.fetchone()[0] == 'errored'
 
+    def test_error_handling_removes_checkpoints(self, db_cursor, mocker):
+
+        def bake(binder, recipe_id, publisher, message, cursor, **kwargs):
+            kwargs['checkpoints'].save(recipe_id, 'collate', b'<html/>')
+            raise Exception('something failed during baking')
+
+        mock_bake = mocker.patch('cnxpublishing.subscribers.bake')
+        mock_bake.side_effect = bake
+
+        self.target(self.make_event())
+
+        db_cursor.execute("SELECT result_id::text "
+                          "FROM document_baking_result_associations "
+                          "WHERE module_ident = %s "
+                          "ORDER BY created DESC",
+                          (self.module_ident,))
+        result_id = db_cursor.fetchone()[0]
+
+        from celery.result import AsyncResult
+        with pytest.raises(Exception):
+            AsyncResult(id=result_id).get()  # blocking operation
+
+        # The errored bake's checkpoints aren't kept.
+        db_cursor.execute("SELECT count(*) FROM bake_checkpoints "
+                          "WHERE module_ident = %s", (self.module_ident,))
+        assert db_cursor.fetchone()[0] == 0
+
+    def test_error_handling_of_time_limit(self, db_cursor, mocker):
+        from celery.exceptions import SoftTimeLimitExceeded
+
+        def bake(binder, recipe_id, publisher, message, cursor, **kwargs):
+            # Partly write the bake.
+            cursor.execute("UPDATE modules SET print_style = 'half-baked' "
+                           "WHERE module_ident = %s", (self.module_ident,))
+            raise SoftTimeLimitExceeded()
+
+        mock_bake = mocker.patch('cnxpublishing.subscribers.bake')
+        mock_bake.side_effect = bake
+
+        self.target(self.make_event())
+
+        db_cursor.execute("SELECT result_id::text "
+                          "FROM document_baking_result_associations "
+                          "WHERE module_ident = %s "
+                          "ORDER BY created DESC",
+                          (self.module_ident,))
+        result_id = db_cursor.fetchone()[0]
+
+        from celery.result import AsyncResult
+        AsyncResult(id=result_id).get()  # blocking operation
+
+        # The partly written bake is discarded and the book is errored.
+        db_cursor.execute("SELECT ms.statename, m.print_style "
+                          "FROM modules AS m NATURAL JOIN modulestates AS ms "
+                          "WHERE module_ident = %s",
+                          (self.module_ident,))
+        statename, print_style = db_cursor.fetchone()
+        assert statename == 'errored'
+        assert print_style != 'half-baked'
+        db_cursor.execute("SELECT state FROM bake_jobs WHERE id = %s",
+                          (result_id,))
+        assert db_cursor.fetchone()[0] == 'failed'
+
     def test_duplicate_baking(self, db_cursor):
         # Set up (setUp) creates the content, thus putting it in the
         # post-publication state. We simply create the event associated
@@ -275,6 +375,26 @@ class TestPostPublicationProcessing(object):
                           "WHERE module_ident = %s", (self.module_ident,))
         assert db_cursor.fetchone()[0] == 1
 
+    def test_outbox_entry_removed(self, db_cursor, mocker):
+        mocker.patch('cnxpublishing.subscribers.bake')
+        self.target(self.make_event())
+
+        db_cursor.execute("SELECT count(*) FROM post_publication_outbox "
+                          "WHERE module_ident = %s", (self.module_ident,))
+        assert db_cursor.fetchone()[0] == 0
+
+    def test_outbox_entry_kept_on_error(self, db_cursor, mocker):
+        mock_process = mocker.patch(
+            'cnxpublishing.subscribers.process_post_publications')
+        mock_process.side_effect = Exception('forced error')
+        self.target(self.make_event())
+
+        # Left to be retried once its lease expires.
+        db_cursor.execute("SELECT attempts, leased_until IS NOT NULL "
+                          "FROM post_publication_outbox "
+                          "WHERE module_ident = %s", (self.module_ident,))
+        assert db_cursor.fetchall() == [(1, True)]
+
     def test_rebaking(self, db_cursor, mocker):
         mock_bake = mocker.patch('cnxpublishing.subscribers.bake')
 
@@ -298,6 +418,9 @@ class TestPostPublicationProcessing(object):
 
         # After baking is finished, if the module state is set to
         # "post-publication" again, another event is created
+        db_cursor.execute("UPDATE modules SET stateid = 5 "
+                          "WHERE module_ident = %s", (self.module_ident,))
+        db_cursor.connection.commit()
         event = self.make_event()
 
         self.target(event)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import sys
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import celery
+from celery import signals
+from pyramid import testing
+
+
+class PrewarmTestCase(unittest.TestCase):
+
+    def test(self):
+        from cnxpublishing.worker import prewarm
+        sys.modules.pop('json.tool', None)
+        prewarm(['json.tool'])
+        self.assertIn('json.tool', sys.modules)
+
+
+class ConfigureBakingWorkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'db-connection-string': 'dbname=testing',
+            'baking.worker.max_bakes': '10',
+            'baking.worker.max_rss': '500000',
+            'baking.worker.recipe_cache_size': '8',
+        })
+        self.celery_app = celery.Celery('tasks')
+
+    def tearDown(self):
+        from cnxpublishing.worker import DISPATCH_UID
+        for signal in (signals.worker_init, signals.worker_process_init,
+                       signals.worker_process_shutdown):
+            signal.disconnect(dispatch_uid=DISPATCH_UID)
+        testing.tearDown()
+
+    def target(self):
+        from cnxpublishing.worker import configure_baking_worker
+        return configure_baking_worker(self.celery_app, self.config.registry)
+
+    def test_recycling(self):
+        conf = self.target().conf
+        self.assertEqual(conf['worker_max_tasks_per_child'], 10)
+        self.assertEqual(conf['worker_max_memory_per_child'], 500000)
+
+    def test_recycling_after_bake_memory_ceiling(self):
+        # The process that stopped a bake isn't left to run its retry.
+        self.config.registry.settings['baking.memory.max_rss'] = '400000'
+        conf = self.target().conf
+        self.assertEqual(conf['worker_max_memory_per_child'], 400000)
+
+    def test_unlimited(self):
+        self.config.registry.settings['baking.worker.max_rss'] = '0'
+        conf = self.target().conf
+        self.assertEqual(conf['worker_max_memory_per_child'], None)
+
+    @mock.patch('cnxpublishing.worker.prepare')
+    @mock.patch('cnxpublishing.worker.bake')
+    @mock.patch('cnxpublishing.worker.db')
+    def test_process_lifecycle(self, db, bake, prepare):
+        self.target()
+
+        signals.worker_process_init.send(sender=None)
+        prepare.assert_called_once_with(registry=self.config.registry)
+        self.assertTrue(self.celery_app.conf['pyramid_prepared'])
+        db.init_process_db_pool.assert_called_once_with('dbname=testing')
+        bake.enable_recipe_cache.assert_called_once_with(8)
+
+        signals.worker_process_shutdown.send(sender=None)
+        db.close_process_db_pool.assert_called_once_with()
@@ -5,8 +5,9 @@
 # Public License version 3 (AGPLv3).
 # See LICENCE.txt for details.
 # ###
-import os
 import functools
+import imp
+import os
 
 import psycopg2
 from cnxdb.init import init_db as _init_db
@@ -17,6 +18,7 @@ __all__ = (
     'TEST_DATA_DIR',
     'integration_test_settings',
     'db_connection_factory', 'db_connect',
+    'apply_migrations',
 )
 
 
@@ -78,3 +80,19 @@ def init_db(db_conn_str):
     from sqlalchemy import create_engine
     engine = create_engine(db_conn_str)
     _init_db(engine, venv)
+    apply_migrations(db_conn_str)
+
+
+def apply_migrations(db_conn_str):
+    """Applies this project's migrations on top of the cnx-db schema."""
+    from ..main import find_migrations_directory
+    migrations_dir = find_migrations_directory()
+    filenames = sorted([f for f in os.listdir(migrations_dir)
+                        if f.endswith('.py') and not f.startswith('_')])
+    with psycopg2.connect(db_conn_str) as db_conn:
+        with db_conn.cursor() as cursor:
+            for filename in filenames:
+                name = 'cnxpublishing_migration_{}'.format(filename[:-3])
+                migration = imp.load_source(
+                    name, os.path.join(migrations_dir, filename))
+                migration.up(cursor)
@@ -74,17 +74,12 @@ class BaseFunctionalViewTestCase(unittest.TestCase, EPUBMixInTestCase):
         attr_name = '_api_keys'
         api_keys = getattr(self, attr_name, None)
 
-        def get_info():
-            from cnxpublishing.authnz import lookup_api_key_info
-            with self.db_connect() as db_conn:
-                with db_conn.cursor():
-                    return lookup_api_key_info()
-
         if api_keys is None:
             self.addCleanup(delattr, self, attr_name)
-            api_keys = {}
-            for key, value in get_info().items():
-                api_keys[value['name']] = key
+            with self.db_connect() as db_conn:
+                with db_conn.cursor() as cursor:
+                    cursor.execute("SELECT name, key FROM api_keys")
+                    api_keys = dict(cursor.fetchall())
             setattr(self, attr_name, api_keys)
         return api_keys
 
@@ -112,7 +107,7 @@ class BaseFunctionalViewTestCase(unittest.TestCase, EPUBMixInTestCase):
     def tear_down_api_keys(self):
         # Invalidate the api_key lookup cache
         from cnxpublishing import authnz
-        authnz.cache_manager.invalidate(authnz.lookup_api_key_info)
+        authnz.api_key_cache.clear()
 
     @classmethod
     def setUpClass(cls):
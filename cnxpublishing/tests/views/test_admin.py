@@ -14,6 +14,10 @@ except ImportError:
     import mock
 
 from datetime import datetime
+try:
+    from urllib.parse import parse_qsl
+except ImportError:
+    from urlparse import parse_qsl
 
 from pyramid import testing
 import psycopg2
@@ -324,6 +328,7 @@ class ContentStatusViewsTestCase(unittest.TestCase):
             'sort': 'bpsa.created DESC',
             'sort_created': 'fa fa-angle-down',
             'total_entries': 2,
+            'next_link': None,
             'states': content['states']
         }, content)
         self.assertEqual(
@@ -359,6 +364,7 @@ class ContentStatusViewsTestCase(unittest.TestCase):
             'sort': 'STATE ASC',
             'sort_state': 'fa fa-angle-up',
             'total_entries': 2,
+            'next_link': None,
             'states': content['states']
         }, content)
         self.assertEqual(len(content['states']), 2)
@@ -369,6 +375,38 @@ class ContentStatusViewsTestCase(unittest.TestCase):
             content['states'],
             sorted(content['states'], key=lambda x: x['state']))
 
+    def test_admin_content_status_next_page(self):
+        request = testing.DummyRequest(params=MultiDict([
+            ('number', 1),
+        ]))
+
+        from ...views.admin import admin_content_status
+        first_page = admin_content_status(request)
+        self.assertEqual(first_page['total_entries'], 2)
+        self.assertEqual(len(first_page['states']), 1)
+        self.assertIn('after=', first_page['next_link'])
+
+        query = first_page['next_link'].split('?', 1)[1]
+        request = testing.DummyRequest(params=MultiDict(parse_qsl(query)))
+        second_page = admin_content_status(request)
+        self.assertEqual(second_page['page'], 2)
+        self.assertEqual(second_page['start_entry'], 1)
+        self.assertEqual(second_page['next_link'], None)
+        self.assertEqual(len(second_page['states']), 1)
+        self.assertTrue(first_page['states'][0]['created'] >=
+                        second_page['states'][0]['created'])
+
+    def test_admin_content_status_bad_after(self):
+        request = testing.DummyRequest(params=MultiDict([
+            ('after', '2017-01-01T00:00:00+00:00'),
+            ('after_id', 'abc'),
+        ]))
+
+        from ...views.admin import admin_content_status
+        with self.assertRaises(HTTPBadRequest) as caught_exc:
+            admin_content_status(request)
+        self.assertIn('invalid after_id', caught_exc.exception.message)
+
     def test_admin_content_status_stale_recipe(self):
         uuid = 'd5dbbd8e-d137-4f89-9d0a-3ac8db53d8ee'
         with psycopg2.connect(self.db_conn_str) as db_conn:
@@ -478,17 +516,20 @@ Hi there!
             'current_recipe': None,
             'current_ident': 2,
             'current_state': u'PENDING',
+            'bake_version': content['bake_version'],
             'states': [
                 {'version': '1.1',
                  'recipe': None,
                  'created': content['states'][0]['created'],
                  'state': 'PENDING',
-                 'state_message': ''},
+                 'state_message': '',
+                 'stages': []},
                 {'version': '1.1',
                  'recipe': None,
                  'created': content['states'][1]['created'],
                  'state': 'PENDING',
-                 'state_message': ''}
+                 'state_message': '',
+                 'stages': []}
             ]
         }, content)
 
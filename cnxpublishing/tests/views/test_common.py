@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+import unittest
+from datetime import datetime, timedelta
+
+from pyramid import httpexceptions
+from webob import Request
+from webob.datetime_utils import UTC
+
+
+class RaiseIfNotModifiedTestCase(unittest.TestCase):
+
+    modified = datetime(2019, 1, 2, 3, 4, 5, 678, tzinfo=UTC)
+
+    def target(self, request, *args):
+        from cnxpublishing.views.common import raise_if_not_modified
+        request.response = request.ResponseClass()
+        return raise_if_not_modified(request, *args)
+
+    def test_modified(self):
+        request = Request.blank('/', headers={'If-None-Match': '"41"'})
+        self.target(request, 42, self.modified)
+        self.assertEqual(request.response.etag, '42')
+        self.assertEqual(request.response.last_modified,
+                         self.modified.replace(microsecond=0))
+
+    def test_etag(self):
+        request = Request.blank('/', headers={'If-None-Match': '"42"'})
+        with self.assertRaises(httpexceptions.HTTPNotModified) as caught:
+            self.target(request, 42, self.modified)
+        self.assertEqual(caught.exception.etag, '42')
+
+    def test_modified_since(self):
+        request = Request.blank('/')
+        request.if_modified_since = self.modified
+        with self.assertRaises(httpexceptions.HTTPNotModified):
+            self.target(request, 42, self.modified)
+
+        request.if_modified_since = self.modified - timedelta(seconds=1)
+        self.target(request, 42, self.modified)
+
+    def test_modified_within_the_second(self):
+        modified = datetime.now(UTC)
+        request = Request.blank('/')
+        request.if_modified_since = modified
+        # Another change may follow within the same second.
+        self.target(request, 42, modified)
+        self.assertIsNone(request.response.last_modified)
+        self.assertEqual(request.response.etag, '42')
+
+    def test_not_modified_revalidates(self):
+        request = Request.blank('/', headers={'If-None-Match': '"42"'})
+        with self.assertRaises(httpexceptions.HTTPNotModified) as caught:
+            self.target(request, 42, self.modified)
+        cache_control = caught.exception.cache_control
+        self.assertTrue(cache_control.no_cache)
+        self.assertFalse(cache_control.no_store)
+
+    def test_etag_over_modified_since(self):
+        request = Request.blank('/', headers={'If-None-Match': '"41"'})
+        request.if_modified_since = self.modified
+        self.target(request, 42, self.modified)
@@ -16,6 +16,7 @@ except ImportError:
     import mock
 
 import cnxepub
+import psycopg2
 from pyramid import httpexceptions
 from pyramid import testing
 from webob import Request
@@ -339,6 +340,16 @@ GROUP BY user_id, accepted
         headers = self._extract_cookie_header(resp)
         resp = self.app_get_moderation(headers=headers)
         self.assertIn(publication_id, [p['id'] for p in resp.json])
+        # The list only summarizes the documents,
+        # which are in the publication's details.
+        moderation = [p for p in resp.json if p['id'] == publication_id][0]
+        self.assertEqual(moderation['model_count'],
+                         len(moderation['models']))
+        self.assertNotIn('content', moderation['models'][0])
+        resp = self.app.get('/moderations/{}'.format(publication_id),
+                            headers=headers)
+        self.assertEqual(resp.json['id'], publication_id)
+        self.assertEqual(len(resp.json['models']), moderation['model_count'])
         # Now post the moderation approval.
         resp = self.app_post_moderation(publication_id,
                                         {'is_accepted': True},
@@ -353,6 +364,33 @@ GROUP BY user_id, accepted
         # 5. (manual)
         self._check_published_to_archive(use_cases.BOOK)
 
+    def test_moderation_paging(self):
+        publication_ids = []
+        with self.db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                for i in range(3):
+                    cursor.execute("""\
+INSERT INTO publications (publisher, publication_message, epub, state)
+VALUES ('ream', %s, %s, 'Waiting for moderation')
+RETURNING id""", ('page {}'.format(i), psycopg2.Binary(b'epub'),))
+                    publication_ids.append(cursor.fetchone()[0])
+        resp = self.app_login('direwolf', 'direwolf')
+        headers = self._extract_cookie_header(resp)
+
+        resp = self.app.get('/moderations?limit=2', headers=headers)
+        self.assertEqual([p['id'] for p in resp.json], publication_ids[:2])
+        self.assertEqual(resp.json[0]['model_count'], 0)
+        # Follow the link to the next (and last) page.
+        link = resp.headers['Link']
+        self.assertTrue(link.endswith('; rel="next"'))
+        resp = self.app.get(link[link.index('<') + 1:link.index('>')],
+                            headers=headers)
+        self.assertEqual([p['id'] for p in resp.json], publication_ids[2:])
+        self.assertNotIn('Link', resp.headers)
+
+        self.app.get('/moderations?limit=0', headers=headers, status=400)
+        self.app.get('/moderations?after=last', headers=headers, status=400)
+
     def test_publishing_spam(self):
         """\
         Publish *new* documents.
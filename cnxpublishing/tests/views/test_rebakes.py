@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+from .. import use_cases
+from ..testing import db_connect
+from .base import BaseFunctionalViewTestCase
+
+
+class RebakeViewsTestCase(BaseFunctionalViewTestCase):
+
+    @db_connect
+    def setUp(self, cursor):
+        super(RebakeViewsTestCase, self).setUp()
+        binder = use_cases.setup_BOOK_in_archive(self, cursor)
+        cursor.execute("""\
+UPDATE modules SET print_style = 'physics', stateid = 1
+WHERE ident_hash(uuid, major_version, minor_version) = %s""",
+                       (binder.ident_hash,))
+
+    def test_post_and_get(self):
+        api_key_headers = self.gen_api_key_headers('some-trust')
+        resp = self.app.post_json('/rebakes',
+                                  {'print_style': 'physics',
+                                   'batch_size': 2},
+                                  headers=api_key_headers, status=202)
+        progress = resp.json
+        self.assertEqual(progress['print_style'], 'physics')
+        self.assertEqual(progress['batch_size'], 2)
+        self.assertEqual((progress['total'], progress['waiting']), (1, 1))
+        self.assertEqual(resp.headers['Location'],
+                         'http://localhost/rebakes/{}'.format(progress['id']))
+
+        resp = self.app.get('/rebakes/{}'.format(progress['id']),
+                            headers=[('Accept', 'application/json')])
+        self.assertEqual(resp.json['state'], 'running')
+
+    def test_post_without_books(self):
+        api_key_headers = self.gen_api_key_headers('some-trust')
+        self.app.post_json('/rebakes', {'print_style': 'math'},
+                           headers=api_key_headers, status=400)
+
+    def test_post_invalid(self):
+        api_key_headers = self.gen_api_key_headers('some-trust')
+        self.app.post_json('/rebakes', {}, headers=api_key_headers,
+                           status=400)
+        self.app.post_json('/rebakes',
+                           {'print_style': 'physics', 'concurrency': 0},
+                           headers=api_key_headers, status=400)
+
+    def test_post_unauthorized(self):
+        self.app.post_json('/rebakes', {'print_style': 'physics'},
+                           status=403)
+
+    def test_delete(self):
+        api_key_headers = self.gen_api_key_headers('some-trust')
+        resp = self.app.post_json('/rebakes', {'print_style': 'physics'},
+                                  headers=api_key_headers, status=202)
+        path = '/rebakes/{}'.format(resp.json['id'])
+
+        resp = self.app.delete(path, headers=api_key_headers)
+        self.assertEqual(resp.json['state'], 'cancelled')
+
+    def test_get_not_found(self):
+        self.app.get('/rebakes/100', headers=[('Accept', 'application/json')],
+                     status=404)
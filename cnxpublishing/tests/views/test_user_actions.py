@@ -284,6 +284,30 @@ INSERT INTO document_controls (uuid) VALUES (DEFAULT) RETURNING uuid""")
         resp = self.app.get(path, headers=api_key_header)
         self.assertEqual(resp.json, expected)
 
+    @db_connect
+    def test_acl_request_not_modified(self, cursor):
+        cursor.execute("""\
+INSERT INTO document_controls (uuid) VALUES (DEFAULT) RETURNING uuid""")
+        uuid_ = cursor.fetchone()[0]
+        cursor.connection.commit()
+
+        api_key_header = self.gen_api_key_headers('some-trust')
+        path = "/contents/{}/permissions".format(uuid_)
+        resp = self.app.get(path, headers=api_key_header)
+        etag = resp.headers['ETag']
+
+        resp = self.app.get(path, status=304,
+                            headers=api_key_header + [('If-None-Match', etag)])
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        # Changing the ACL changes the version.
+        data = [{'uid': 'ream', 'permission': 'publish'}]
+        self.app.post_json(path, data, headers=api_key_header)
+        resp = self.app.get(path,
+                            headers=api_key_header + [('If-None-Match', etag)])
+        self.assertEqual(resp.status_int, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
     def test_create_identifier_on_licensors_request(self):
         """Submit a set of users to initial license acceptance.
         This tests whether a trusted publisher has the permission
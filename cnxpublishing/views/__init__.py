@@ -23,6 +23,8 @@ def declare_api_routes(config):
     # TODO (8-May-12017) Remove because the term collate is being phased out.
     add_route('collate-content', '/contents/{ident_hash}/collate-content')
     add_route('bake-content', '/contents/{ident_hash}/baked')
+    add_route('rebakes', '/rebakes')
+    add_route('rebake', '/rebakes/{id}')
 
     # Moderation routes
     add_route('moderation', '/moderations')
@@ -57,6 +59,8 @@ def declare_browsable_routes(config):
 
     add_route('admin-content-status', '/a/content-status/')
     add_route('admin-content-status-single', '/a/content-status/{uuid}')
+    add_route('admin-content-status-single-wait',
+              '/a/content-status/{uuid}/wait')
 
     add_route('admin-print-style', '/a/print-style/')
     add_route('admin-print-style-single', '/a/print-style/{style}')
@@ -8,11 +8,13 @@
 from __future__ import absolute_import
 from uuid import UUID
 
+import psycopg2
 from psycopg2.extras import DictCursor
 from pyramid import httpexceptions
 from pyramid.view import view_config
 
-from ...db import db_connect
+from ...db import db_connect, get_bake_state_version
+from ...longpoll import BAKE_STATE_CHANNEL, wait_for_change
 
 
 STATE_ICONS = [
@@ -37,63 +39,149 @@ __all__ = (
     'admin_content_status',
     'admin_content_status_single',
     'admin_content_status_single_POST',
+    'admin_content_status_single_wait',
 )
 
 
-def get_baking_statuses_sql(get_request):
-    """ Creates SQL to get info on baking books filtered from GET request.
-
-    All books that have ever attempted to bake will be retured if they
-    pass the filters in the GET request.
-    If a single book has been requested to bake multiple times there will
-    be a row for each of the baking attempts.
-    By default the results are sorted in descending order of when they were
-    requested to bake.
-
-    N.B. The version reported for a print-style linked recipe will the the
-    lowest cnx-recipes release installed that contains the exact recipe
-    used to bake that book, regardless of when the book was baked relative
-    to recipe releases. E.g. if a book uses the 'physics' recipe, and it is
-    identical for versions 1.1, 1.2, 1.3, and 1.4, then it will be reported
-    as version 1.1, even if the most recent release is tagged 1.4.
-    """
-    args = {}
+#: The state of a baking attempt, as reported by the content status pages.
+#: The job state is tracked in the bake_jobs table. Associations made
+#: before that table existed may not have a job, in which case the
+#: state is unknown (i.e. 'PENDING').
+STATE_SQL = """\
+coalesce(CASE bj.state
+             WHEN 'queued' THEN 'QUEUED'
+             WHEN 'started' THEN 'STARTED'
+             WHEN 'retry' THEN 'RETRY'
+             WHEN 'failed' THEN 'FAILURE'
+             WHEN 'finished' THEN
+                 CASE WHEN ms.statename = 'fallback'
+                 THEN 'FALLBACK'
+                 ELSE 'SUCCESS'
+                 END
+         END, 'PENDING')"""
+#: The columns the results are ordered by, by sort. Each ends with
+#: the association's unique key, so the order is stable between pages.
+ORDER_BY = {
+    'bpsa.created': ['bpsa.created', 'bpsa.result_id'],
+    'm.name': ['m.name', 'bpsa.created', 'bpsa.result_id'],
+    'STATE': [STATE_SQL, 'bpsa.created', 'bpsa.result_id'],
+}
+
+
+def _get_sort(get_request):
     sort = get_request.get('sort', 'bpsa.created DESC')
     if (len(sort.split(" ")) != 2 or
             sort.split(" ")[0] not in SORTS_DICT.keys() or
             sort.split(" ")[1] not in ARROW_MATCH.keys()):
         raise httpexceptions.HTTPBadRequest(
             'invalid sort: {}'.format(sort))
-    if sort == "STATE ASC" or sort == "STATE DESC":
-        sort = 'bpsa.created DESC'
+    return sort
+
+
+def _get_status_filters(get_request):
+    if hasattr(get_request, 'getall'):
+        return get_request.getall('status_filter')
+    status_filters = get_request.get('status_filter', [])
+    if not isinstance(status_filters, (list, tuple)):
+        status_filters = [status_filters]
+    return list(status_filters)
+
+
+def _get_baking_statuses_filters(get_request):
+    """Returns the SQL conditions and arguments of the filters
+    in the GET request.
+
+    """
+    args = {}
+    conditions = []
     uuid_filter = get_request.get('uuid', '').strip()
     author_filter = get_request.get('author', '').strip()
     latest_filter = get_request.get('latest', False)
+    status_filters = _get_status_filters(get_request)
 
-    sql_filters = "WHERE"
     if latest_filter:
-        sql_filters += """ ARRAY [m.major_version, m.minor_version] = (
-         SELECT max(ARRAY[major_version,minor_version]) FROM
-                   modules where m.uuid= uuid) AND """
+        conditions.append("""EXISTS (
+         SELECT 1 FROM latest_module_versions
+         WHERE module_ident = m.module_ident)""")
     if uuid_filter != '':
         args['uuid'] = uuid_filter
-        sql_filters += " m.uuid=%(uuid)s AND "
+        conditions.append("m.uuid=%(uuid)s")
     if author_filter != '':
         author_filter = author_filter.decode('utf-8')
-        sql_filters += " %(author)s=ANY(m.authors) "
+        conditions.append("m.authors @> ARRAY[%(author)s]")
         args["author"] = author_filter
+    if status_filters:
+        conditions.append("{} = ANY(%(status_filters)s)".format(STATE_SQL))
+        args['status_filters'] = status_filters
+    return conditions, args
+
+
+def _get_keyset(get_request, sort):
+    """Returns the ``created`` timestamp and ``result_id`` of the last
+    association on the previous page, or None when the results are not
+    paged by key (i.e. they are not sorted by when they were created).
+
+    """
+    after = get_request.get('after', '').strip()
+    if not after or not sort.startswith('bpsa.created '):
+        return None
+    after_id = get_request.get('after_id', '').strip()
+    try:
+        UUID(after_id)
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest(
+            'invalid after_id: {}'.format(after_id))
+    return after, after_id
+
+
+def get_baking_statuses_sql(get_request, limit=None, offset=None):
+    """ Creates SQL to get info on baking books filtered from GET request.
+
+    All books that have ever attempted to bake will be retured if they
+    pass the filters in the GET request.
+    If a single book has been requested to bake multiple times there will
+    be a row for each of the baking attempts.
+    By default the results are sorted in descending order of when they were
+    requested to bake.
+
+    When sorted by when they were requested to bake, the results follow the
+    ``after`` (``created``) and ``after_id`` (``result_id``) of the last
+    result of the previous page, if given, rather than skipping ``offset``
+    results. At most ``limit`` results are returned.
+
+    N.B. The version reported for a print-style linked recipe will the the
+    lowest cnx-recipes release installed that contains the exact recipe
+    used to bake that book, regardless of when the book was baked relative
+    to recipe releases. E.g. if a book uses the 'physics' recipe, and it is
+    identical for versions 1.1, 1.2, 1.3, and 1.4, then it will be reported
+    as version 1.1, even if the most recent release is tagged 1.4.
+    """
+    sort = _get_sort(get_request)
+    column, direction = sort.split(" ")
+    conditions, args = _get_baking_statuses_filters(get_request)
+
+    keyset = _get_keyset(get_request, sort)
+    if keyset is not None:
+        args['after'], args['after_id'] = keyset
+        conditions.append(
+            "(bpsa.created, bpsa.result_id) {} "
+            "(%(after)s, %(after_id)s)".format(
+                direction == 'DESC' and '<' or '>'))
+        offset = None
+
+    sql_filters = ''
+    if conditions:
+        sql_filters = 'WHERE ' + ' AND '.join(conditions)
+    order_by = ', '.join(['{} {}'.format(order_column, direction)
+                          for order_column in ORDER_BY[column]])
+    sql_limit = ''
+    if limit is not None:
+        sql_limit += ' LIMIT %(limit)s'
+        args['limit'] = limit
+    if offset:
+        sql_limit += ' OFFSET %(offset)s'
+        args['offset'] = offset
 
-    if sql_filters.endswith("AND "):
-        sql_filters = sql_filters[:-4]
-    if sql_filters == "WHERE":
-        sql_filters = ""
-
-    # FIXME  celery AsyncResult API is soooo sloow that this page takes
-    # 2 min. or more to load on production.  As an workaround, this code
-    # accesses the celery_taskmeta table directly. Need to remove that access
-    # once we track enough state info ourselves. Want to track when queued,
-    # started, ended, etc. for future monitoring of baking system performance
-    # as well.
     # The 'limit 1' subselect is to ensure the "oldest identical version"
     # for recipes released as part of cnx-recipes (avoids one line per
     # identical recipe file in different releases, for a single baking job)
@@ -116,29 +204,48 @@ def get_baking_statuses_sql(get_request):
                        f.sha1 as recipe,
                        m.module_ident,
                        ident_hash(m.uuid, m.major_version, m.minor_version),
-                       bpsa.created, ctm.traceback,
-                       CASE WHEN ctm.status = 'SUCCESS'
-                           AND ms.statename = 'fallback'
-                       THEN 'FALLBACK'
-                       ELSE ctm.status
-                       END as state
+                       bpsa.created, bpsa.result_id, bj.traceback, bj.stages,
+                       {state} as state
                 FROM document_baking_result_associations AS bpsa
                 INNER JOIN modules AS m USING (module_ident)
                 INNER JOIN modulestates as ms USING (stateid)
-                LEFT JOIN celery_taskmeta AS ctm
-                    ON bpsa.result_id = ctm.task_id::uuid
+                LEFT JOIN bake_jobs AS bj
+                    ON bpsa.result_id = bj.id
                 LEFT JOIN default_print_style_recipes as dps
                     ON dps.print_style = m.print_style
-                LEFT JOIN latest_modules as lm
-                    ON lm.uuid=m.uuid
                 LEFT JOIN files f on m.recipe = f.fileid
-                {}
-                ORDER BY {};
-                """.format(sql_filters, sort)
+                {filters}
+                ORDER BY {order_by}{limit};
+                """.format(state=STATE_SQL, filters=sql_filters,
+                           order_by=order_by, limit=sql_limit)
     args.update({'sort': sort})
     return statement, args
 
 
+def get_baking_statuses_count_sql(get_request):
+    """Creates SQL to count the books filtered from the GET request
+    (see `get_baking_statuses_sql`), without the details of each.
+
+    """
+    conditions, args = _get_baking_statuses_filters(get_request)
+    joins = ''
+    if 'status_filters' in args:
+        joins = """
+                INNER JOIN modulestates as ms USING (stateid)
+                LEFT JOIN bake_jobs AS bj
+                    ON bpsa.result_id = bj.id"""
+    sql_filters = ''
+    if conditions:
+        sql_filters = 'WHERE ' + ' AND '.join(conditions)
+    statement = """
+                SELECT count(*)
+                FROM document_baking_result_associations AS bpsa
+                INNER JOIN modules AS m USING (module_ident){joins}
+                {filters};
+                """.format(joins=joins, filters=sql_filters)
+    return statement, args
+
+
 def format_authors(authors):
     if not authors:
         return ""
@@ -153,19 +260,38 @@ def admin_content_status(request):
     Returns a dictionary with the states and info of baking books,
     and the filters from the GET request to pre-populate the form.
     """
-    statement, sql_args = get_baking_statuses_sql(request.GET)
+    num_entries = request.params.get('number', 100) or 100
+    page = request.params.get('page', 1) or 1
+    try:
+        page = int(page)
+        num_entries = int(num_entries)
+        start_entry = (page - 1) * num_entries
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest(
+            'invalid page({}) or entries per page({})'.
+            format(page, num_entries))
+    # One more than a page is selected, to know whether there is a next page.
+    statement, sql_args = get_baking_statuses_sql(
+        request.GET, limit=num_entries + 1, offset=start_entry)
+    count_statement, count_args = get_baking_statuses_count_sql(request.GET)
 
     states = []
     status_filters = request.params.getall('status_filter') or []
     state_icons = dict(STATE_ICONS)
     with db_connect(cursor_factory=DictCursor) as db_conn:
         with db_conn.cursor() as cursor:
-            cursor.execute(statement, vars=sql_args)
-            for row in cursor.fetchall():
+            try:
+                cursor.execute(statement, vars=sql_args)
+            except psycopg2.DataError:
+                raise httpexceptions.HTTPBadRequest(
+                    'invalid after: {}'.format(sql_args.get('after')))
+            rows = cursor.fetchall()
+            cursor.execute(count_statement, vars=count_args)
+            total_entries = cursor.fetchone()[0]
+            has_next_page = len(rows) > num_entries
+            for row in rows[:num_entries]:
                 message = ''
                 state = row['state'] or 'PENDING'
-                if status_filters and state not in status_filters:
-                    continue
                 if state == 'FAILURE':  # pragma: no cover
                     if row['traceback'] is not None:
                         message = row['traceback'].split("\n")[-2]
@@ -199,32 +325,28 @@ def admin_content_status(request):
                     'content_link': request.route_path(
                         'get-content', ident_hash=row['ident_hash'])
                 })
-    sort = request.params.get('sort', 'bpsa.created DESC')
+    sort = sql_args['sort']
     sort_match = SORTS_DICT[sort.split(' ')[0]]
     sort_arrow = ARROW_MATCH[sort.split(' ')[1]]
-    if sort == "STATE ASC":
-        states.sort(key=lambda x: x['state'])
-    if sort == "STATE DESC":
-        states.sort(key=lambda x: x['state'], reverse=True)
 
-    num_entries = request.params.get('number', 100) or 100
-    page = request.params.get('page', 1) or 1
-    try:
-        page = int(page)
-        num_entries = int(num_entries)
-        start_entry = (page - 1) * num_entries
-    except ValueError:
-        raise httpexceptions.HTTPBadRequest(
-            'invalid page({}) or entries per page({})'.
-            format(page, num_entries))
-    total_entries = len(states)
-    states = states[start_entry: start_entry + num_entries]
-
-    returns = sql_args
+    next_link = None
+    if has_next_page:
+        query = [(key, value) for key, value in request.GET.items()
+                 if key not in ('page', 'after', 'after_id')]
+        query.append(('page', page + 1))
+        if sort.startswith('bpsa.created '):
+            last_row = rows[num_entries - 1]
+            query.extend([('after', last_row['created'].isoformat()),
+                          ('after_id', str(last_row['result_id']))])
+        next_link = request.route_path('admin-content-status', _query=query)
+
+    returns = dict([(key, sql_args[key]) for key in ('uuid', 'author')
+                    if key in sql_args])
     returns.update({'start_entry': start_entry,
                     'num_entries': num_entries,
                     'page': page,
                     'total_entries': total_entries,
+                    'next_link': next_link,
                     'states': states,
                     'sort_' + sort_match: sort_arrow,
                     'sort': sort,
@@ -262,6 +384,7 @@ def admin_content_status_single(request):
 
             states = []
             collection_info = modules[0]
+            bake_version = get_bake_state_version(cursor, uuid)
 
             for row in modules:
                 message = ''
@@ -280,6 +403,7 @@ def admin_content_status_single(request):
                     'created': str(row['created']),
                     'state': state,
                     'state_message': message,
+                    'stages': row['stages'] or [],
                 })
 
     return {'uuid': str(collection_info['uuid']),
@@ -289,9 +413,35 @@ def admin_content_status_single(request):
             'current_recipe': collection_info['recipe_id'],
             'current_ident': collection_info['module_ident'],
             'current_state': states[0]['state'],
+            'bake_version': bake_version,
             'states': states}
 
 
+@view_config(route_name='admin-content-status-single-wait',
+             request_method='GET', renderer='json',
+             permission='view', http_cache=0)
+def admin_content_status_single_wait(request):
+    """Returns the version of the bake states of a single book once it
+    is no longer the given ``version``, or once ``wait`` seconds have passed.
+    """
+    uuid = request.matchdict['uuid']
+    try:
+        UUID(uuid)
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest(
+            '{} is not a valid uuid'.format(uuid))
+
+    def get_version():
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                return get_bake_state_version(cursor, uuid)
+
+    version = wait_for_change(
+        request, BAKE_STATE_CHANNEL, uuid, get_version,
+        lambda version: version == request.params.get('version'))
+    return {'version': version}
+
+
 @view_config(route_name='admin-content-status-single', request_method='POST',
              renderer='cnxpublishing.views:'
                       'templates/content-status-single.html',
@@ -32,24 +32,12 @@ def admin_print_styles(request):
     # current book plus all default recipes that have not yet been used
     # as well as "bad" books that are not "current" state, but would otherwise
     # be the latest/current for that book
+    # (see `cnxpublishing.print_style_stats`)
     with db_connect(cursor_factory=DictCursor) as db_conn:
         with db_conn.cursor() as cursor:
             cursor.execute("""\
-                WITH latest AS (SELECT print_style, recipe,
-                    count(*), count(nullif(stateid, 1)) as bad
-                FROM modules m
-                WHERE portal_type = 'Collection'
-                      AND recipe IS NOT NULL
-                      AND (
-                          baked IS NOT NULL OR (
-                              baked IS NULL AND stateid not in (1,8)
-                              )
-                          )
-                      AND ARRAY [major_version, minor_version] = (
-                          SELECT max(ARRAY[major_version,minor_version]) FROM
-                              modules where m.uuid= uuid)
-
-                GROUP BY print_style, recipe
+                WITH latest AS (SELECT print_style, recipe, count, bad
+                FROM print_style_stats
                 ),
                 defaults AS (SELECT print_style, fileid AS recipe
                 FROM default_print_style_recipes d
@@ -131,9 +119,9 @@ def admin_print_styles_single(request):
                     LEFT JOIN files f ON psr.fileid = f.fileid
                     WHERE lm.print_style=%s
                     AND portal_type='Collection'
-                    AND ARRAY [major_version, minor_version] = (
-                        SELECT max(ARRAY[major_version,minor_version])
-                        FROM modules WHERE lm.uuid = uuid)
+                    AND EXISTS (
+                        SELECT 1 FROM latest_module_versions
+                        WHERE module_ident = lm.module_ident)
 
                     ORDER BY psr.tag DESC;
                     """, vars=(style,))
@@ -150,9 +138,9 @@ def admin_print_styles_single(request):
                     AND NOT EXISTS (
                         SELECT 1 from print_style_recipes psr
                         WHERE psr.fileid = lm.recipe)
-                    AND ARRAY [major_version, minor_version] = (
-                        SELECT max(ARRAY[major_version,minor_version])
-                        FROM modules WHERE lm.uuid = uuid)
+                    AND EXISTS (
+                        SELECT 1 FROM latest_module_versions
+                        WHERE module_ident = lm.module_ident)
                     ORDER BY uuid, recipe, revised DESC;
                     """, vars=(style,))
                 status = '(custom)'
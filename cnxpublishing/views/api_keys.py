@@ -30,12 +30,6 @@ SELECT row_to_json(combined_rows) FROM (
              renderer="cnxpublishing.views:templates/api-keys.html",
              permission='administer', http_cache=0)
 def admin_api_keys(request):  # pragma: no cover
-    # Easter Egg that will invalidate the cache, just hit this page.
-    # FIXME Move this logic into the C[R]UD views...
-    from ..authnz import lookup_api_key_info
-    from ..cache import cache_manager
-    cache_manager.invalidate(lookup_api_key_info)
-
     return {'api_keys': get_api_keys(request)}
 
 # TODO Add CRUD views for API Keys...
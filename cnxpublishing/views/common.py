@@ -5,10 +5,18 @@
 # Public License version 3 (AGPLv3).
 # See LICENCE.txt for details.
 # ###
+import datetime
+
 from pyramid import httpexceptions
 from pyramid.view import forbidden_view_config
 
 
+#: The ``http_cache`` of the views answering conditional requests
+#: (see `raise_if_not_modified`): a copy may be kept, but is revalidated
+#: on every use.
+REVALIDATE = (None, {'no_cache': True, 'private': True})
+
+
 @forbidden_view_config()
 def forbidden(request):
     if request.path.startswith('/a/'):
@@ -16,3 +24,58 @@ def forbidden(request):
             path = request.route_path('login', _query={'redirect': '/a/'})
             return httpexceptions.HTTPFound(location=path)
     return httpexceptions.HTTPForbidden()
+
+
+def _settled(last_modified, now=None):
+    """Returns ``last_modified`` truncated to the second (as in HTTP),
+    or None while that second isn't over, because a later change within
+    it would have the same Last-Modified.
+
+    """
+    if last_modified is None:
+        return None
+    if now is None:
+        now = datetime.datetime.now(last_modified.tzinfo)
+    last_modified = last_modified.replace(microsecond=0)
+    if last_modified >= now.replace(microsecond=0):
+        return None
+    return last_modified
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """Returns True when the client's copy is current, according to
+    the request's If-None-Match or, without it, If-Modified-Since.
+    If-Modified-Since is only relied on once the second of
+    ``last_modified`` is over.
+
+    """
+    if request.if_none_match:
+        return str(etag) in request.if_none_match
+    last_modified = _settled(last_modified)
+    return (last_modified is not None and
+            request.if_modified_since is not None and
+            last_modified <= request.if_modified_since)
+
+
+def raise_if_not_modified(request, etag, last_modified=None):
+    """Set the ETag and Last-Modified of the response to ``request``.
+    Raises HTTPNotModified when the client's copy is current
+    (see `is_not_modified`). Last-Modified is left out while its second
+    isn't over, so the client's copy is only compared by its ETag.
+
+    """
+    etag = str(etag)
+    last_modified = _settled(last_modified)
+    request.response.etag = etag
+    request.response.last_modified = last_modified
+
+    if is_not_modified(request, etag, last_modified):
+        not_modified = httpexceptions.HTTPNotModified()
+        not_modified.etag = etag
+        not_modified.last_modified = last_modified
+        not_modified.cache_expires(REVALIDATE[0], **REVALIDATE[1])
+        # When a long poll wasn't held (see `cnxpublishing.longpoll`).
+        retry_after = request.response.headers.get('Retry-After')
+        if retry_after is not None:
+            not_modified.headers['Retry-After'] = retry_after
+        raise not_modified
@@ -8,14 +8,90 @@
 from pyramid import httpexceptions
 from pyramid.view import view_config
 
-from ..db import poke_publication_state, db_connect
+from ..db import (
+    db_connect,
+    get_moderations_version,
+    poke_publication_state,
+)
+from .common import REVALIDATE, raise_if_not_modified
+
+
+#: Number of publications listed per page
+DEFAULT_PAGE_SIZE = 50
+
+
+def _get_moderations(request):
+    """Returns a page of the publications that need moderation, summarized,
+    and the id to list the next page after (or None on the last page).
+
+    """
+    try:
+        limit = int(request.params.get('limit', DEFAULT_PAGE_SIZE))
+        after = int(request.params.get('after', 0))
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest('invalid limit or after')
+    if limit < 1:
+        raise httpexceptions.HTTPBadRequest('invalid limit or after')
+
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            # One more than a page is selected,
+            # to know whether there is a next page.
+            cursor.execute("""\
+SELECT row_to_json(combined_rows) FROM (
+  SELECT p.id, p.created, p.publisher, p.publication_message,
+         count(pd.id) AS model_count,
+         coalesce(sum(octet_length(pd.content)), 0) AS size,
+         coalesce(json_agg(json_build_object(
+                     'id', pd.id, 'uuid', pd.uuid,
+                     'major_version', pd.major_version,
+                     'minor_version', pd.minor_version,
+                     'type', pd.type, 'title', pd.metadata->>'title',
+                     'size', octet_length(pd.content))
+                   ORDER BY pd.id) FILTER (WHERE pd.id IS NOT NULL),
+                  '[]') AS models
+  FROM publications AS p
+    LEFT JOIN pending_documents AS pd ON (pd.publication_id = p.id)
+  WHERE p.state = 'Waiting for moderation' AND p.id > %s
+  GROUP BY p.id
+  ORDER BY p.id
+  LIMIT %s) AS combined_rows""", (after, limit + 1,))
+            moderations = [x[0] for x in cursor.fetchall()]
+
+    next_after = None
+    if len(moderations) > limit:
+        moderations = moderations[:limit]
+        next_after = moderations[-1]['id']
+    return moderations, next_after
 
 
 @view_config(route_name='moderation', request_method='GET',
              accept="application/json",
              renderer='json', permission='moderate', http_cache=0)
 def get_moderation(request):
-    """Return the list of publications that need moderation."""
+    """Return a page of the list of publications that need moderation,
+    with a summary of their documents (see `get_moderation_detail`).
+    The next page, if any, is linked to in the ``Link`` header.
+
+    """
+    moderations, next_after = _get_moderations(request)
+    if next_after is not None:
+        request.response.headers['Link'] = '<{}>; rel="next"'.format(
+            request.route_url('moderation', _query=[
+                ('limit', request.params.get('limit', DEFAULT_PAGE_SIZE)),
+                ('after', next_after)]))
+    return moderations
+
+
+@view_config(route_name='moderate', request_method='GET',
+             accept="application/json",
+             renderer='json', permission='moderate', http_cache=0)
+def get_moderation_detail(request):
+    """Return a publication that needs moderation with its documents."""
+    try:
+        publication_id = int(request.matchdict['id'])
+    except ValueError:
+        raise httpexceptions.HTTPNotFound()
     with db_connect() as db_conn:
         with db_conn.cursor() as cursor:
             cursor.execute("""\
@@ -25,10 +101,12 @@ SELECT row_to_json(combined_rows) FROM (
           from pending_documents as pd
           where pd.publication_id = p.id) AS models
   FROM publications AS p
-  WHERE state = 'Waiting for moderation') AS combined_rows""")
-            moderations = [x[0] for x in cursor.fetchall()]
-
-    return moderations
+  WHERE state = 'Waiting for moderation' AND id = %s) AS combined_rows""",
+                           (publication_id,))
+            row = cursor.fetchone()
+    if row is None:
+        raise httpexceptions.HTTPNotFound()
+    return row[0]
 
 
 @view_config(route_name='moderate', request_method='POST',
@@ -70,9 +148,20 @@ WHERE id = %s""", (publication_id,))
 
 @view_config(route_name='admin-moderation', request_method='GET',
              renderer="cnxpublishing.views:templates/moderations.html",
-             permission='moderate', http_cache=0)
+             permission='moderate', http_cache=REVALIDATE)
 @view_config(route_name='moderation-rss', request_method='GET',
              renderer="cnxpublishing.views:templates/moderations.rss",
-             permission='view', http_cache=0)
+             permission='view', http_cache=REVALIDATE)
 def admin_moderations(request):  # pragma: no cover
-    return {'moderations': get_moderation(request)}
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            etag, last_modified = get_moderations_version(cursor)
+    raise_if_not_modified(request, etag, last_modified)
+    moderations, next_after = _get_moderations(request)
+    next_link = None
+    if next_after is not None:
+        next_link = request.route_path(
+            request.matched_route.name,
+            _query=[('limit', request.params.get('limit', DEFAULT_PAGE_SIZE)),
+                    ('after', next_after)])
+    return {'moderations': moderations, 'next_link': next_link}
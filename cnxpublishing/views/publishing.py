@@ -16,10 +16,14 @@ from ..db import (
     accept_publication_role,
     add_publication,
     check_publication_state,
+    get_publication_version,
     poke_publication_state,
     db_connect,
 )
+from ..longpoll import PUBLICATION_STATE_CHANNEL, wait_for_change
+from ..outbox import enqueue_post_publication
 from ..utils import split_ident_hash
+from .common import REVALIDATE, is_not_modified, raise_if_not_modified
 
 
 @view_config(route_name='publications', request_method='POST', renderer='json',
@@ -58,10 +62,25 @@ def publish(request):
 
 
 @view_config(route_name='get-publication', request_method=['GET', 'HEAD'],
-             renderer='json', permission='view', http_cache=0)
+             renderer='json', permission='view', http_cache=REVALIDATE)
 def get_publication(request):
-    """Lookup publication state"""
+    """Lookup publication state. With a ``wait`` parameter, a request whose
+    copy is current (see `is_not_modified`) waits up to that many seconds
+    for the publication to change.
+
+    """
     publication_id = request.matchdict['id']
+
+    def get_version():
+        with db_connect() as db_conn:
+            with db_conn.cursor() as cursor:
+                return get_publication_version(cursor, publication_id)
+
+    version = wait_for_change(
+        request, PUBLICATION_STATE_CHANNEL, publication_id, get_version,
+        lambda version: is_not_modified(request, *version))
+    if version is not None:
+        raise_if_not_modified(request, *version)
     state, messages = check_publication_state(publication_id)
     response_data = {
         'publication': publication_id,
@@ -262,12 +281,7 @@ WHERE ident_hash(uuid, major_version, minor_version) = %s
                     '{} is not a book'.format(ident_hash))
 
             if stateid == 5:
-                cursor.execute("""\
-SELECT pg_notify('post_publication',
-'{"module_ident": '||%s||',
-  "ident_hash": "'||%s||'",
-  "timestamp": "'||CURRENT_TIMESTAMP||'"}')
-""", (module_ident, ident_hash))
+                enqueue_post_publication(cursor, module_ident, ident_hash)
             else:
                 cursor.execute("""\
 UPDATE modules SET stateid = 5
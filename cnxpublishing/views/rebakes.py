@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+from pyramid import httpexceptions
+from pyramid.view import view_config
+
+from ..db import db_connect
+from .. import rebake
+
+
+def _get_int(posted, name, default):
+    value = posted.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, long)) \
+       or value < 1:
+        raise httpexceptions.HTTPBadRequest(
+            "Invalid '{}' value, a positive integer is required."
+            .format(name))
+    return value
+
+
+@view_config(route_name='rebakes', request_method='POST',
+             accept="application/json",
+             renderer='json', permission='publish', http_cache=0)
+def post_rebake(request):
+    """Start rebaking the latest versions of the books using a print style
+    (given as 'print_style') or a list of books (given as 'uuids').
+
+    """
+    try:
+        posted = request.json
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest('Invalid JSON')
+    print_style = posted.get('print_style')
+    uuids = posted.get('uuids')
+    if not print_style and not uuids:
+        raise httpexceptions.HTTPBadRequest(
+            "Either 'print_style' or 'uuids' is required.")
+    settings = request.registry.settings
+    batch_size = _get_int(posted, 'batch_size',
+                          int(settings.get('baking.rebake.batch_size',
+                                           rebake.DEFAULT_BATCH_SIZE)))
+    concurrency = _get_int(posted, 'concurrency',
+                           int(settings.get('baking.rebake.concurrency',
+                                            rebake.DEFAULT_CONCURRENCY)))
+
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            try:
+                run_id = rebake.create_rebake_run(
+                    cursor, print_style=print_style or None, uuids=uuids,
+                    batch_size=batch_size, concurrency=concurrency,
+                    submitter=request.unauthenticated_userid)
+            except ValueError as exc:
+                raise httpexceptions.HTTPBadRequest(exc.message)
+            progress = rebake.get_rebake_run_progress(cursor, run_id)
+
+    request.response.status = 202
+    request.response.headers['Location'] = request.route_path(
+        'rebake', id=run_id)
+    return progress
+
+
+@view_config(route_name='rebake', request_method='GET',
+             accept="application/json",
+             renderer='json', permission='view', http_cache=0)
+def get_rebake(request):
+    """Return the progress of a rebake run."""
+    try:
+        run_id = int(request.matchdict['id'])
+    except ValueError:
+        raise httpexceptions.HTTPNotFound()
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            progress = rebake.get_rebake_run_progress(cursor, run_id)
+    if progress is None:
+        raise httpexceptions.HTTPNotFound()
+    return progress
+
+
+@view_config(route_name='rebake', request_method='DELETE',
+             accept="application/json",
+             renderer='json', permission='publish', http_cache=0)
+def delete_rebake(request):
+    """Cancel a rebake run. Books already set to bake are left to finish."""
+    try:
+        run_id = int(request.matchdict['id'])
+    except ValueError:
+        raise httpexceptions.HTTPNotFound()
+    with db_connect() as db_conn:
+        with db_conn.cursor() as cursor:
+            progress = rebake.get_rebake_run_progress(cursor, run_id)
+            if progress is None:
+                raise httpexceptions.HTTPNotFound()
+            rebake.cancel_rebake_run(cursor, run_id)
+            progress = rebake.get_rebake_run_progress(cursor, run_id)
+    return progress
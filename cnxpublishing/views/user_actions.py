@@ -16,6 +16,7 @@ from ..exceptions import (
 )
 from ..db import (
     db_connect,
+    get_document_controls_version,
     remove_acl,
     remove_license_requests,
     remove_role_requests,
@@ -24,11 +25,13 @@ from ..db import (
     upsert_role_requests,
     upsert_users,
 )
+from .common import REVALIDATE, raise_if_not_modified
 
 
 @view_config(route_name='license-request',
              request_method='GET',
-             accept='application/json', renderer='json', http_cache=0)
+             accept='application/json', renderer='json',
+             http_cache=REVALIDATE)
 def get_license_request(request):
     """Returns a list of those accepting the license."""
     uuid_ = request.matchdict['uuid']
@@ -43,6 +46,9 @@ def get_license_request(request):
 
     with db_connect() as db_conn:
         with db_conn.cursor() as cursor:
+            version = get_document_controls_version(cursor, uuid_)
+            if version is not None:
+                raise_if_not_modified(request, *version)
             cursor.execute("""\
 SELECT l.url
 FROM licenses AS l
@@ -139,7 +145,8 @@ def delete_license_request(request):
 
 @view_config(route_name='roles-request',
              request_method='GET',
-             accept='application/json', renderer='json', http_cache=0)
+             accept='application/json', renderer='json',
+             http_cache=REVALIDATE)
 def get_roles_request(request):
     """Returns a list of accepting roles."""
     uuid_ = request.matchdict['uuid']
@@ -154,6 +161,9 @@ def get_roles_request(request):
 
     with db_connect() as db_conn:
         with db_conn.cursor() as cursor:
+            version = get_document_controls_version(cursor, uuid_)
+            if version is not None:
+                raise_if_not_modified(request, *version)
             cursor.execute("""\
 SELECT row_to_json(combined_rows) FROM (
 SELECT uuid, user_id AS uid, role_type AS role, accepted AS has_accepted
@@ -231,13 +241,17 @@ def delete_roles_request(request):
 
 @view_config(route_name='acl-request',
              request_method='GET',
-             accept='application/json', renderer='json', http_cache=0)
+             accept='application/json', renderer='json',
+             http_cache=REVALIDATE)
 def get_acl(request):
     """Returns the ACL for the given content identified by ``uuid``."""
     uuid_ = request.matchdict['uuid']
 
     with db_connect() as db_conn:
         with db_conn.cursor() as cursor:
+            version = get_document_controls_version(cursor, uuid_)
+            if version is not None:
+                raise_if_not_modified(request, *version)
             cursor.execute("""\
 SELECT TRUE FROM document_controls WHERE uuid = %s""", (uuid_,))
             try:
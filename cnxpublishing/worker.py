@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# ###
+# Copyright (c) 2019, Rice University
+# This software is subject to the provisions of the GNU Affero General
+# Public License version 3 (AGPLv3).
+# See LICENCE.txt for details.
+# ###
+"""\
+Provides the baking worker mode of the Celery worker
+(see `cnxpublishing.scripts.baking_worker`).
+
+In this mode the heavy modules used to bake are imported before the worker
+process pool is forked, so the processes share them. Each process prepares
+the Pyramid environment once, keeps its database connections open and
+caches the recipes. A process is replaced after ``baking.worker.max_bakes``
+tasks or once its memory use is over ``baking.worker.max_rss`` kilobytes,
+which returns the memory fragmented by baking large books. A process that
+stopped a bake for using more than ``baking.memory.max_rss`` kilobytes is
+also replaced, so the retry of the bake doesn't run in it.
+
+"""
+from __future__ import absolute_import
+
+import importlib
+import logging
+
+from celery import signals
+from pyramid.scripting import prepare
+
+from . import bake, db
+from .config import CONNECTION_STRING
+
+
+logger = logging.getLogger('cnxpublishing')
+
+#: Modules imported before the worker processes are forked
+PREWARM_MODULES = (
+    'cnxarchive.scripts.export_epub',
+    'cnxeasybake',
+    'cnxepub.collation',
+    'cnxepub.formatters',
+    'lxml.etree',
+    'lxml.html',
+)
+#: Identifies the signal handlers of the baking worker
+DISPATCH_UID = 'cnxpublishing.worker'
+#: Number of tasks a worker process runs before it is replaced
+DEFAULT_MAX_BAKES = 50
+#: Memory (in kilobytes) a worker process may use before it is replaced,
+#: 0 is unlimited
+DEFAULT_MAX_RSS = 0
+#: Number of recipes cached by a worker process
+DEFAULT_RECIPE_CACHE_SIZE = 32
+
+
+def prewarm(modules=PREWARM_MODULES):
+    """Import the ``modules``, so that it is done once before forking."""
+    for name in modules:
+        importlib.import_module(name)
+
+
+def configure_baking_worker(celery_app, registry):
+    """Set up ``celery_app`` to run as a baking worker."""
+    settings = registry.settings
+    max_rss = [rss for rss in (
+        int(settings.get('baking.worker.max_rss', DEFAULT_MAX_RSS)),
+        int(settings.get('baking.memory.max_rss', bake.DEFAULT_MAX_RSS)),
+    ) if rss]
+    celery_app.conf.update(
+        worker_max_tasks_per_child=int(settings.get(
+            'baking.worker.max_bakes', DEFAULT_MAX_BAKES)) or None,
+        worker_max_memory_per_child=max_rss and min(max_rss) or None,
+    )
+
+    def on_worker_init(**kwargs):
+        prewarm()
+        logger.info('Baking worker prewarmed {} modules'
+                    .format(len(PREWARM_MODULES)))
+
+    def on_worker_process_init(**kwargs):
+        # The environment is kept for the life of the process.
+        prepare(registry=registry)
+        celery_app.conf['pyramid_prepared'] = True
+        db.init_process_db_pool(settings[CONNECTION_STRING])
+        bake.enable_recipe_cache(int(settings.get(
+            'baking.worker.recipe_cache_size', DEFAULT_RECIPE_CACHE_SIZE)))
+
+    def on_worker_process_shutdown(**kwargs):
+        db.close_process_db_pool()
+
+    # Strong references, because the handlers are local functions.
+    signals.worker_init.connect(on_worker_init, weak=False,
+                                dispatch_uid=DISPATCH_UID)
+    signals.worker_process_init.connect(on_worker_process_init, weak=False,
+                                        dispatch_uid=DISPATCH_UID)
+    signals.worker_process_shutdown.connect(on_worker_process_shutdown,
+                                            weak=False,
+                                            dispatch_uid=DISPATCH_UID)
+    return celery_app
+
+
+__all__ = (
+    'configure_baking_worker',
+    'prewarm',
+)
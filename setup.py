@@ -63,6 +63,13 @@ setup(
     [console_scripts]
     cnx-publishing-channel-processing = \
         cnxpublishing.scripts.channel_processing:main
+    cnx-publishing-rebake = cnxpublishing.scripts.rebake:main
+    cnx-publishing-baking-worker = \
+        cnxpublishing.scripts.baking_worker:main
+    cnx-publishing-collect-orphans = \
+        cnxpublishing.scripts.collect_orphans:main
+    cnx-publishing-rebuild-print-style-stats = \
+        cnxpublishing.scripts.rebuild_print_style_stats:main
     [dbmigrator]
     migrations_directory = cnxpublishing.main:find_migrations_directory
     """,